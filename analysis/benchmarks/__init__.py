@@ -0,0 +1,7 @@
+import os
+import sys
+
+# asv installs the modules of the benchmarked commit into its environment; when the benchmarks run in an existing
+# environment, e.g. with `asv run --python=same`, the modules of the working tree are used
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data-model"))
@@ -0,0 +1,132 @@
+import numpy as np
+
+from plot_decimation import decimate
+from pxrd_batch import PXRDBatch, normalize_batch, remove_baseline_batch, subtract_blanks
+from pxrd_composition import ReferenceBasis
+from pxrd_grid import GridResampler
+from pxrd_lazy import subtract_and_normalize
+from pxrd_pipeline import normalize, remove_baseline, solve_composition, subtract_blank
+from pxrd_reader import parse_xyd
+
+from .common import GRID, SCALES, contents, mixtures, real_blank, synthetic_intensity
+
+# The batch implementations process all patterns as one matrix, the per pattern implementations are the
+# functions the notebook calls for every sample; those are only measured up to PER_PATTERN_LIMIT patterns
+IMPLEMENTATIONS = ["batch", "per pattern"]
+PER_PATTERN_LIMIT = 1000
+
+# The width of a notebook plot in pixels
+PLOT_WIDTH = 800
+
+
+class Scaled:
+    params = [SCALES, IMPLEMENTATIONS]
+    param_names = ["patterns", "implementation"]
+    timeout = 600
+
+    def setup(self, n, implementation):
+        if implementation == "per pattern" and n > PER_PATTERN_LIMIT:
+            raise NotImplementedError
+        self.batch = PXRDBatch(GRID.angle, synthetic_intensity(n))
+        if implementation == "per pattern":
+            self.patterns = [self.batch.pattern(row) for row in range(n)]
+
+
+class Parse:
+    params = SCALES
+    param_names = ["patterns"]
+    timeout = 600
+
+    def setup(self, n):
+        self.contents = contents(n)
+        self.patterns = [parse_xyd(content) for content in self.contents]
+        self.resampler = GridResampler(GRID)
+
+    def time_parse_xyd(self, n):
+        for content in self.contents:
+            parse_xyd(content)
+
+    def time_resample(self, n):
+        self.resampler.resample_many(self.patterns)
+
+
+class BlankSubtraction(Scaled):
+    def setup(self, n, implementation):
+        super().setup(n, implementation)
+        self.blank = np.column_stack([GRID.angle, real_blank()])
+
+    def time_subtract_blank(self, n, implementation):
+        if implementation == "batch":
+            subtract_blanks(self.batch, np.broadcast_to(self.blank[:, 1], self.batch.intensity.shape))
+        else:
+            for pattern in self.patterns:
+                subtract_blank(pattern, self.blank)
+
+
+class Normalization(Scaled):
+    def time_normalize(self, n, implementation):
+        if implementation == "batch":
+            normalize_batch(self.batch, np.tile([38.0, 40.0], (n, 1)))
+        else:
+            for pattern in self.patterns:
+                normalize(pattern, (38.0, 40.0))
+
+
+class BlankNormalizationPlan:
+    params = SCALES
+    param_names = ["patterns"]
+    timeout = 600
+
+    def setup(self, n):
+        self.batch = PXRDBatch(GRID.angle, synthetic_intensity(n))
+        self.blank = real_blank()[np.newaxis]
+        self.windows = np.tile([38.0, 40.0], (n, 1))
+
+    def time_subtract_and_normalize(self, n):
+        # the lazy plan of PXRDPipeline.process_batch, collected once with the streaming engine
+        subtract_and_normalize(self.batch, self.blank, np.zeros(n, dtype=int), self.windows)
+
+
+class SNIPBaseline(Scaled):
+    def time_remove_baseline(self, n, implementation):
+        if implementation == "batch":
+            remove_baseline_batch(self.batch, max_half_window=40, smooth_half_window=3)
+        else:
+            for pattern in self.patterns:
+                remove_baseline(pattern, max_half_window=40, smooth_half_window=3)
+
+
+class Composition(Scaled):
+    def setup(self, n, implementation):
+        if implementation == "per pattern" and n > PER_PATTERN_LIMIT:
+            raise NotImplementedError
+        self.references, self.samples = mixtures(n)
+        self.names = [f"phase {i}" for i in range(len(self.references))]
+        self.phases = {
+            name: np.column_stack([GRID.angle, reference]) for name, reference in zip(self.names, self.references)
+        }
+
+    def time_solve(self, n, implementation):
+        if implementation == "batch":
+            # a new basis every time, so the factorization is part of the measurement
+            ReferenceBasis(self.names, self.references).solve(self.samples)
+        else:
+            for sample in self.samples:
+                solve_composition(np.column_stack([GRID.angle, sample]), self.phases)
+
+
+class PlotPreparation:
+    params = [SCALES, ["minmax", "lttb"]]
+    param_names = ["patterns", "method"]
+    timeout = 600
+
+    def setup(self, n, method):
+        # LTTB walks the buckets of every pattern in Python, at 10,000 patterns it takes minutes
+        if method == "lttb" and n > PER_PATTERN_LIMIT:
+            raise NotImplementedError
+        self.intensity = synthetic_intensity(n)
+
+    def time_decimate(self, n, method):
+        for intensity in self.intensity:
+            decimate(GRID.angle, intensity, PLOT_WIDTH, method)
+
@@ -0,0 +1,122 @@
+import functools
+import os
+
+import numpy as np
+
+from pxrd_batch import PXRDBatch, normalize_batch, remove_baseline_batch
+from pxrd_grid import AngleGrid, GridResampler
+from pxrd_reader import parse_xyd
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+PXRD_DIR = os.path.join(BENCHMARK_DIR, "..", "..", "data", "PXRD")
+
+# The numbers of patterns every stage is measured at
+SCALES = [1, 10, 100, 1000, 10000]
+
+# The grid of the notebook
+GRID = AngleGrid(start=0.9, stop=80.0, step=0.015)
+
+# The part of the grid covered by all benchmark patterns, the usual measured range of the Cu samples
+GRID_RANGE = slice(*np.searchsorted(GRID.angle, [1.6, 39.9]))
+
+
+@functools.cache
+def real_contents() -> list[bytes]:
+    """
+    Returns the contents of the Cu sample files in data/PXRD, sorted by file name.
+    """
+    file_names = sorted(
+        file_name for file_name in os.listdir(PXRD_DIR)
+        if file_name.endswith(".xyd") and "_Cu-" in file_name and not file_name.startswith("PXRD_Blank_")
+    )
+    contents = []
+    for file_name in file_names:
+        with open(os.path.join(PXRD_DIR, file_name), "rb") as f:
+            contents.append(f.read())
+    return contents
+
+
+@functools.cache
+def real_blank() -> np.ndarray:
+    """
+    Returns the resampled intensities of the Cu capillary blank of data/PXRD.
+    """
+    with open(os.path.join(PXRD_DIR, "PXRD_Blank_Cu-Ka1_capillary-1mm_3s-deg.xyd"), "rb") as f:
+        return GridResampler(GRID).resample(parse_xyd(f.read()))[:, 1]
+
+
+@functools.cache
+def real_intensity() -> np.ndarray:
+    """
+    Returns the resampled intensities of the real Cu samples that cover the whole grid used by the benchmarks,
+    of shape (N, M).
+    """
+    resampled = GridResampler(GRID).resample_many([parse_xyd(content) for content in real_contents()])
+    return resampled[np.isfinite(resampled[:, GRID_RANGE]).all(axis=1)]
+
+
+@functools.cache
+def synthetic_intensity(n: int, seed: int = 0) -> np.ndarray:
+    """
+    Builds n patterns from the real samples: every pattern is a real sample, scaled, shifted by a few grid points
+    and with new counting noise, so repeated samples are not identical. The patterns cover the benchmark range of
+    the grid, outside it they are NaN like resampled patterns.
+
+    Args:
+        n (int): The number of patterns.
+        seed (int): The seed of the variations.
+
+    Returns:
+        np.ndarray: The intensities of shape (n, M).
+    """
+    rng = np.random.default_rng(seed)
+    real = real_intensity()
+    intensity = np.full((n, len(GRID.angle)), np.nan)
+    for i in range(n):
+        source = real[i % len(real), GRID_RANGE]
+        expected = np.clip(np.roll(source, rng.integers(-5, 6)) * rng.uniform(0.5, 2.0), 0, None)
+        # about 200 s effective counting time per point, as estimated from the noise of the real samples
+        intensity[i, GRID_RANGE] = rng.poisson(expected * 200) / 200
+    return intensity
+
+
+@functools.cache
+def corrected_real() -> np.ndarray:
+    """
+    Returns the real samples normalized to the Cu window and without their SNIP baseline, of shape (N, M).
+    """
+    real = real_intensity()
+    normalized = normalize_batch(PXRDBatch(GRID.angle, real), np.tile([38.0, 40.0], (len(real), 1)))
+    return remove_baseline_batch(normalized).intensity
+
+
+@functools.cache
+def mixtures(n: int, k: int = 4, seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Builds n corrected samples as random mixtures of k corrected real patterns used as references, plus one of the
+    other real patterns as an unknown phase and noise.
+
+    Args:
+        n (int): The number of samples.
+        k (int): The number of references.
+        seed (int): The seed of the mixtures.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The references of shape (k, M) and the samples of shape (n, M).
+    """
+    rng = np.random.default_rng(seed)
+    real = corrected_real()
+    references, others = real[:k], real[k:]
+    # a third of the phases is missing from every sample, so the fit has to find the active phases
+    weights = rng.uniform(0, 1, (n, k)) * (rng.uniform(0, 1, (n, k)) > 1 / 3)
+    unknown = others[rng.integers(0, len(others), n)] * rng.uniform(0, 0.5, (n, 1))
+    noise = rng.normal(0, 0.01, (n, real.shape[1]))
+    return references, weights @ references + unknown + noise
+
+
+def contents(n: int) -> list[bytes]:
+    """
+    Returns the contents of n files, the real files repeated as needed.
+    """
+    real = real_contents()
+    return [real[i % len(real)] for i in range(n)]
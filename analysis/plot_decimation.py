@@ -0,0 +1,129 @@
+import numpy as np
+
+
+def _finite(x: np.ndarray, y: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    valid = np.isfinite(x) & np.isfinite(y)
+    return x[valid], y[valid]
+
+
+def minmax_decimate(x: np.ndarray, y: np.ndarray, n_buckets: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Downsamples a line to the minimum and the maximum of every bucket, in their original order. With one bucket per
+    pixel column the drawn line looks exactly like the full line, every peak keeps its height.
+
+    Args:
+        x (np.ndarray): The x values in ascending order, e.g. the angles.
+        y (np.ndarray): The y values, e.g. the intensities. NaN values are dropped.
+        n_buckets (int): The number of buckets, e.g. the width of the axes in pixels.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: At most 2 * n_buckets points of the line.
+    """
+    x, y = _finite(x, y)
+    if len(x) <= 2 * n_buckets:
+        return x, y
+    bucket = np.minimum((np.arange(len(x)) * n_buckets) // len(x), n_buckets - 1)
+    # sorted by bucket and then by y, the first point of a bucket is its minimum and the last one its maximum
+    order = np.lexsort((y, bucket))
+    starts = np.searchsorted(bucket[order], np.arange(n_buckets))
+    ends = np.append(starts[1:], len(x)) - 1
+    keep = np.unique(np.concatenate([order[starts], order[ends]]))
+    return x[keep], y[keep]
+
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Downsamples a line with Largest-Triangle-Three-Buckets: from every bucket the point spanning the largest triangle
+    with the point kept before and the mean of the next bucket is kept. The shape of the line, including its peaks,
+    is preserved with fewer points than min/max decimation.
+
+    Args:
+        x (np.ndarray): The x values in ascending order, e.g. the angles.
+        y (np.ndarray): The y values, e.g. the intensities. NaN values are dropped.
+        n_out (int): The number of points to keep, at least 3.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: n_out points of the line, including the first and the last point.
+    """
+    x, y = _finite(x, y)
+    if len(x) <= n_out or n_out < 3:
+        return x, y
+    # the first and the last point are kept, the points in between are split into n_out - 2 buckets
+    edges = np.linspace(1, len(x) - 1, n_out - 1).astype(int)
+    keep = np.empty(n_out, dtype=int)
+    keep[0], keep[-1] = 0, len(x) - 1
+    for i in range(n_out - 2):
+        start, stop = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_x, next_y = x[stop:edges[i + 2]].mean(), y[stop:edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        previous_x, previous_y = x[keep[i]], y[keep[i]]
+        area = np.abs(
+            (previous_x - next_x) * (y[start:stop] - previous_y) - (previous_x - x[start:stop]) * (next_y - previous_y)
+        )
+        keep[i + 1] = start + np.argmax(area)
+    return x[keep], y[keep]
+
+
+def decimate(x: np.ndarray, y: np.ndarray, width: int, method: str = "minmax") -> tuple[np.ndarray, np.ndarray]:
+    """
+    Downsamples a line for drawing it with the given width in pixels. NaN values split the line into runs, e.g.
+    around unmeasured angle ranges; every run gets its share of the width and the runs stay separated by NaN, so
+    the drawn line does not bridge the gaps.
+
+    Args:
+        x (np.ndarray): The x values in ascending order.
+        y (np.ndarray): The y values, NaN where nothing was measured.
+        width (int): The width of the axes in pixels.
+        method (str): "minmax" (two points per pixel column) or "lttb" (one point per pixel column).
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The points to draw.
+
+    Raises:
+        ValueError: If the method is unknown.
+    """
+    if method not in ("minmax", "lttb"):
+        raise ValueError(f"Unknown decimation method: {method}")
+
+    def decimate_run(run_x, run_y, run_width):
+        if method == "minmax":
+            return minmax_decimate(run_x, run_y, max(run_width, 1))
+        return lttb(run_x, run_y, max(run_width, 3))
+
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    valid = np.isfinite(x) & np.isfinite(y)
+    edges = np.flatnonzero(np.diff(valid.astype(np.int8), prepend=np.int8(0), append=np.int8(0)))
+    runs = list(zip(edges[::2], edges[1::2]))
+    if len(runs) <= 1:
+        return decimate_run(x, y, width)
+
+    span = x[valid][-1] - x[valid][0]
+    xs, ys = [], []
+    for start, stop in runs:
+        run_width = int(np.ceil(width * (x[stop - 1] - x[start]) / span)) if span > 0 else width
+        run_x, run_y = decimate_run(x[start:stop], y[start:stop], run_width)
+        xs += [run_x, [np.nan]]
+        ys += [run_y, [np.nan]]
+    return np.concatenate(xs[:-1]), np.concatenate(ys[:-1])
+
+
+def plot_decimated(ax, x: np.ndarray, y: np.ndarray, method: str = "minmax", **kwargs):
+    """
+    Plots a line on matplotlib axes, downsampled to the width of the axes in pixels, so drawing time depends on the
+    figure size instead of the number of points.
+
+    Args:
+        ax (matplotlib.axes.Axes): The axes.
+        x (np.ndarray): The x values in ascending order.
+        y (np.ndarray): The y values, NaN where nothing was measured, see decimate.
+        method (str): The decimation method, see decimate.
+        **kwargs: The keyword arguments of Axes.plot, e.g. label.
+
+    Returns:
+        list[matplotlib.lines.Line2D]: The plotted lines.
+    """
+    width = int(np.ceil(ax.get_window_extent().width))
+    return ax.plot(*decimate(x, y, width, method), **kwargs)
@@ -124,7 +124,53 @@ def _(
 
 
 @app.cell
-def _(baseline_correction, dataclass, io, normalization, np, pl):
+def _(mo, sys):
+    # the PXRD file handling is shared with the data model
+    sys.path.append(str(mo.notebook_dir().parent / "data-model"))
+    from pxrd_reader import XYDCache
+    from pxrd_pipeline import PXRDPipeline, StageCache, counting_statistics, counting_time
+    from pxrd_grid import AngleGrid, GridResampler
+    from xray_wavelength import convert_two_theta
+    from pxrd_composition import composition_table
+    from pxrd_similarity import SimilaritySearch
+    from plot_decimation import plot_decimated
+    from pxrd_matching import match_samples
+
+    _cache_dir = mo.notebook_dir() / ".cache"
+    # parsed patterns are cached as binary arrays, so each file is only parsed once
+    xyd_cache = XYDCache(str(_cache_dir / "xyd"))
+    # every stage result is cached under its inputs and parameters, the disk tier survives restarts
+    # all patterns are converted to Cu Kα1 angles and resampled onto one 2θ grid, so samples, blanks
+    # and pure components line up; the grid starts below 1.5° to keep the start of converted Co patterns
+    pipeline = PXRDPipeline(
+        xyd_cache,
+        StageCache(max_entries=1024, cache_dir=str(_cache_dir / "stages")),
+        GridResampler(AngleGrid(start=0.9, stop=80.0, step=0.015)),
+        target_source="Cu Kα1",
+        # the notebook reruns on every change, a few processes are enough for the selected samples
+        max_workers=2,
+    )
+    return (
+        SimilaritySearch,
+        composition_table,
+        convert_two_theta,
+        counting_statistics,
+        counting_time,
+        match_samples,
+        pipeline,
+        plot_decimated,
+    )
+
+
+@app.cell
+def _(
+    background_subtraction,
+    baseline_correction,
+    composition,
+    dataclass,
+    normalization,
+    pipeline,
+):
     @dataclass
     class PXRDMeasurement:
         filename: str
@@ -132,27 +178,17 @@ def _(baseline_correction, dataclass, io, normalization, np, pl):
         type: str | None = None
 
         @property
-        def data(self):
-            _ = pl.from_numpy(
-                np.loadtxt(io.StringIO(self.content.decode("utf-8"))),
-                schema=["angle", self.filename],
+        def loaded(self):
+            # Co patterns are converted to the 2θ angles of the target X-ray source once, the result is cached
+            return pipeline.resample(
+                pipeline.convert_wavelength(pipeline.load(self.content), self.type)
             )
-            if type == "Co-Kα1":
-                col_names = _.columns
-                _ = _.select(
-                    pl.col(_.columns[0]),
-                    (
-                        2
-                        * (
-                            1.540562
-                            / 1.788965
-                            * (np.pi / 180 * pl.col(_.columns[1]) / 2).sin()
-                        ).arcsin()
-                        * 180
-                        / np.pi
-                    ).alias(_.columns[1]),
-                )
-            return _
+
+        # the stage results are read-only arrays of shape (N, 2) with the angle and the intensity, shared with
+        # the pipeline cache, so the properties below neither copy nor convert them
+        @property
+        def data(self):
+            return self.loaded.value
 
         @classmethod
         def dict_from_marimo_file(cls, marimo_file):
@@ -166,15 +202,15 @@ def _(baseline_correction, dataclass, io, normalization, np, pl):
     class PureProduct(PXRDMeasurement):
         @property
         def background_subtraction(self):
-            return background_subtraction(self)
+            return background_subtraction(self).value
 
         @property
         def normalized(self):
-            return normalization(self)
+            return normalization(self).value
 
         @property
         def corrected(self):
-            return baseline_correction(self)
+            return baseline_correction(self).value
 
 
     class SampleProduct(PXRDMeasurement):
@@ -205,15 +241,15 @@ def _(baseline_correction, dataclass, io, normalization, np, pl):
 
         @property
         def background_subtraction(self):
-            return background_subtraction(self)
+            return background_subtraction(self).value
 
         @property
         def normalized(self):
-            return normalization(self)
+            return normalization(self).value
 
         @property
         def corrected(self):
-            return baseline_correction(self)
+            return baseline_correction(self).value
 
         @property
         def composition(self):
@@ -234,6 +270,7 @@ def _(
     PureProduct,
     any_file,
     jxdl_filtered,
+    match_samples,
     mo,
     ui_files_blank,
     ui_files_pure,
@@ -251,28 +288,21 @@ def _(
     blank_measurements = BlankMeasurement.dict_from_marimo_file(ui_files_blank)
     pure_products = PureProduct.dict_from_marimo_file(ui_files_pure)
     sample_products_empty = PXRDMeasurement.dict_from_marimo_file(ui_files_samples)
+    # the file names are parsed once, every sample is assigned by lookups of its X-ray source and sample holder
+    _matches, match_report = match_samples(
+        sample_products_empty, blank_measurements, pure_products, jxdl_filtered
+    )
     for _key, _val in sample_products_empty.items():
-        _jxdl_key = [_ for _ in jxdl_filtered.keys() if _ in _key][0]
-        _cu_co = [_ for _ in ["Cu", "Co"] if _ in _key]
-        _cu_co = _cu_co[0] if _cu_co else None
-        _blank = [
-            _
-            for _ in blank_measurements.keys()
-            if _.replace("PXRD_Blank_", "").replace(".xyd", "") in _key
-        ]
-        _blank = _blank[0] if _blank else None
-        _pure = [
-            _
-            for _ in pure_products.keys()
-            if _blank.replace("PXRD_Blank_", "").replace(".xyd", "") in _
-        ]
+        _match = _matches[_key]
         _val.ui = {
-            "Cu": mo.ui.dropdown(["Cu", "Co"], value=_cu_co),
-            "blank": mo.ui.dropdown(blank_measurements, value=_blank),
-            "pure": mo.ui.multiselect(pure_products, value=_pure),
-            "jxdl_entry": mo.ui.dropdown(jxdl_filtered, value=_jxdl_key),
+            "Cu": mo.ui.dropdown(
+                ["Cu", "Co"], value=_match.xray_source if _match.xray_source in ("Cu", "Co") else None
+            ),
+            "blank": mo.ui.dropdown(blank_measurements, value=_match.blank),
+            "pure": mo.ui.multiselect(pure_products, value=_match.pure),
+            "jxdl_entry": mo.ui.dropdown(jxdl_filtered, value=_match.jxdl),
         }
-    return (sample_products_empty,)
+    return match_report, sample_products_empty
 
 
 @app.cell
@@ -290,6 +320,17 @@ def _(jxdl):
     return (jxdl_filtered,)
 
 
+@app.cell
+def _(match_report, mo):
+    mo.md(
+        "/// warning | **Not all files could be assigned automatically**\n"
+        "Please assign them in the table below.\n\n"
+        f"{match_report}\n"
+        "///"
+    ) if match_report else None
+    return
+
+
 @app.cell
 def _(mo, sample_products_empty):
     ui_selected_samples = mo.ui.table(
@@ -312,7 +353,15 @@ def _(mo, sample_products_empty):
 
 
 @app.cell
-def _(SampleProduct, mo, sample_products_empty, ui_selected_samples):
+def _(
+    SampleProduct,
+    baseline_parameters,
+    mo,
+    normalization_window,
+    pipeline,
+    sample_products_empty,
+    ui_selected_samples,
+):
     mo.stop(
         not ui_selected_samples.value,
         output=mo.md(
@@ -339,6 +388,24 @@ def _(SampleProduct, mo, sample_products_empty, ui_selected_samples):
                 # _old_sample.
             )
         }
+
+    # process all selected samples and their pure components as one batch, the stage functions
+    # below then only look up the cached results
+    _measurements = list(sample_products.values()) + list(
+        {id(_pure): _pure for _val in sample_products.values() for _pure in _val.pure_products}.values()
+    )
+    pipeline.process_batch(
+        [
+            (
+                _measurement.loaded,
+                _measurement.blank_measurement.loaded if _measurement.blank_measurement else None,
+                normalization_window(_measurement),
+            )
+            for _measurement in _measurements
+            if normalization_window(_measurement) is not None
+        ],
+        **baseline_parameters,
+    )
     return (sample_products,)
 
 
@@ -354,28 +421,13 @@ def _(mo):
 
 
 @app.cell
-def _(pl):
+def _(pipeline):
     def background_subtraction(sample):
-        return (
-            (
-                sample.data.join(
-                    sample.blank_measurement.data, on="angle", how="inner", coalesce=True
-                )
-                .with_columns(
-                    [
-                        (pl.col(_key) - pl.col(sample.blank_measurement.filename)).alias(
-                            _key
-                        )
-                        for _key in sample.data.columns
-                        if _key != "angle"
-                    ]
-                )
-                .drop(sample.blank_measurement.filename)
-            )
-            if sample.blank_measurement
-            else sample.data
+        return pipeline.subtract_blank(
+            sample.loaded,
+            sample.blank_measurement.loaded if sample.blank_measurement else None,
         )
-    return
+    return (background_subtraction,)
 
 
 @app.cell
@@ -387,17 +439,26 @@ def _(mo, sample_products):
 
 
 @app.cell
-def _(mo, plt, sample_selected_for_plot):
+def _(background_subtraction, normalization, normalization_window, sample_selected_for_plot):
+    # the plots show the stage results the pipeline computed and cached for the corrections
+    plot_stages = {
+        _val.filename: {
+            "loaded": _val.loaded.value,
+            "subtracted": background_subtraction(_val).value,
+            "normalized": normalization(_val).value if normalization_window(_val) is not None else None,
+        }
+        for _val in sample_selected_for_plot.value
+    }
+    return (plot_stages,)
+
+
+@app.cell
+def _(mo, plot_decimated, plot_stages, plt, sample_selected_for_plot):
     _fig, _ax = plt.subplots(1, 2, figsize=(12, 5))
     for _val in sample_selected_for_plot.value:
-        _ax[0].plot(
-            _val.data.to_numpy()[:, 0],
-            _val.data.to_numpy()[:, 1],
-        )
-        _ax[1].plot(
-            _val.background_subtraction.to_numpy()[:, 0],
-            _val.background_subtraction.to_numpy()[:, 1],
-        )
+        _stages = plot_stages[_val.filename]
+        plot_decimated(_ax[0], _stages["loaded"][:, 0], _stages["loaded"][:, 1])
+        plot_decimated(_ax[1], _stages["subtracted"][:, 0], _stages["subtracted"][:, 1])
     _ax[0].set_title("Before")
     _ax[1].set_title("After")
     for _ax_ in _ax:
@@ -455,51 +516,43 @@ def _(mo, ui_normalization_co_reset):
 
 @app.cell
 def _(
-    pl,
+    background_subtraction,
+    convert_two_theta,
+    pipeline,
     ui_normalization_co_range_end,
     ui_normalization_co_range_start,
     ui_normalization_cu_range_end,
     ui_normalization_cu_range_start,
 ):
-    def normalization(sample):
-        _data = sample.background_subtraction
-
-        _norm = None
+    def normalization_window(sample):
         if sample.type == "Cu":
-            _norm = [
+            return [
                 ui_normalization_cu_range_start.value,
                 ui_normalization_cu_range_end.value,
             ]
         elif sample.type == "Co":
-            _norm = [
-                ui_normalization_co_range_start.value,
-                ui_normalization_co_range_end.value,
-            ]
+            # the window is given in Co angles, the converted patterns are in angles of the target source
+            return convert_two_theta(
+                [ui_normalization_co_range_start.value, ui_normalization_co_range_end.value],
+                "Co",
+                pipeline.target_source,
+            ).tolist()
+        return None
 
-        return _data.with_columns(
-            [
-                (
-                    pl.col(_key)
-                    / pl.col(_key)
-                    .filter(pl.col("angle").is_between(_norm[0], _norm[1]))
-                    .mean()
-                ).alias(_key)
-                for _key in _data.columns
-                if _key != "angle"
-            ]
-        )
-    return (normalization,)
+
+    def normalization(sample):
+        return pipeline.normalize(background_subtraction(sample), normalization_window(sample))
+    return normalization, normalization_window
 
 
 @app.cell
-def _(mo, plt, sample_selected_for_plot):
+def _(mo, plot_decimated, plot_stages, plt, sample_selected_for_plot):
     _fig, _ax = plt.subplots(1, 2, figsize=(12, 5))
     for _val in sample_selected_for_plot.value:
-        _ax[0].plot(
-            _val.background_subtraction.to_numpy()[:, 0],
-            _val.background_subtraction.to_numpy()[:, 1],
-        )
-        _ax[1].plot(_val.normalized.to_numpy()[:, 0], _val.normalized.to_numpy()[:, 1])
+        _stages = plot_stages[_val.filename]
+        plot_decimated(_ax[0], _stages["subtracted"][:, 0], _stages["subtracted"][:, 1])
+        if _stages["normalized"] is not None:
+            plot_decimated(_ax[1], _stages["normalized"][:, 0], _stages["normalized"][:, 1])
     _ax[0].set_title("Before")
     _ax[1].set_title("After")
     for _ax_ in _ax:
@@ -518,53 +571,30 @@ def _(mo):
 
 
 @app.cell
-def _(Baseline, np):
+def _(normalization, pipeline):
     # baseline determination can be performed using diffrent algorithms and parameters
-    # if baselines do not fit your problem, try tweaking the parameters in baseline_fitter.snip
-    # or use a different algorithm from the pybaselines package
+    # if baselines do not fit your problem, try tweaking the SNIP parameters below
+    # or use a different algorithm from the pybaselines package in pxrd_pipeline.remove_baseline;
+    # pxrd_sweep.py scores a whole grid of parameters, algorithms and normalization windows in one batch run
 
 
-    def _baseline_determination(x, y):
-        _bool = np.isnan(y)
-        _y_org = y.copy()
-        y = y[~np.isnan(y)].copy()
-        baseline_fitter = Baseline(x_data=x[~_bool])
-        base, _ = baseline_fitter.snip(
-            y, max_half_window=40, decreasing=True, smooth_half_window=3
-        )
-        y_detrend = np.ones_like(x) * np.nan
-        y_detrend[~_bool] = y - base
-        return y_detrend
+    baseline_parameters = {"max_half_window": 40, "smooth_half_window": 3}
 
 
     def baseline_correction(sample):
-        _data = sample.normalized
-        return _data.with_columns(
-            **{
-                _key: _baseline_determination(
-                    _data["angle"].to_numpy(),
-                    _data[_key].to_numpy(),
-                )
-                for _key in _data.columns[1:]
-            }
-        )
-    return (baseline_correction,)
+        return pipeline.remove_baseline(normalization(sample), **baseline_parameters)
+    return baseline_correction, baseline_parameters
 
 
 @app.cell
-def _(mo, plt, sample_selected_for_plot):
+def _(mo, plot_decimated, plt, sample_selected_for_plot):
     _fig, _ax = plt.subplots(1, 2, figsize=(12, 5))
     for _val in sample_selected_for_plot.value:
-        _ax[0].plot(_val.normalized.to_numpy()[:, 0], _val.normalized.to_numpy()[:, 1])
+        _normalized, _corrected = _val.normalized, _val.corrected
+        plot_decimated(_ax[0], _normalized[:, 0], _normalized[:, 1])
         if len(sample_selected_for_plot.value) <= 1:
-            _ax[0].plot(
-                _val.corrected.to_numpy()[:, 0],
-                _val.normalized.to_numpy()[:, 1] - _val.corrected.to_numpy()[:, 1],
-            )
-        _ax[1].plot(
-            _val.corrected.to_numpy()[:, 0],
-            _val.corrected.to_numpy()[:, 1],
-        )
+            plot_decimated(_ax[0], _corrected[:, 0], _normalized[:, 1] - _corrected[:, 1])
+        plot_decimated(_ax[1], _corrected[:, 0], _corrected[:, 1])
     _ax[0].set_title("Before")
     _ax[1].set_title("After")
     for _ax_ in _ax:
@@ -575,6 +605,16 @@ def _(mo, plt, sample_selected_for_plot):
     return
 
 
+@app.cell
+def _(baseline_correction, mo, pipeline, sample_products):
+    # peaks of all corrected samples, cached next to the corrected patterns
+    peak_table = pipeline.peak_table(
+        {_key: baseline_correction(_val) for _key, _val in sample_products.items()}
+    )
+    mo.accordion({"Peak Table": mo.ui.table(peak_table, selection=None, page_size=50)})
+    return (peak_table,)
+
+
 @app.cell
 def _(mo):
     mo.md(r"""## 4. Analysis""")
@@ -688,66 +728,30 @@ def _():
 
 
 @app.cell
-def _(np):
-    from scipy.optimize import nnls as _nnls
-
-
+def _(baseline_correction, pipeline):
     def composition(sample):
-        phases = {_.filename: _.corrected.to_numpy().T[1] for _ in sample.pure_products}
-        phases_list = list(phases)
-        sample_corrected = sample.corrected.to_numpy().T[1]
-
-        min_len = min(
-            *([len(phase) for phase in phases.values()] + [len(sample_corrected)])
-        )
-
-        for key, phase in phases.items():
-            phases[key] = phase[:min_len]
-        sample_corrected = sample_corrected[:min_len]
-
-        A = np.vstack([phases[_] for _ in phases_list]).T
-        weights, _ = _nnls(A, sample_corrected)
-
-        weights = np.minimum(weights, 1)
-
-        friendly_name = []
-        for phase_name in phases_list:
-            if "MOCOF-1" in phase_name:
-                friendly_name.append("MOCOF-1")
-            elif "COF-366-Co" in phase_name:
-                friendly_name.append("COF-366-Co")
-            else:
-                friendly_name.append(phase_name)
-        return {key: weight for key, weight in zip(phases_list, weights)} | {
-            "unknown": 1 - np.sum(weights)
-        }
+        return pipeline.composition(
+            baseline_correction(sample),
+            {_.filename: baseline_correction(_) for _ in sample.pure_products},
+        ).value
     return (composition,)
 
 
 @app.cell
-def _(composition, mo, plt, sample_selected_for_plot):
+def _(composition, mo, plot_decimated, plt, sample_selected_for_plot):
     _fig, _ax = plt.subplots(1, 2, figsize=(12, 5))
     if len(sample_selected_for_plot.value) <= 1:
         for _val in sample_selected_for_plot.value:
-            for _pure in _val.pure_products:
-                _ax[0].plot(
-                    _pure.corrected.to_numpy()[:, 0],
-                    _pure.corrected.to_numpy()[:, 1],
-                    label=_pure.filename,
-                )
-            _ax[1].plot(
-                _val.corrected.to_numpy()[:, 0],
-                _val.corrected.to_numpy()[:, 1],
-                label="sample",
-            )
+            _pure_corrected = {_pure.filename: _pure.corrected for _pure in _val.pure_products}
+            for _name, _corrected in _pure_corrected.items():
+                plot_decimated(_ax[0], _corrected[:, 0], _corrected[:, 1], label=_name)
+            _corrected = _val.corrected
+            plot_decimated(_ax[1], _corrected[:, 0], _corrected[:, 1], label="sample")
+            _composition = _val.composition
             _sum = 0
-            for _pure in _val.pure_products:
-                _sum += _val.composition[_pure.filename] * _pure.corrected.to_numpy()[:, 1]
-            _ax[1].plot(
-                _val.pure_products[0].corrected.to_numpy()[:, 0],
-                _sum,
-                label="linear combination",
-            )
+            for _name, _pure_pattern in _pure_corrected.items():
+                _sum += _composition[_name] * _pure_pattern[:, 1]
+            plot_decimated(_ax[1], _corrected[:, 0], _sum, label="linear combination")
 
         _ax[0].set_title("Pure Components")
         _ax[0].legend()
@@ -771,9 +775,147 @@ def _(composition, mo, plt, sample_selected_for_plot):
     return
 
 
+@app.cell
+def _(baseline_correction, composition_table, mo, pipeline, sample_products):
+    # compositions of all selected samples, solved together against one factorized basis per phase set
+    _samples = {_key: _val for _key, _val in sample_products.items() if _val.pure_products}
+    compositions = pipeline.composition_batch(
+        {_key: baseline_correction(_val) for _key, _val in _samples.items()},
+        {
+            _key: {_pure.filename: baseline_correction(_pure) for _pure in _val.pure_products}
+            for _key, _val in _samples.items()
+        },
+    )
+    mo.ui.table(composition_table(compositions), selection=None, page_size=50)
+    return (compositions,)
+
+
+@app.cell
+def _(mo):
+    ui_bootstrap_resamples = mo.ui.number(start=10, stop=10000, step=10, value=200)
+    mo.md(
+        f"""
+        Confidence intervals of the compositions under counting noise, from {ui_bootstrap_resamples} resamples
+        per sample.
+        """
+    )
+    return (ui_bootstrap_resamples,)
+
+
+@app.cell
+def _(
+    baseline_correction,
+    counting_statistics,
+    counting_time,
+    mo,
+    normalization_window,
+    pipeline,
+    sample_products,
+    ui_bootstrap_resamples,
+):
+    # the counting time per point is estimated from the noise of every pattern as measured, before the conversion
+    # and resampling smooth it; the resamples keep the baseline fixed
+    _samples = {_key: _val for _key, _val in sample_products.items() if _val.pure_products}
+    mo.stop(not _samples)
+    _intervals = pipeline.composition_uncertainty(
+        {_key: baseline_correction(_val) for _key, _val in _samples.items()},
+        {
+            _key: {_pure.filename: baseline_correction(_pure) for _pure in _val.pure_products}
+            for _key, _val in _samples.items()
+        },
+        {
+            _key: counting_statistics(
+                _val.loaded.value,
+                _val.blank_measurement.loaded.value if _val.blank_measurement else None,
+                normalization_window(_val),
+                counting_time(pipeline.load(_val.content).value),
+                counting_time(pipeline.load(_val.blank_measurement.content).value)
+                if _val.blank_measurement
+                else None,
+            )
+            for _key, _val in _samples.items()
+        },
+        n_resamples=ui_bootstrap_resamples.value,
+    )
+    mo.ui.table(_intervals, selection=None, page_size=50)
+    return
+
+
+@app.cell
+def _(mo):
+    ui_screening_top_k = mo.ui.number(start=1, stop=50, step=1, value=3)
+    mo.md(
+        f"""
+        Screen the pure components of all selected samples as one reference library and fit every sample
+        against its {ui_screening_top_k} best matching references.
+        """
+    )
+    return (ui_screening_top_k,)
+
+
+@app.cell
+def _(
+    baseline_correction,
+    composition_table,
+    mo,
+    pipeline,
+    sample_products,
+    ui_screening_top_k,
+):
+    # references are ranked by normalized cross-correlation, only the top candidates are fitted
+    _library = {
+        _pure.filename: baseline_correction(_pure)
+        for _val in sample_products.values()
+        for _pure in _val.pure_products
+    }
+    mo.stop(not _library)
+    _compositions = pipeline.composition_screened(
+        {_key: baseline_correction(_val) for _key, _val in sample_products.items()},
+        _library,
+        top_k=ui_screening_top_k.value,
+    )
+    mo.ui.table(composition_table(_compositions), selection=None, page_size=50)
+    return
+
+
+@app.cell
+def _(mo):
+    mo.md(r"""### 4.2 Similar Patterns""")
+    return
+
+
+@app.cell
+def _(
+    SimilaritySearch,
+    baseline_correction,
+    mo,
+    sample_products,
+    sample_selected_for_plot,
+):
+    # the library of all corrected samples and pure components is normalized once, queries are one matrix product
+    _library = {_key: baseline_correction(_val).value for _key, _val in sample_products.items()} | {
+        _pure.filename: baseline_correction(_pure).value
+        for _val in sample_products.values()
+        for _pure in _val.pure_products
+    }
+    similarity_search = SimilaritySearch.from_patterns(_library, metric="pearson")
+    mo.vstack(
+        [sample_selected_for_plot]
+        + [
+            mo.ui.table(
+                similarity_search.query(baseline_correction(_val).value[:, 1], k=6),
+                selection=None,
+                label=_val.filename,
+            )
+            for _val in sample_selected_for_plot.value
+        ]
+    )
+    return
+
+
 @app.cell
 def _(mo):
-    mo.md(r"""### 4.2 Parameter Analysis""")
+    mo.md(r"""### 4.3 Parameter Analysis""")
     return
 
 
@@ -951,6 +1093,7 @@ def _():
     from pathlib import Path
     import pandas as pd
     import io
+    import sys
     import matplotlib.pyplot as plt
     import scipy as sp
     from scipy.signal import detrend
@@ -958,7 +1101,7 @@ def _():
     from dataclasses import dataclass
     import json
     import seaborn as sns
-    return Baseline, Path, dataclass, io, json, np, pl, plt
+    return Path, dataclass, json, np, pl, plt, sys
 
 
 @app.cell
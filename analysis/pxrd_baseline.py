@@ -0,0 +1,140 @@
+import hashlib
+import math
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from pybaselines import Baseline
+
+from pxrd_batch import PXRDBatch, remove_baseline_batch
+
+# One fitter per distinct angle grid and process, for the most recently used grids. Algorithms that precompute
+# matrices for a grid, e.g. the Whittaker smoothers, only do that once per grid instead of once per pattern.
+_fitters: OrderedDict[bytes, Baseline] = OrderedDict()
+MAX_FITTERS = 16
+
+# Fitting a row takes about 1.5 ms, starting a process pool about 70 ms; smaller batches are fitted in this process
+MIN_ROWS_PER_PROCESS = 64
+
+# The version of the baseline results, part of their cache keys; increment it whenever the fitted baselines change
+BASELINE_VERSION = 1
+
+
+def pattern_hash(pattern: np.ndarray) -> str:
+    """
+    Returns the hex digest of the content of a pattern array.
+    """
+    return hashlib.blake2b(np.ascontiguousarray(pattern).tobytes(), digest_size=16).hexdigest()
+
+
+def baseline_key(pattern: np.ndarray, algorithm: str, **params) -> str:
+    """
+    Returns the cache key of the baseline corrected pattern: the version, the pattern hash, the algorithm and its
+    parameters.
+    """
+    description = repr(("baseline", BASELINE_VERSION, pattern_hash(pattern), algorithm, sorted(params.items())))
+    return hashlib.blake2b(description.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _fitter(angle: np.ndarray) -> Baseline:
+    key = angle.tobytes()
+    if key in _fitters:
+        _fitters.move_to_end(key)
+    else:
+        _fitters[key] = Baseline(x_data=angle)
+        if len(_fitters) > MAX_FITTERS:
+            _fitters.popitem(last=False)
+    return _fitters[key]
+
+
+def _fit_rows(angle: np.ndarray, intensity: np.ndarray, algorithm: str, params: dict) -> np.ndarray:
+    if algorithm == "snip" and set(params) <= {"max_half_window", "smooth_half_window"}:
+        # the decreasing SNIP of the pipeline is computed for all rows at once
+        return remove_baseline_batch(PXRDBatch(angle, intensity), **params).intensity
+    if algorithm == "snip":
+        params = {"decreasing": True} | params
+
+    corrected = np.full_like(intensity, np.nan)
+    for row, y in enumerate(intensity):
+        valid = np.isfinite(y)
+        if not valid.any():
+            continue
+        base, _ = getattr(_fitter(angle[valid]), algorithm)(y[valid], **params)
+        corrected[row, valid] = y[valid] - base
+    return corrected
+
+
+def fit_baseline_matrix(
+    angle: np.ndarray,
+    intensity: np.ndarray,
+    algorithm: str = "snip",
+    max_workers: int | None = None,
+    **params,
+) -> np.ndarray:
+    """
+    Removes the baseline from patterns on one angle grid, spreading the rows across a process pool. Every process
+    gets at least MIN_ROWS_PER_PROCESS rows, so small batches are fitted in this process without a pool.
+    NaN intensities are ignored for fitting and stay NaN.
+
+    Args:
+        angle (np.ndarray): The angle grid of shape (M,).
+        intensity (np.ndarray): The intensities of shape (N, M).
+        algorithm (str): The name of a pybaselines algorithm, e.g. "snip" (decreasing, as in the pipeline) or "asls".
+        max_workers (int | None): The number of processes. If None, all cores are used. 1 runs in this process.
+        **params: The parameters of the algorithm, e.g. max_half_window and smooth_half_window for SNIP.
+
+    Returns:
+        np.ndarray: The baseline corrected intensities of shape (N, M).
+    """
+    workers = min(max_workers or os.cpu_count() or 1, len(intensity) // MIN_ROWS_PER_PROCESS)
+    if workers <= 1:
+        return _fit_rows(angle, intensity, algorithm, params)
+
+    chunk_size = math.ceil(len(intensity) / workers)
+    chunks = [intensity[start:start + chunk_size] for start in range(0, len(intensity), chunk_size)]
+    with ProcessPoolExecutor(max_workers=len(chunks)) as executor:
+        n = len(chunks)
+        return np.vstack(list(executor.map(_fit_rows, [angle] * n, chunks, [algorithm] * n, [params] * n)))
+
+
+def fit_baselines(
+    patterns: list[np.ndarray],
+    algorithm: str = "snip",
+    max_workers: int | None = None,
+    cache=None,
+    **params,
+) -> list[np.ndarray]:
+    """
+    Removes the baseline from many patterns, e.g. a whole reference library. Patterns are grouped by their angle
+    grid, and every group is fitted in parallel. Results are cached by the pattern hash, the algorithm and its
+    parameters, so fitting the same library again only costs the cache lookups.
+
+    Args:
+        patterns (list[np.ndarray]): The patterns of shape (N, 2) with the angle and the intensity.
+        algorithm (str): The name of a pybaselines algorithm.
+        max_workers (int | None): The number of processes. If None, all cores are used.
+        cache (StageCache | None): The cache for the corrected patterns. If None, nothing is cached.
+        **params: The parameters of the algorithm.
+
+    Returns:
+        list[np.ndarray]: The baseline corrected patterns.
+    """
+    keys = [baseline_key(pattern, algorithm, **params) for pattern in patterns]
+    results = [cache.get(key) if cache is not None else None for key in keys]
+
+    groups: dict[bytes, list[int]] = {}
+    for i, pattern in enumerate(patterns):
+        if results[i] is None:
+            groups.setdefault(pattern[:, 0].tobytes(), []).append(i)
+
+    for rows in groups.values():
+        angle = patterns[rows[0]][:, 0]
+        corrected = fit_baseline_matrix(
+            angle, np.vstack([patterns[i][:, 1] for i in rows]), algorithm, max_workers, **params
+        )
+        for row, i in enumerate(rows):
+            results[i] = np.column_stack([angle, corrected[row]])
+            if cache is not None:
+                cache.put(keys[i], results[i])
+    return results
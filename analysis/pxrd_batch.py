@@ -0,0 +1,166 @@
+from dataclasses import dataclass
+
+import numpy as np
+from pybaselines.utils import pad_edges
+from scipy.ndimage import uniform_filter1d
+
+
+@dataclass(frozen=True)
+class PXRDBatch:
+    """
+    N patterns on a shared angle grid. The intensities are held as one (N, M) matrix, so every processing step is a
+    single vectorized pass over all patterns instead of a loop over samples.
+    """
+
+    angle: np.ndarray
+    intensity: np.ndarray
+
+    def __len__(self):
+        return len(self.intensity)
+
+    def pattern(self, index: int) -> np.ndarray:
+        """
+        Returns the pattern at the given row as an array of shape (M, 2) with the angle and the intensity.
+        """
+        return np.column_stack([self.angle, self.intensity[index]])
+
+    @classmethod
+    def from_patterns(cls, patterns: list[np.ndarray]) -> "PXRDBatch":
+        """
+        Stacks patterns of shape (M, 2) that share the same angle grid.
+
+        Raises:
+            ValueError: If the patterns do not share the same angle grid.
+        """
+        angle = patterns[0][:, 0]
+        if any(not np.array_equal(pattern[:, 0], angle) for pattern in patterns[1:]):
+            raise ValueError("The patterns do not share the same angle grid")
+        return cls(angle, np.vstack([pattern[:, 1] for pattern in patterns]))
+
+
+def subtract_blanks(batch: PXRDBatch, blanks: np.ndarray) -> PXRDBatch:
+    """
+    Subtracts the blank intensities row by row.
+
+    Args:
+        batch (PXRDBatch): The patterns.
+        blanks (np.ndarray): The blank intensities of shape (N, M), on the angle grid of the batch.
+
+    Returns:
+        PXRDBatch: The patterns without the blank.
+    """
+    return PXRDBatch(batch.angle, batch.intensity - blanks)
+
+
+def window_ranges(angle: np.ndarray, windows: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Converts angle windows into index ranges of a sorted angle grid.
+
+    Args:
+        angle (np.ndarray): The sorted angle grid.
+        windows (np.ndarray): The windows of shape (N, 2) with the first and last angle (inclusive).
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The start and stop indices, so that angle[start:stop] lies within the window.
+    """
+    windows = np.asarray(windows, dtype=float)
+    return np.searchsorted(angle, windows[:, 0], side="left"), np.searchsorted(angle, windows[:, 1], side="right")
+
+
+def empty_windows(batch: PXRDBatch, windows: np.ndarray) -> np.ndarray:
+    """
+    Finds the patterns without any finite intensity within their angle window (inclusive), e.g. because the window
+    lies outside the measured angle range.
+
+    Args:
+        batch (PXRDBatch): The patterns.
+        windows (np.ndarray): The window of every pattern, of shape (N, 2).
+
+    Returns:
+        np.ndarray: The rows of these patterns.
+    """
+    starts, stops = window_ranges(batch.angle, windows)
+    counts = np.zeros(len(batch), dtype=np.int64)
+    for start, stop in set(zip(starts.tolist(), stops.tolist())):
+        rows = (starts == start) & (stops == stop)
+        counts[rows] = np.isfinite(batch.intensity[rows, start:stop]).sum(axis=1)
+    return np.flatnonzero(counts == 0)
+
+
+def normalize_batch(batch: PXRDBatch, windows: np.ndarray) -> PXRDBatch:
+    """
+    Divides every pattern by its mean intensity within its angle window (inclusive), leaving out NaN. Patterns
+    sharing a window, e.g. all Cu patterns, are normalized together.
+
+    Args:
+        batch (PXRDBatch): The patterns.
+        windows (np.ndarray): The window of every pattern, of shape (N, 2).
+
+    Returns:
+        PXRDBatch: The normalized patterns.
+
+    Raises:
+        ValueError: If a pattern has no finite intensity within its window.
+    """
+    empty = empty_windows(batch, windows)
+    if empty.size:
+        raise ValueError(f"The patterns in rows {empty.tolist()} have no finite intensity within their normalization window")
+    starts, stops = window_ranges(batch.angle, windows)
+    means = np.empty(len(batch))
+    for start, stop in set(zip(starts.tolist(), stops.tolist())):
+        rows = (starts == start) & (stops == stop)
+        means[rows] = np.nanmean(batch.intensity[rows, start:stop], axis=1)
+    return PXRDBatch(batch.angle, batch.intensity / means[:, np.newaxis])
+
+
+def snip_batch(intensity: np.ndarray, max_half_window: int = 40, smooth_half_window: int = 3) -> np.ndarray:
+    """
+    SNIP baseline of every row, computed for all rows at once. The result equals
+    pybaselines' snip(decreasing=True, filter_order=2) of each row.
+
+    Args:
+        intensity (np.ndarray): The intensities of shape (N, M), without NaN.
+        max_half_window (int): The maximum number of iterations.
+        smooth_half_window (int): The half window of the moving average smoothing. 0 disables smoothing.
+
+    Returns:
+        np.ndarray: The baselines of shape (N, M).
+    """
+    baseline = np.vstack([pad_edges(row, max_half_window) for row in intensity])
+    num_y = baseline.shape[1]
+    for i in range(max_half_window, 0, -1):
+        filters = (baseline[:, 0:num_y - 2 * i] + baseline[:, 2 * i:num_y]) / 2
+        if smooth_half_window > 0:
+            previous_baseline = uniform_filter1d(baseline, 2 * smooth_half_window + 1, axis=1)[:, i:-i]
+        else:
+            previous_baseline = baseline[:, i:-i]
+        baseline[:, i:-i] = np.where(baseline[:, i:-i] > filters, filters, previous_baseline)
+    return baseline[:, max_half_window:-max_half_window]
+
+
+def remove_baseline_batch(batch: PXRDBatch, max_half_window: int = 40, smooth_half_window: int = 3) -> PXRDBatch:
+    """
+    Removes the SNIP baseline from every pattern. NaN intensities, e.g. outside the measured angle range of a
+    resampled pattern, are ignored for fitting and stay NaN. Patterns measured over the same angle range are
+    fitted together.
+    """
+    intensity = batch.intensity
+    corrected = np.full_like(intensity, np.nan)
+    valid = np.isfinite(intensity)
+    first = valid.argmax(axis=1)
+    stop = intensity.shape[1] - valid[:, ::-1].argmax(axis=1)
+    contiguous = valid.sum(axis=1) == stop - first
+    groups: dict[tuple[int, int], list[int]] = {}
+    for row in range(len(intensity)):
+        if not valid[row].any():
+            continue
+        if contiguous[row]:
+            groups.setdefault((int(first[row]), int(stop[row])), []).append(row)
+        else:
+            # gaps within the measured range: fit the measured points on their own
+            y = intensity[row, valid[row]]
+            corrected[row, valid[row]] = y - snip_batch(y[np.newaxis], max_half_window, smooth_half_window)[0]
+    for (start, end), rows in groups.items():
+        y = intensity[rows, start:end]
+        corrected[rows, start:end] = y - snip_batch(y, max_half_window, smooth_half_window)
+    return PXRDBatch(batch.angle, corrected)
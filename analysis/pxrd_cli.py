@@ -0,0 +1,266 @@
+import argparse
+import os
+import sys
+from dataclasses import dataclass
+
+import polars as pl
+
+# the PXRD file handling is shared with the data model
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data-model"))
+from jxdl_api import find_corresponding_pxrd_files, load_jxdl  # noqa: E402
+from pxrd_collector import PXRDFile, PXRDFileIndex, collect_pxrd_files  # noqa: E402
+from pxrd_reader import XYDCache  # noqa: E402
+
+from pxrd_composition import composition_table  # noqa: E402
+from pxrd_grid import AngleGrid, GridResampler  # noqa: E402
+from pxrd_pipeline import PXRDPipeline, StageCache, StageResult  # noqa: E402
+from xray_wavelength import convert_two_theta, wavelength  # noqa: E402
+
+# The default normalization windows of the notebook, in 2θ angles of the X-ray source the pattern was measured with
+NORMALIZATION_WINDOWS = {
+    "Cu": (38.0, 40.0),
+    "Co": (1.5, 1.8),
+}
+
+RESULTS_SCHEMA = {
+    "experiment_id": pl.String,
+    "sample": pl.String,
+    "xray_source": pl.String,
+    "sample_holder_shape": pl.String,
+    "sample_holder_diameter": pl.String,
+    "blank": pl.String,
+    "phase": pl.String,
+    "weight": pl.Float64,
+    "residual": pl.Float64,
+}
+
+
+@dataclass
+class SampleMapping:
+    """
+    A sample PXRD file of an experiment in the JXDL file, with the blank measured in the same configuration.
+    """
+
+    experiment_id: str
+    sample: PXRDFile
+    blank: PXRDFile | None
+
+
+def find_blank(blanks: PXRDFileIndex, pxrd_file: PXRDFile) -> PXRDFile | None:
+    """
+    Finds the blank measured with the X-ray source and the sample holder of the given file. A blank with the same
+    scan rate is preferred.
+
+    Args:
+        blanks (PXRDFileIndex): The index of the PXRD files, the blanks have the experiment ID "Blank".
+        pxrd_file (PXRDFile): The sample or reference file.
+
+    Returns:
+        PXRDFile | None: The blank file, or None if there is no blank for the configuration.
+    """
+    candidates = blanks.find(
+        experiment_id="Blank",
+        xray_source=pxrd_file.xray_source,
+        sample_holder_shape=pxrd_file.sample_holder_shape,
+        sample_holder_diameter=pxrd_file.sample_holder_diameter,
+    )
+    if not candidates:
+        return None
+    return next((blank for blank in candidates if blank.scan_rate == pxrd_file.scan_rate), candidates[0])
+
+
+def map_samples(jxdl_path: str, pxrd_files: list[PXRDFile]) -> tuple[list[SampleMapping], list[str]]:
+    """
+    Maps the PXRD files characterizing the products in the JXDL file to the files in the PXRD directory and their
+    blanks. The files are matched by file name, the relative paths in the JXDL file do not need to be valid.
+
+    Args:
+        jxdl_path (str): The path to the JXDL file.
+        pxrd_files (list[PXRDFile]): The sample and blank PXRD files, e.g. the output of collect_pxrd_files.
+
+    Returns:
+        tuple[list[SampleMapping], list[str]]: The mapped samples and the file names referenced in the JXDL file
+        that are missing in the PXRD files.
+    """
+    by_name = {os.path.basename(pxrd_file.path): pxrd_file for pxrd_file in pxrd_files}
+    index = PXRDFileIndex(pxrd_files)
+
+    mappings, missing = [], []
+    for synthesis in load_jxdl(jxdl_path).xdl.synthesis:
+        for characterization in find_corresponding_pxrd_files(synthesis):
+            pxrd_file = by_name.get(os.path.basename(characterization.path))
+            if pxrd_file is None:
+                missing.append(os.path.basename(characterization.path))
+                continue
+            mappings.append(SampleMapping(synthesis.metadata.description, pxrd_file, find_blank(index, pxrd_file)))
+    return mappings, missing
+
+
+def source_window(
+    xray_source: str | None, target_source: str, windows: dict[str, tuple[float, float]] = NORMALIZATION_WINDOWS
+) -> tuple[float, float] | None:
+    """
+    Returns the normalization window of patterns measured with the X-ray source in angles of the target source, or
+    None if the source is unknown.
+
+    Args:
+        xray_source (str | None): The X-ray source of the pattern, e.g. "Co-Kα1".
+        target_source (str): The X-ray source the patterns are converted to.
+        windows (dict[str, tuple[float, float]]): The windows by anode element, in angles of that element.
+    """
+    if xray_source is None:
+        return None
+    window = windows.get(xray_source.split("-")[0])
+    if window is None or wavelength(xray_source) == wavelength(target_source):
+        return window
+    return tuple(convert_two_theta(window, xray_source, target_source).tolist())
+
+
+def normalization_window(pxrd_file: PXRDFile, target_source: str) -> tuple[float, float] | None:
+    """
+    Returns the normalization window of the file in angles of the target source, or None if its X-ray source is
+    unknown.
+    """
+    return source_window(pxrd_file.xray_source, target_source)
+
+
+def create_pipeline(cache_dir: str | None, max_workers: int | None = None) -> PXRDPipeline:
+    """
+    Creates the pipeline with the settings of the notebook: Cu Kα1 angles on the grid from 0.9° to 80°.
+    With the cache directory of the notebook, both share the parsed patterns and the stage results.
+    """
+    return PXRDPipeline(
+        XYDCache(os.path.join(cache_dir, "xyd") if cache_dir else None),
+        StageCache(max_entries=4096, cache_dir=os.path.join(cache_dir, "stages") if cache_dir else None),
+        GridResampler(AngleGrid(start=0.9, stop=80.0, step=0.015)),
+        target_source="Cu Kα1",
+        max_workers=max_workers,
+    )
+
+
+def analyze(
+    mappings: list[SampleMapping],
+    references: list[PXRDFile],
+    reference_blanks: dict[str, PXRDFile | None],
+    pipeline: PXRDPipeline,
+    max_half_window: int = 40,
+    smooth_half_window: int = 3,
+    top_k: int | None = None,
+) -> pl.DataFrame:
+    """
+    Runs blank subtraction, normalization, baseline removal and composition for all samples and references as one
+    batch.
+
+    Args:
+        mappings (list[SampleMapping]): The samples with their blanks, see map_samples.
+        references (list[PXRDFile]): The pure phase references every sample is fitted against. If empty, the
+            composition is skipped.
+        reference_blanks (dict[str, PXRDFile | None]): The blank of every reference by its path.
+        pipeline (PXRDPipeline): The pipeline, see create_pipeline.
+        max_half_window (int): The maximum half window of the SNIP baseline.
+        smooth_half_window (int): The smoothing half window of the SNIP baseline.
+        top_k (int | None): If given, every sample is only fitted against its top_k references ranked by normalized
+            cross-correlation, for large reference libraries.
+
+    Returns:
+        pl.DataFrame: One row per sample and phase with the columns of RESULTS_SCHEMA. Samples without composition
+        have one row without phase.
+    """
+    loaded: dict[str, StageResult] = {}
+
+    def load(pxrd_file):
+        if pxrd_file.path not in loaded:
+            with open(pxrd_file.path, 'rb') as f:
+                pattern = pipeline.load(f.read())
+            loaded[pxrd_file.path] = pipeline.resample(pipeline.convert_wavelength(pattern, pxrd_file.xray_source))
+        return loaded[pxrd_file.path]
+
+    items = [(mapping.sample, mapping.blank) for mapping in mappings]
+    items += [(reference, reference_blanks.get(reference.path)) for reference in references]
+    # files of an unknown X-ray source cannot be normalized and are left out
+    items = [
+        (pxrd_file, blank, window) for pxrd_file, blank in items
+        if (window := normalization_window(pxrd_file, pipeline.target_source)) is not None
+    ]
+    corrected = pipeline.process_batch(
+        [(load(pxrd_file), load(blank) if blank else None, window) for pxrd_file, blank, window in items],
+        max_half_window=max_half_window,
+        smooth_half_window=smooth_half_window,
+    )
+    for (pxrd_file, _, _), result in zip(items, corrected):
+        if result is None:
+            print(f"Skipped PXRD file without intensity in its normalization window: {pxrd_file.path}", file=sys.stderr)
+    # skipped samples have no composition
+    corrected = {pxrd_file.path: result for (pxrd_file, _, _), result in zip(items, corrected) if result is not None}
+
+    samples = {
+        os.path.basename(mapping.sample.path): corrected[mapping.sample.path]
+        for mapping in mappings if mapping.sample.path in corrected
+    }
+    library = {
+        os.path.basename(reference.path): corrected[reference.path] for reference in references if reference.path in corrected
+    }
+    if not library:
+        compositions = {}
+    elif top_k is not None:
+        compositions = pipeline.composition_screened(samples, library, top_k=top_k)
+    else:
+        compositions = pipeline.composition_batch(samples, {path: library for path in samples})
+
+    metadata = pl.DataFrame(
+        [
+            {
+                "experiment_id": mapping.experiment_id,
+                "sample": os.path.basename(mapping.sample.path),
+                "xray_source": mapping.sample.xray_source,
+                "sample_holder_shape": mapping.sample.sample_holder_shape,
+                "sample_holder_diameter": mapping.sample.sample_holder_diameter,
+                "blank": os.path.basename(mapping.blank.path) if mapping.blank else None,
+            }
+            for mapping in mappings
+        ],
+        schema={column: RESULTS_SCHEMA[column] for column in list(RESULTS_SCHEMA)[:6]},
+    )
+    return metadata.join(composition_table(compositions), on="sample", how="left").select(list(RESULTS_SCHEMA))
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(
+        description="Analyzes the PXRD patterns of all experiments in a JXDL file and writes the results as Parquet."
+    )
+    parser.add_argument("--jxdl", default=os.path.join("..", "data", "generated", "jxdl.json"), help="the JXDL file")
+    parser.add_argument("--pxrd-dir", default=os.path.join("..", "data", "PXRD"), help="the directory with the sample and blank PXRD files")
+    parser.add_argument("--references", help="the directory with the pure phase PXRD files, if omitted the composition is skipped")
+    parser.add_argument("--output", default="pxrd_results.parquet", help="the Parquet file for the results")
+    parser.add_argument("--workers", type=int, default=None, help="the number of processes fitting baselines, all cores by default")
+    parser.add_argument("--cache-dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"), help="the cache directory, shared with the notebook by default")
+    parser.add_argument("--max-half-window", type=int, default=40, help="the maximum half window of the SNIP baseline")
+    parser.add_argument("--smooth-half-window", type=int, default=3, help="the smoothing half window of the SNIP baseline")
+    parser.add_argument("--top-k", type=int, default=None, help="fit every sample only against its top k references")
+    args = parser.parse_args(argv)
+
+    pxrd_files = collect_pxrd_files(args.pxrd_dir)
+    mappings, missing = map_samples(args.jxdl, pxrd_files)
+    for file_name in missing:
+        print(f"Missing PXRD file: {file_name}", file=sys.stderr)
+
+    references = collect_pxrd_files(args.references) if args.references else []
+    # references are measured in the configurations of the samples, so their blanks are in the sample directory
+    index = PXRDFileIndex(pxrd_files)
+    reference_blanks = {reference.path: find_blank(index, reference) for reference in references}
+
+    results = analyze(
+        mappings,
+        references,
+        reference_blanks,
+        create_pipeline(args.cache_dir, args.workers),
+        max_half_window=args.max_half_window,
+        smooth_half_window=args.smooth_half_window,
+        top_k=args.top_k,
+    )
+    results.write_parquet(args.output)
+    print(f"{results['sample'].n_unique()} samples analyzed, results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,454 @@
+import hashlib
+import math
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+
+import numpy as np
+import polars as pl
+from scipy.linalg import cho_factor, cho_solve, LinAlgError
+
+
+def nnls_gram(gram: np.ndarray, correlation: np.ndarray, tol: float | None = None) -> np.ndarray:
+    """
+    Solves min ||A x - b|| subject to x >= 0 with the Lawson-Hanson active set method, given only the Gram matrix
+    G = AᵀA and the correlation c = Aᵀb. The cost does not depend on the number of angles, so one Gram matrix
+    serves every sample fitted against the same references.
+
+    Args:
+        gram (np.ndarray): The Gram matrix of shape (k, k).
+        correlation (np.ndarray): The correlation of shape (k,).
+        tol (float | None): The tolerance for the optimality check. If None, it is derived from the Gram matrix.
+
+    Returns:
+        np.ndarray: The non-negative solution of shape (k,).
+    """
+    k = len(correlation)
+    if tol is None:
+        tol = 10 * np.finfo(float).eps * np.abs(gram).sum(axis=0).max() * k
+    x = np.zeros(k)
+    passive = np.zeros(k, dtype=bool)
+    gradient = correlation.copy()
+    for _ in range(3 * k):
+        if passive.all() or (gradient[~passive] <= tol).all():
+            break
+        passive[np.argmax(np.where(passive, -np.inf, gradient))] = True
+        while True:
+            z = np.zeros(k)
+            z[passive] = np.linalg.lstsq(gram[np.ix_(passive, passive)], correlation[passive], rcond=None)[0]
+            if (z[passive] > tol).all():
+                x = z
+                break
+            # step back to the boundary of the feasible region and drop the phases that hit zero
+            blocking = passive & (z <= tol)
+            step = x[blocking] - z[blocking]
+            alpha = np.min(np.divide(x[blocking], step, out=np.zeros_like(step), where=step > 0))
+            x = x + alpha * (z - x)
+            passive &= x > tol
+            x[~passive] = 0
+        gradient = correlation - gram @ x
+    return x
+
+
+# The number of references up to which nnls_gram_batch enumerates all 2^k active sets
+MAX_ENUMERATED_PHASES = 8
+
+
+def nnls_gram_batch(gram: np.ndarray, correlations: np.ndarray) -> np.ndarray:
+    """
+    Solves the non-negative least squares problems of many samples against the same few references at once, see
+    nnls_gram. Every subset of the references is solved for all samples with one matrix product, and each sample
+    keeps the non-negative solution with the smallest residual. This is exact and, for up to MAX_ENUMERATED_PHASES
+    references, much faster than solving the samples one by one.
+
+    Args:
+        gram (np.ndarray): The Gram matrix of shape (k, k).
+        correlations (np.ndarray): The correlations of shape (N, k).
+
+    Returns:
+        np.ndarray: The non-negative solutions of shape (N, k).
+    """
+    n, k = correlations.shape
+    best = np.zeros((n, k))
+    # ||Ax - b||² = xᵀGx - 2cᵀx + ||b||², for the least squares solution of a subset it is ||b||² - cᵀx
+    best_objective = np.zeros(n)
+    for subset in range(1, 2 ** k):
+        active = np.array([(subset >> j) & 1 for j in range(k)], dtype=bool)
+        solution = correlations[:, active] @ np.linalg.pinv(gram[np.ix_(active, active)]).T
+        objective = -np.einsum("ij,ij->i", correlations[:, active], solution)
+        better = (solution >= 0).all(axis=1) & (objective < best_objective)
+        best[np.ix_(better, active)] = solution[better]
+        best[np.ix_(better, ~active)] = 0
+        best_objective[better] = objective[better]
+    return best
+
+
+@dataclass
+class ReferenceBasis:
+    """
+    The reference patterns of a phase set on one angle grid. The Gram matrix and its Cholesky factor are computed
+    once per set of measured angles and reused for every sample.
+    """
+
+    names: list[str]
+    intensity: np.ndarray
+    _factors: dict[str, tuple] = field(default_factory=dict, repr=False)
+
+    def __post_init__(self):
+        # without a common measured angle every sample would silently get the weights 0
+        if not self.names:
+            raise ValueError("The reference basis needs at least one reference")
+        unmeasured = [name for name, row in zip(self.names, self.intensity) if not np.isfinite(row).any()]
+        if unmeasured:
+            raise ValueError(f"The references {', '.join(unmeasured)} have no measured intensities")
+        if not np.isfinite(self.intensity).all(axis=0).any():
+            raise ValueError(f"The references {', '.join(self.names)} have no measured angle in common")
+
+    @classmethod
+    def from_patterns(cls, phases: dict[str, np.ndarray]) -> "ReferenceBasis":
+        """
+        Builds the basis from phase patterns of shape (M, 2) on the same angle grid.
+
+        Raises:
+            ValueError: If there are no phases, a phase has no measured intensities or the phases have no measured
+                angle in common.
+        """
+        if not phases:
+            raise ValueError("The reference basis needs at least one reference")
+        return cls(list(phases), np.vstack([phase[:, 1] for phase in phases.values()]))
+
+    def _factor(self, measured: np.ndarray) -> tuple:
+        key = hashlib.blake2b(np.packbits(measured).tobytes(), digest_size=16).hexdigest()
+        if key not in self._factors:
+            basis = self.intensity[:, measured]
+            gram = basis @ basis.T
+            try:
+                cholesky = cho_factor(gram)
+            except LinAlgError:
+                # linearly dependent references, only the active set solver can handle them
+                cholesky = None
+            self._factors[key] = (gram, cholesky)
+        return self._factors[key]
+
+    def solve_correlation(self, measured: np.ndarray, correlation: np.ndarray) -> np.ndarray:
+        """
+        Fits samples given only their correlation with the references, c = Aᵀb over the measured angles.
+
+        Args:
+            measured (np.ndarray): The angles measured in the samples and in all references, of shape (M,).
+            correlation (np.ndarray): The correlations of shape (N, k).
+
+        Returns:
+            np.ndarray: The non-negative weights of shape (N, k).
+        """
+        gram, cholesky = self._factor(measured)
+        if cholesky is not None:
+            # the unconstrained least squares solution of all samples at once is the answer whenever it is non-negative
+            solution = cho_solve(cholesky, correlation.T).T
+        else:
+            solution = np.full_like(correlation, -1.0)
+        negative = ~(solution >= 0).all(axis=1)
+        if negative.any() and len(self.names) <= MAX_ENUMERATED_PHASES:
+            solution[negative] = nnls_gram_batch(gram, correlation[negative])
+        elif negative.any():
+            solution[negative] = [nnls_gram(gram, row) for row in correlation[negative]]
+        return solution
+
+    def solve(self, samples: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Fits every sample as a non-negative linear combination of the references. Only angles measured in the
+        sample and in all references are fitted.
+
+        Args:
+            samples (np.ndarray): The sample intensities of shape (N, M).
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: The weights of shape (N, k) and the relative residual norm
+            ||b - Ax|| / ||b|| of every sample.
+        """
+        weights = np.zeros((len(samples), len(self.names)))
+        residuals = np.empty(len(samples))
+        measured = np.isfinite(samples) & np.isfinite(self.intensity).all(axis=0)
+        groups: dict[bytes, list[int]] = {}
+        for i, row in enumerate(measured):
+            groups.setdefault(np.packbits(row).tobytes(), []).append(i)
+
+        for rows in groups.values():
+            mask = measured[rows[0]]
+            basis, b = self.intensity[:, mask], samples[np.ix_(rows, mask)]
+            weights[rows] = self.solve_correlation(mask, b @ basis.T)
+            residuals[rows] = np.linalg.norm(b - weights[rows] @ basis, axis=1) / np.linalg.norm(b, axis=1)
+        return weights, residuals
+
+
+def measured_phases(phases: dict) -> tuple[dict, list[str]]:
+    """
+    Leaves out the phases without any measured intensity, e.g. because their normalization window lies outside their
+    measured range, with a warning. They cannot be fitted and would leave no angle to fit the others on.
+
+    Args:
+        phases (dict): The phase patterns of shape (M, 2) by name, as arrays or stage results.
+
+    Returns:
+        tuple[dict, list[str]]: The measured phases and the names of the phases left out.
+    """
+    measured, unmeasured = {}, []
+    for name, phase in phases.items():
+        intensity = getattr(phase, "value", phase)[:, 1]
+        if np.isfinite(intensity).any():
+            measured[name] = phase
+        else:
+            unmeasured.append(name)
+    if unmeasured:
+        warnings.warn(
+            f"The references {', '.join(unmeasured)} have no measured intensities, e.g. because their normalization "
+            f"window lies outside their measured range, and are left out of the fit"
+        )
+    return measured, unmeasured
+
+
+def composition_from_weights(
+    names: list[str], weights: np.ndarray, residual: float, unmeasured: list[str] | None = None
+) -> dict[str, float]:
+    """
+    Returns the composition of one sample: the weight per phase (at most 1), NaN for the unmeasured phases that were
+    left out of the fit, the remaining "unknown" fraction and the relative residual of the fit.
+    """
+    weights = np.minimum(weights, 1)
+    return (
+        {name: float(weight) for name, weight in zip(names, weights)}
+        | {name: math.nan for name in unmeasured or []}
+        | {"unknown": float(1 - np.sum(weights)), "residual": float(residual)}
+    )
+
+
+def composition_table(compositions: dict[str, dict[str, float]]) -> pl.DataFrame:
+    """
+    Converts the compositions of many samples to a tidy table with one row per sample and phase, including the
+    "unknown" remainder, and the residual of the sample fit.
+
+    Args:
+        compositions (dict[str, dict[str, float]]): The composition per sample, as returned by the pipeline.
+
+    Returns:
+        pl.DataFrame: The columns sample, phase, weight and residual.
+    """
+    rows = [
+        {"sample": sample, "phase": phase, "weight": weight, "residual": composition["residual"]}
+        for sample, composition in compositions.items()
+        for phase, weight in composition.items()
+        if phase != "residual"
+    ]
+    return pl.DataFrame(
+        rows, schema={"sample": pl.String, "phase": pl.String, "weight": pl.Float64, "residual": pl.Float64}
+    )
+
+
+def normalized_cross_correlation(samples: np.ndarray, references: np.ndarray, max_shift: int = 0) -> np.ndarray:
+    """
+    Scores every reference against every sample by the normalized cross-correlation of the intensities, computed
+    for all pairs with one matrix product per shift. NaN intensities (unmeasured angles) do not contribute.
+
+    Args:
+        samples (np.ndarray): The sample intensities of shape (N, M).
+        references (np.ndarray): The reference intensities of shape (L, M).
+        max_shift (int): The largest shift in grid points tried between sample and reference, to tolerate small
+            peak shifts, e.g. from sample displacement. The best shift counts.
+
+    Returns:
+        np.ndarray: The scores of shape (N, L) between -1 and 1.
+    """
+    def standardize(intensity):
+        centered = intensity - np.nanmean(intensity, axis=1, keepdims=True)
+        centered = np.nan_to_num(centered, nan=0.0)
+        norm = np.linalg.norm(centered, axis=1, keepdims=True)
+        return np.divide(centered, norm, out=np.zeros_like(centered), where=norm > 0)
+
+    samples, references = standardize(samples), standardize(references)
+    scores = samples @ references.T
+    for shift in range(1, max_shift + 1):
+        scores = np.maximum(scores, samples[:, shift:] @ references[:, :-shift].T)
+        scores = np.maximum(scores, samples[:, :-shift] @ references[:, shift:].T)
+    return scores
+
+
+def screen_candidates(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """
+    Returns the indices of the top_k references with the highest scores per sample, best first.
+
+    Args:
+        scores (np.ndarray): The scores of shape (N, L), e.g. from normalized_cross_correlation.
+        top_k (int): The number of candidates per sample.
+
+    Returns:
+        np.ndarray: The reference indices of shape (N, min(top_k, L)).
+    """
+    top_k = min(top_k, scores.shape[1])
+    candidates = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=1), axis=1)
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+def solve_screened(
+    samples: np.ndarray, references: np.ndarray, names: list[str], top_k: int = 5, max_shift: int = 0
+) -> list[dict[str, float]]:
+    """
+    Fits every sample against its top_k references from a large library. The references are ranked by normalized
+    cross-correlation with the sample, and only the candidates go into the non-negative least squares fit, so the
+    cost of the fit stays flat as the library grows.
+
+    Args:
+        samples (np.ndarray): The sample intensities of shape (N, M).
+        references (np.ndarray): The library intensities of shape (L, M), on the same angle grid.
+        names (list[str]): The names of the references.
+        top_k (int): The number of candidates fitted per sample.
+        max_shift (int): The largest shift in grid points tried for screening.
+
+    Returns:
+        list[dict[str, float]]: The composition of every sample over its candidates, see composition_from_weights.
+    """
+    candidates = screen_candidates(normalized_cross_correlation(samples, references, max_shift), top_k)
+    compositions = []
+    for sample, indices in zip(samples, candidates):
+        basis = ReferenceBasis([names[i] for i in indices], references[indices])
+        weights, residuals = basis.solve(sample[np.newaxis])
+        compositions.append(composition_from_weights(basis.names, weights[0], residuals[0]))
+    return compositions
+
+
+# The expected counts above which Poisson noise is drawn from its normal approximation
+POISSON_NORMAL_THRESHOLD = 50
+
+
+def _bootstrap_rows(
+    basis: ReferenceBasis,
+    samples: np.ndarray,
+    counts: np.ndarray,
+    scale: np.ndarray,
+    blank_counts: np.ndarray,
+    blank_scale: np.ndarray,
+    n_resamples: int,
+    seeds: list[np.random.SeedSequence],
+) -> np.ndarray:
+    draws = np.full((len(samples), n_resamples, len(basis.names)), np.nan)
+    for i, seed in enumerate(seeds):
+        rng = np.random.default_rng(seed)
+        measured = np.isfinite(samples[i]) & np.isfinite(basis.intensity).all(axis=0)
+        if not (np.isfinite(scale[i]) and np.isfinite(blank_scale[i]) and measured.any()):
+            # e.g. a sample without measured angles in its normalization window, its weights stay NaN
+            continue
+        references = basis.intensity[:, measured]
+        sample_counts, reference_counts = counts[i, measured], blank_counts[i, measured]
+        correlation = references @ samples[i, measured]
+
+        # the fit only sees the noise through its correlation with the references, so above a few dozen counts the
+        # normal approximation is drawn directly as k correlated values instead of one value per angle
+        normal = (sample_counts >= POISSON_NORMAL_THRESHOLD) & (reference_counts >= POISSON_NORMAL_THRESHOLD)
+        variance = scale[i] ** 2 * sample_counts[normal] + blank_scale[i] ** 2 * reference_counts[normal]
+        covariance = (references[:, normal] * variance) @ references[:, normal].T
+        noise = rng.multivariate_normal(np.zeros(len(basis.names)), covariance, size=n_resamples, method="eigh")
+
+        # the few low counts, e.g. at the edges of the measured range, are drawn from the Poisson distribution
+        low = ~normal
+        if low.any():
+            poisson = scale[i] * (rng.poisson(sample_counts[low], size=(n_resamples, low.sum())) - sample_counts[low])
+            if blank_scale[i]:
+                poisson -= blank_scale[i] * (
+                    rng.poisson(reference_counts[low], size=(n_resamples, low.sum())) - reference_counts[low]
+                )
+            noise += poisson @ references[:, low].T
+        draws[i] = basis.solve_correlation(measured, correlation + noise)
+    return draws
+
+
+def bootstrap_weights(
+    basis: ReferenceBasis,
+    samples: np.ndarray,
+    counts: np.ndarray,
+    scale: np.ndarray,
+    blank_counts: np.ndarray | None = None,
+    blank_scale: np.ndarray | None = None,
+    n_resamples: int = 1000,
+    max_workers: int | None = None,
+    seed: int = 0,
+) -> np.ndarray:
+    """
+    Draws the phase weights of samples under Poisson counting noise: every resample adds noise drawn from the
+    expected counts of the sample (and its blank) to the corrected intensities and is solved again. The baseline
+    and the normalization are kept fixed. The resamples of a sample are solved as one matrix, the samples are
+    spread across a process pool.
+
+    Args:
+        basis (ReferenceBasis): The references the samples are fitted against.
+        samples (np.ndarray): The corrected sample intensities of shape (N, M).
+        counts (np.ndarray): The expected counts of the sample measurements of shape (N, M).
+        scale (np.ndarray): The corrected intensity of one count of every sample, of shape (N,).
+        blank_counts (np.ndarray | None): The expected counts of the subtracted blanks of shape (N, M), if any.
+        blank_scale (np.ndarray | None): The corrected intensity of one blank count of every sample, 0 for no blank.
+        n_resamples (int): The number of resamples per sample.
+        max_workers (int | None): The number of processes. If None, all cores are used. 1 runs in this process.
+        seed (int): The seed of the noise, the draws do not depend on the number of processes.
+
+    Returns:
+        np.ndarray: The weights of shape (N, n_resamples, k). The weights of samples with a NaN scale or without a
+        measured angle are NaN.
+    """
+    counts = np.clip(np.nan_to_num(counts, nan=0.0), 0, None)
+    scale = np.broadcast_to(np.asarray(scale, dtype=float), (len(samples),))
+    if blank_counts is None:
+        blank_counts, blank_scale = np.zeros_like(counts), np.zeros(len(samples))
+    blank_counts = np.clip(np.nan_to_num(blank_counts, nan=0.0), 0, None)
+    blank_scale = np.broadcast_to(np.asarray(blank_scale, dtype=float), (len(samples),))
+    seeds = np.random.SeedSequence(seed).spawn(len(samples))
+
+    workers = min(max_workers or os.cpu_count() or 1, len(samples))
+    if workers <= 1:
+        return _bootstrap_rows(basis, samples, counts, scale, blank_counts, blank_scale, n_resamples, seeds)
+
+    chunk_size = math.ceil(len(samples) / workers)
+    chunks = [slice(start, start + chunk_size) for start in range(0, len(samples), chunk_size)]
+    with ProcessPoolExecutor(max_workers=len(chunks)) as executor:
+        futures = [
+            executor.submit(
+                _bootstrap_rows, basis, samples[chunk], counts[chunk], scale[chunk], blank_counts[chunk],
+                blank_scale[chunk], n_resamples, seeds[chunk],
+            )
+            for chunk in chunks
+        ]
+        return np.concatenate([future.result() for future in futures])
+
+
+def composition_intervals(
+    samples: list[str], names: list[str], weights: np.ndarray, draws: np.ndarray, confidence: float = 0.95
+) -> pl.DataFrame:
+    """
+    Summarizes bootstrapped phase weights as confidence intervals, including the "unknown" remainder.
+
+    Args:
+        samples (list[str]): The sample names.
+        names (list[str]): The phase names.
+        weights (np.ndarray): The weights fitted to the measured intensities, of shape (N, k).
+        draws (np.ndarray): The bootstrapped weights of shape (N, R, k), see bootstrap_weights.
+        confidence (float): The confidence level of the percentile intervals.
+
+    Returns:
+        pl.DataFrame: One row per sample and phase with the columns sample, phase, weight, std, lower and upper.
+    """
+    # the same capping and remainder as composition_from_weights
+    weights, draws = np.minimum(weights, 1), np.minimum(draws, 1)
+    weights = np.concatenate([weights, 1 - weights.sum(axis=1, keepdims=True)], axis=1)
+    draws = np.concatenate([draws, 1 - draws.sum(axis=2, keepdims=True)], axis=2)
+    lower, upper = np.quantile(draws, [(1 - confidence) / 2, (1 + confidence) / 2], axis=1)
+    phases = [*names, "unknown"]
+    return pl.DataFrame({
+        "sample": np.repeat(samples, len(phases)).tolist(),
+        "phase": phases * len(samples),
+        "weight": weights.ravel(),
+        "std": draws.std(axis=1).ravel(),
+        "lower": lower.ravel(),
+        "upper": upper.ravel(),
+    }, schema={
+        "sample": pl.String, "phase": pl.String, "weight": pl.Float64, "std": pl.Float64, "lower": pl.Float64,
+        "upper": pl.Float64,
+    })
@@ -0,0 +1,108 @@
+import hashlib
+from dataclasses import dataclass, field
+from functools import cached_property
+
+import numpy as np
+
+
+@dataclass(frozen=True)
+class AngleGrid:
+    """
+    An evenly spaced 2θ grid that all patterns are resampled onto, so that every later stage is plain aligned
+    array arithmetic. The default matches the 0.015° steps of the diffractometer from 1.5° to 80°.
+    """
+
+    start: float = 1.5
+    stop: float = 80.0
+    step: float = 0.015
+
+    @cached_property
+    def angle(self) -> np.ndarray:
+        angle = np.round(self.start + self.step * np.arange(round((self.stop - self.start) / self.step) + 1), 10)
+        angle.setflags(write=False)
+        return angle
+
+
+@dataclass(frozen=True)
+class InterpolationWeights:
+    """
+    Linear interpolation from one source grid onto an angle grid: target point j is
+    (1 - fraction[j]) * y[index[j]] + fraction[j] * y[index[j] + 1], or NaN outside the source grid.
+    """
+
+    index: np.ndarray
+    fraction: np.ndarray
+    outside: np.ndarray
+
+    @classmethod
+    def between(cls, source: np.ndarray, target: np.ndarray) -> "InterpolationWeights":
+        """
+        Computes the weights from a sorted source grid onto the target grid.
+        """
+        index = np.clip(np.searchsorted(source, target, side="right") - 1, 0, max(len(source) - 2, 0))
+        right = np.minimum(index + 1, len(source) - 1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            fraction = np.where(right > index, (target - source[index]) / (source[right] - source[index]), 0.0)
+        # points on the source grid are copied exactly instead of mixing in rounding errors
+        fraction[np.isclose(fraction, 0.0, rtol=0, atol=1e-6)] = 0.0
+        on_right = np.isclose(fraction, 1.0, rtol=0, atol=1e-6)
+        index[on_right], fraction[on_right] = right[on_right], 0.0
+        outside = (target < source[0] - 1e-9) | (target > source[-1] + 1e-9)
+        return cls(index, fraction, outside)
+
+    def apply(self, intensity: np.ndarray) -> np.ndarray:
+        """
+        Interpolates intensities of shape (..., N) on the source grid onto the target grid.
+        """
+        right = np.minimum(self.index + 1, intensity.shape[-1] - 1)
+        resampled = intensity[..., self.index] * (1 - self.fraction) + intensity[..., right] * self.fraction
+        resampled[..., self.outside] = np.nan
+        return resampled
+
+
+@dataclass
+class GridResampler:
+    """
+    Resamples patterns onto an angle grid. The interpolation weights are computed once per source grid and
+    reused for every pattern measured on that grid.
+    """
+
+    grid: AngleGrid = AngleGrid()
+    _weights: dict[str, InterpolationWeights] = field(default_factory=dict, repr=False)
+
+    def weights(self, source: np.ndarray) -> InterpolationWeights:
+        """
+        Returns the cached interpolation weights from the source grid onto the grid.
+        """
+        digest = hashlib.blake2b(np.ascontiguousarray(source).tobytes(), digest_size=16).hexdigest()
+        if digest not in self._weights:
+            self._weights[digest] = InterpolationWeights.between(source, self.grid.angle)
+        return self._weights[digest]
+
+    def resample(self, pattern: np.ndarray) -> np.ndarray:
+        """
+        Resamples a pattern of shape (N, 2) onto the grid. Angles outside the measured range get NaN intensities.
+
+        Returns:
+            np.ndarray: The resampled pattern of shape (M, 2).
+        """
+        # e.g. reflections that do not exist after a wavelength conversion
+        pattern = pattern[np.isfinite(pattern[:, 0])]
+        return np.column_stack([self.grid.angle, self.weights(pattern[:, 0]).apply(pattern[:, 1])])
+
+    def resample_many(self, patterns: list[np.ndarray]) -> np.ndarray:
+        """
+        Resamples many patterns onto the grid. Patterns measured on the same source grid are interpolated together.
+
+        Returns:
+            np.ndarray: The resampled intensities of shape (number of patterns, M).
+        """
+        patterns = [pattern[np.isfinite(pattern[:, 0])] for pattern in patterns]
+        intensity = np.empty((len(patterns), len(self.grid.angle)))
+        groups: dict[bytes, list[int]] = {}
+        for i, pattern in enumerate(patterns):
+            groups.setdefault(pattern[:, 0].tobytes(), []).append(i)
+        for rows in groups.values():
+            weights = self.weights(patterns[rows[0]][:, 0])
+            intensity[rows] = weights.apply(np.vstack([patterns[i][:, 1] for i in rows]))
+        return intensity
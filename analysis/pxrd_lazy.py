@@ -0,0 +1,72 @@
+import numpy as np
+import polars as pl
+
+from pxrd_batch import PXRDBatch, window_ranges
+
+
+def blank_normalization_plan(patterns: pl.LazyFrame, blanks: pl.LazyFrame) -> pl.LazyFrame:
+    """
+    Builds one query plan for the blank subtraction and normalization of a batch of patterns on a common angle
+    grid. Every pattern is one row holding its intensities as an array, so the plan works on whole patterns instead
+    of single points; the blanks are joined by their ID, so every blank is stored once however many patterns use it.
+
+    Args:
+        patterns (pl.LazyFrame): One row per pattern with the columns intensity (an array over the grid), blank
+            (the ID of its blank, an ID not among the blanks for no blank), start and stop (the grid indices of the
+            normalization window, see pxrd_batch.window_ranges).
+        blanks (pl.LazyFrame): One row per blank with the columns blank and blank_intensity (an array over the grid).
+
+    Returns:
+        pl.LazyFrame: The rows of the patterns in their order with the columns subtracted and normalized. Unmeasured
+        angles are NaN, as in the pipeline, and a window without finite intensity gives a NaN mean.
+    """
+    subtracted = patterns.join(blanks, on="blank", how="left", maintain_order="left").with_columns(
+        subtracted=pl.when(pl.col("blank_intensity").is_null())
+        .then(pl.col("intensity"))
+        .otherwise(pl.col("intensity") - pl.col("blank_intensity"))
+    )
+    window_mean = (
+        pl.col("subtracted").arr.slice(pl.col("start"), pl.col("stop") - pl.col("start"))
+        .list.eval(pl.element().filter(pl.element().is_not_nan()).mean())
+        .list.first()
+        .fill_null(np.nan)
+    )
+    return subtracted.with_columns(window_mean=window_mean).select(
+        "subtracted", normalized=pl.col("subtracted") / pl.col("window_mean")
+    )
+
+
+def subtract_and_normalize(
+    batch: PXRDBatch, blanks: np.ndarray, blank_rows: np.ndarray, windows: np.ndarray
+) -> tuple[PXRDBatch, PXRDBatch]:
+    """
+    Subtracts the blanks from the patterns and divides them by their mean intensity within their angle window
+    (inclusive), leaving out NaN, like pxrd_batch.subtract_blanks and pxrd_batch.normalize_batch. The stages run as
+    one lazy query plan, collected once with the streaming engine.
+
+    Args:
+        batch (PXRDBatch): The patterns.
+        blanks (np.ndarray): The distinct blank intensities of shape (B, M), on the angle grid of the batch.
+        blank_rows (np.ndarray): The row of the blank of every pattern in blanks, -1 for no blank.
+        windows (np.ndarray): The normalization window of every pattern, of shape (N, 2).
+
+    Returns:
+        tuple[PXRDBatch, PXRDBatch]: The patterns without the blank and the normalized patterns.
+    """
+    grid = pl.Array(pl.Float64, len(batch.angle))
+    starts, stops = window_ranges(batch.angle, windows)
+    patterns = pl.LazyFrame({
+        "intensity": pl.Series(batch.intensity, dtype=grid),
+        "blank": np.asarray(blank_rows, dtype=np.int64),
+        "start": starts,
+        "stop": stops,
+    })
+    blank_frame = pl.LazyFrame({
+        "blank": np.arange(len(blanks), dtype=np.int64),
+        "blank_intensity": pl.Series(np.reshape(blanks, (-1, len(batch.angle))), dtype=grid),
+    })
+    result = blank_normalization_plan(patterns, blank_frame).collect(engine="streaming")
+    return (
+        PXRDBatch(batch.angle, result["subtracted"].to_numpy()),
+        PXRDBatch(batch.angle, result["normalized"].to_numpy()),
+    )
@@ -0,0 +1,143 @@
+from dataclasses import dataclass, field
+from typing import Iterable
+
+from pxrd_collector import PXRDFile
+
+
+def parse_file_name(file_name: str) -> PXRDFile | None:
+    """
+    Parses the metadata of a PXRD file name, see pxrd_collector.PXRD_FILE_NAME_PATTERN, or returns None if the
+    name does not follow the pattern.
+    """
+    try:
+        return PXRDFile(file_name)
+    except ValueError:
+        return None
+
+
+def configuration(pxrd_file: PXRDFile) -> tuple[str | None, str | None, str | None]:
+    """
+    Returns the measurement configuration of a PXRD file: the anode element of the X-ray source (e.g. "Cu" for
+    both "Cu" and "Cu-Kα1"), the sample holder shape and the sample holder diameter.
+    """
+    element = pxrd_file.xray_source.split("-")[0] if pxrd_file.xray_source else None
+    return element, pxrd_file.sample_holder_shape, pxrd_file.sample_holder_diameter
+
+
+class MetadataIndex:
+    """
+    Index of PXRD file names by their parsed metadata. The names are parsed once, finding the files measured in
+    a configuration is a dictionary lookup.
+    """
+
+    def __init__(self, file_names: Iterable[str]):
+        """
+        Parses the file names and builds the index.
+
+        Args:
+            file_names (Iterable[str]): The PXRD file names, e.g. the names of the uploaded files.
+        """
+        self.files: dict[str, PXRDFile | None] = {name: parse_file_name(name) for name in file_names}
+        self.by_configuration: dict[tuple, list[str]] = {}
+        for name, pxrd_file in self.files.items():
+            if pxrd_file is not None:
+                self.by_configuration.setdefault(configuration(pxrd_file), []).append(name)
+
+    def find(self, pxrd_file: PXRDFile) -> list[str]:
+        """
+        Returns the files measured in the configuration of the given file, the ones with the same scan rate first.
+        """
+        names = self.by_configuration.get(configuration(pxrd_file), [])
+        return sorted(names, key=lambda name: self.files[name].scan_rate != pxrd_file.scan_rate)
+
+
+@dataclass
+class SampleMatch:
+    """
+    The blank, the pure components and the JXDL entry assigned to a sample file.
+    """
+
+    xray_source: str | None = None
+    blank: str | None = None
+    pure: list[str] = field(default_factory=list)
+    jxdl: str | None = None
+
+
+@dataclass
+class MatchReport:
+    """
+    The sample files that could not be assigned automatically and need a manual assignment.
+    """
+
+    unparsed: list[str] = field(default_factory=list)
+    no_blank: list[str] = field(default_factory=list)
+    no_pure: list[str] = field(default_factory=list)
+    no_jxdl: list[str] = field(default_factory=list)
+
+    def __bool__(self):
+        return bool(self.unparsed or self.no_blank or self.no_pure or self.no_jxdl)
+
+    def __str__(self):
+        return "\n".join(
+            f"- {label}: {', '.join(names)}"
+            for label, names in [
+                ("File name not recognized", self.unparsed),
+                ("No blank measurement", self.no_blank),
+                ("No pure components", self.no_pure),
+                ("No JXDL entry", self.no_jxdl),
+            ]
+            if names
+        )
+
+
+def find_experiment(experiment_id: str, experiment_ids: set[str] | dict) -> str | None:
+    """
+    Finds the JXDL entry of an experiment. Repeated measurements of an experiment carry a suffix, e.g. KE-048-1-2,
+    so the suffixes are dropped one by one until an entry matches.
+    """
+    while experiment_id not in experiment_ids:
+        if "-" not in experiment_id:
+            return None
+        experiment_id = experiment_id.rsplit("-", 1)[0]
+    return experiment_id
+
+
+def match_samples(
+    samples: Iterable[str], blanks: Iterable[str], pure: Iterable[str], experiment_ids: set[str] | dict
+) -> tuple[dict[str, SampleMatch], MatchReport]:
+    """
+    Assigns a blank, the pure components and a JXDL entry to every sample file by the metadata in the file names.
+    A blank or pure component matches if it was measured with the same X-ray source and sample holder as the
+    sample; blanks with the same scan rate are preferred.
+
+    Args:
+        samples (Iterable[str]): The sample file names.
+        blanks (Iterable[str]): The blank file names.
+        pure (Iterable[str]): The pure component file names.
+        experiment_ids (set[str] | dict): The experiment IDs of the JXDL entries, or a dictionary keyed by them.
+
+    Returns:
+        tuple[dict[str, SampleMatch], MatchReport]: The assignment of every sample and the samples that could not
+        be assigned completely.
+    """
+    sample_index, blank_index, pure_index = MetadataIndex(samples), MetadataIndex(blanks), MetadataIndex(pure)
+    matches, report = {}, MatchReport()
+    for name, pxrd_file in sample_index.files.items():
+        if pxrd_file is None:
+            matches[name] = SampleMatch()
+            report.unparsed.append(name)
+            continue
+        match = SampleMatch(
+            xray_source=configuration(pxrd_file)[0],
+            blank=next(iter(blank_index.find(pxrd_file)), None),
+            pure=pure_index.find(pxrd_file),
+            jxdl=find_experiment(pxrd_file.experiment_id, experiment_ids),
+        )
+        matches[name] = match
+        if match.blank is None:
+            report.no_blank.append(name)
+        if not match.pure:
+            report.no_pure.append(name)
+        if match.jxdl is None:
+            report.no_jxdl.append(name)
+    return matches, report
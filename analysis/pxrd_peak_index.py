@@ -0,0 +1,202 @@
+import json
+import math
+import os
+from typing import Callable
+
+import numpy as np
+import polars as pl
+
+
+class PeakIndex:
+    """
+    Inverted index from binned peak positions to the patterns with a peak there. Finding the patterns that
+    contain a set of reflections intersects the posting lists of the reflections instead of scanning all patterns.
+    """
+
+    def __init__(self, index_path: str, axis: str = "two_theta", bin_width: float = 0.05):
+        """
+        Loads the index from the given path, or starts an empty index if the file does not exist yet.
+
+        Args:
+            index_path (str): The path of the index JSON file, e.g. ../data/generated/pxrd_peak_index.json.
+            axis (str): The peak table column that is indexed, "two_theta" (in degrees) or "d_spacing" (in Å).
+            bin_width (float): The width of the bins, in the unit of the axis.
+        """
+        self.index_path = index_path
+        self.axis = axis
+        self.bin_width = bin_width
+        # pattern ID -> peak positions, needed to remove a pattern and to check exact distances
+        self.positions: dict[str, list[float]] = {}
+        # pattern ID -> content hash of the indexed file, to find the files changed since they were indexed
+        self.content_hashes: dict[str, str] = {}
+        self._postings: dict[int, set[str]] = {}
+        if os.path.exists(index_path):
+            with open(index_path, 'r') as f:
+                index = json.load(f)
+            self.axis, self.bin_width = index["axis"], index["bin_width"]
+            for pattern_id, positions in index["patterns"].items():
+                self.add(pattern_id, positions)
+            # indexes saved without content hashes are indexed again on their next update
+            self.content_hashes = index.get("content_hashes", {})
+
+    def __len__(self):
+        return len(self.positions)
+
+    def _bin(self, position: float) -> int:
+        return math.floor(position / self.bin_width)
+
+    def add(self, pattern_id: str, positions):
+        """
+        Adds the peak positions of a pattern, replacing the positions indexed for it before.
+        """
+        self.remove(pattern_id)
+        self.positions[pattern_id] = [float(position) for position in positions]
+        for position in self.positions[pattern_id]:
+            self._postings.setdefault(self._bin(position), set()).add(pattern_id)
+
+    def add_peak_table(self, peak_table: pl.DataFrame):
+        """
+        Adds all patterns of a peak table, see pxrd_peaks.detect_peaks.
+        """
+        for (pattern_id,), peaks in peak_table.partition_by("pattern", as_dict=True).items():
+            self.add(pattern_id, peaks[self.axis].to_list())
+
+    def remove(self, pattern_id: str):
+        """
+        Removes a pattern from the index, if it is indexed.
+        """
+        self.content_hashes.pop(pattern_id, None)
+        for position in self.positions.pop(pattern_id, []):
+            postings = self._postings.get(self._bin(position))
+            if postings is not None:
+                postings.discard(pattern_id)
+                if not postings:
+                    del self._postings[self._bin(position)]
+
+    def patterns_near(self, position: float, tolerance: float) -> set[str]:
+        """
+        Returns the patterns with a peak within position ± tolerance.
+        """
+        candidates = set().union(*(
+            self._postings.get(i, ()) for i in range(self._bin(position - tolerance), self._bin(position + tolerance) + 1)
+        ))
+        # the bins at both ends of the range can hold peaks just outside of it
+        return {
+            pattern_id for pattern_id in candidates
+            if any(abs(peak - position) <= tolerance for peak in self.positions[pattern_id])
+        }
+
+    def query(self, positions: list[float], tolerance: float = 0.1) -> set[str]:
+        """
+        Returns the patterns that have a peak within ± tolerance of every given position, e.g. of the three
+        strongest reflections of a phase.
+
+        Args:
+            positions (list[float]): The peak positions, in the unit of the axis.
+            tolerance (float): The allowed deviation, in the unit of the axis.
+
+        Returns:
+            set[str]: The IDs of the matching patterns.
+        """
+        if not positions:
+            return set()
+        # start with the rarest reflection, so the intersection stays small
+        postings = sorted((self.patterns_near(position, tolerance) for position in positions), key=len)
+        return set.intersection(*postings)
+
+    def update(
+        self, content_hashes: dict[str, str], peak_table: Callable[[list[str]], pl.DataFrame]
+    ) -> tuple[list[str], list[str], list[str]]:
+        """
+        Brings the index up to date with the files of a PXRD manifest. The content hash of every indexed pattern is
+        stored with its peaks, so patterns are added, changed and removed by comparing the hashes, independent of
+        which tool updated the manifest last.
+
+        Args:
+            content_hashes (dict[str, str]): The content hash of every pattern, e.g. of the entries of a manifest.
+            peak_table (Callable[[list[str]], pl.DataFrame]): Returns the peak table of the given patterns.
+
+        Returns:
+            tuple[list[str], list[str], list[str]]: The patterns added, changed and removed.
+        """
+        added = sorted(pattern_id for pattern_id in content_hashes if pattern_id not in self.content_hashes)
+        changed = sorted(
+            pattern_id for pattern_id, content_hash in content_hashes.items()
+            if pattern_id in self.content_hashes and self.content_hashes[pattern_id] != content_hash
+        )
+        removed = sorted(
+            pattern_id for pattern_id in {*self.positions, *self.content_hashes} if pattern_id not in content_hashes
+        )
+        for pattern_id in [*removed, *added, *changed]:
+            self.remove(pattern_id)
+        if added or changed:
+            self.add_peak_table(peak_table(added + changed))
+            for pattern_id in added + changed:
+                # patterns without peaks are still known to the index
+                self.positions.setdefault(pattern_id, [])
+                self.content_hashes[pattern_id] = content_hashes[pattern_id]
+        self.save()
+        return added, changed, removed
+
+    def save(self):
+        """
+        Saves the index. Only the peak positions and the content hash per pattern are stored, the posting lists are
+        rebuilt on loading.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(self.index_path)), exist_ok=True)
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(
+                {
+                    "axis": self.axis,
+                    "bin_width": self.bin_width,
+                    "patterns": self.positions,
+                    "content_hashes": self.content_hashes,
+                },
+                f,
+                ensure_ascii=False,
+            )
+        os.replace(tmp_path, self.index_path)
+
+
+def strongest_reflections(peak_table: pl.DataFrame, pattern_id: str, count: int = 3, axis: str = "two_theta") -> list[float]:
+    """
+    Returns the positions of the strongest peaks of a pattern, e.g. of a pure phase, for a PeakIndex query.
+    """
+    peaks = peak_table.filter(pl.col("pattern") == pattern_id).sort("height", descending=True).head(count)
+    return peaks[axis].to_list()
+
+
+if __name__ == '__main__':
+    import sys
+
+    sys.path.append(os.path.join('..', 'data-model'))
+    from pxrd_manifest import PXRDManifest
+    from pxrd_reader import XYDCache
+    from pxrd_grid import AngleGrid, GridResampler
+    from pxrd_pipeline import PXRDPipeline
+
+    manifest = PXRDManifest(os.path.join('..', 'data', 'generated', 'pxrd_manifest.json'))
+    manifest.update(os.path.join('..', 'data', 'PXRD'))
+    index = PeakIndex(os.path.join('..', 'data', 'generated', 'pxrd_peak_index.json'))
+    # the grid of the notebook and the CLI
+    pipeline = PXRDPipeline(
+        XYDCache(os.path.join('.cache', 'xyd')), resampler=GridResampler(AngleGrid(start=0.9, stop=80.0, step=0.015))
+    )
+
+    def peak_table(pattern_ids):
+        corrected = {}
+        for pattern_id in pattern_ids:
+            with open(manifest.path(pattern_id), 'rb') as f:
+                pattern = pipeline.load(f.read())
+            source = (manifest.entries[pattern_id]["metadata"] or {}).get("xray_source")
+            pattern = pipeline.resample(pipeline.convert_wavelength(pattern, source))
+            if np.isfinite(pattern.value[:, 1]).any():
+                corrected[pattern_id] = pipeline.remove_baseline(pattern)
+        return pipeline.peak_table(corrected)
+
+    # the manifest is shared with other tools, so the index compares the content hashes instead of using the delta
+    added, changed, removed = index.update(
+        {pattern_id: entry["content_hash"] for pattern_id, entry in manifest.entries.items()}, peak_table
+    )
+    print(f"PXRD peak index: {len(added)} added, {len(changed)} changed, {len(removed)} removed, {len(index)} patterns indexed")
@@ -0,0 +1,78 @@
+import numpy as np
+import polars as pl
+from scipy.integrate import cumulative_trapezoid
+from scipy.signal import find_peaks, peak_widths
+
+from xray_wavelength import wavelength
+
+PEAK_TABLE_SCHEMA = {
+    "pattern": pl.String,
+    "two_theta": pl.Float64,
+    "d_spacing": pl.Float64,
+    "height": pl.Float64,
+    "fwhm": pl.Float64,
+    "area": pl.Float64,
+    "relative_area": pl.Float64,
+}
+
+
+def d_spacing(two_theta: np.ndarray, source: str = "Cu Kα1") -> np.ndarray:
+    """
+    Converts 2θ angles in degrees to lattice plane distances in Å with Bragg's law, d = λ / (2 sin θ).
+    """
+    return wavelength(source) / (2 * np.sin(np.radians(np.asarray(two_theta)) / 2))
+
+
+def detect_peaks(
+    angle: np.ndarray,
+    intensity: np.ndarray,
+    names: list[str],
+    relative_height: float = 1 / 40,
+    relative_prominence: float = 1 / 40,
+    min_width: float = 0.05,
+    source: str = "Cu Kα1",
+) -> pl.DataFrame:
+    """
+    Detects the peaks of baseline corrected patterns on a common angle grid and returns them as a peak table.
+    The areas of all peaks come from one cumulative integral per pattern instead of one integration per peak.
+
+    Args:
+        angle (np.ndarray): The angle grid of shape (M,).
+        intensity (np.ndarray): The baseline corrected intensities of shape (N, M). NaN counts as zero.
+        names (list[str]): The pattern IDs.
+        relative_height (float): The minimum peak height relative to the highest intensity of the pattern.
+        relative_prominence (float): The minimum peak prominence relative to the highest intensity of the pattern.
+        min_width (float): The minimum peak width in degrees.
+        source (str): The X-ray source of the angles, for the d-spacing.
+
+    Returns:
+        pl.DataFrame: One row per peak with the pattern ID, the position (2θ and d-spacing), the height, the full
+        width at half maximum in degrees, the area between the peak bases and the area relative to the integral of
+        the positive intensity of the pattern, so that negative residuals of the baseline removal do not inflate it.
+    """
+    intensity = np.nan_to_num(intensity, nan=0.0)
+    # the integral from the first angle to every angle, so the area between two angles is one difference
+    cumulative = cumulative_trapezoid(intensity, angle, axis=1, initial=0)
+    positive_area = cumulative_trapezoid(np.clip(intensity, 0, None), angle, axis=1)[:, -1]
+    maxima = intensity.max(axis=1)
+    step = (angle[-1] - angle[0]) / (len(angle) - 1)
+
+    columns = {column: [] for column in PEAK_TABLE_SCHEMA}
+    for name, y, y_cumulative, y_positive_area, y_max in zip(names, intensity, cumulative, positive_area, maxima):
+        peaks, properties = find_peaks(
+            y, height=y_max * relative_height, prominence=y_max * relative_prominence, width=min_width / step
+        )
+        fwhm = peak_widths(y, peaks, rel_height=0.5)[0] * step
+        left, right = properties["left_bases"], properties["right_bases"]
+        area = y_cumulative[right] - y_cumulative[left]
+        columns["pattern"].extend([name] * len(peaks))
+        columns["two_theta"].append(angle[peaks])
+        columns["height"].append(y[peaks])
+        columns["fwhm"].append(fwhm)
+        columns["area"].append(area)
+        columns["relative_area"].append(area / y_positive_area if y_positive_area > 0 else np.full(len(peaks), np.nan))
+
+    for column in ("two_theta", "height", "fwhm", "area", "relative_area"):
+        columns[column] = np.concatenate(columns[column]) if columns[column] else np.empty(0)
+    columns["d_spacing"] = d_spacing(columns["two_theta"], source)
+    return pl.DataFrame(columns, schema=PEAK_TABLE_SCHEMA)
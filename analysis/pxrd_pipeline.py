@@ -0,0 +1,592 @@
+import hashlib
+import os
+import pickle
+import warnings
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable
+
+import numpy as np
+import polars as pl
+from pybaselines import Baseline
+
+from pxrd_baseline import fit_baseline_matrix
+from pxrd_batch import PXRDBatch, empty_windows
+from pxrd_composition import (
+    ReferenceBasis,
+    bootstrap_weights,
+    composition_from_weights,
+    composition_intervals,
+    measured_phases,
+    solve_screened,
+)
+from pxrd_grid import GridResampler
+from pxrd_lazy import subtract_and_normalize
+from pxrd_peaks import PEAK_TABLE_SCHEMA, detect_peaks
+from xray_wavelength import convert_two_theta, wavelength
+
+
+# The processing of a PXRD pattern is a chain of stages. Each stage result is cached under a key derived from
+# the keys of its inputs and its own parameters, so changing the parameters of one stage only recomputes
+# that stage and the stages depending on it.
+STAGES = ("load", "wavelength_conversion", "resample", "blank_subtraction", "normalization", "baseline", "peaks", "composition")
+
+# The version of every stage whose results changed, part of the stage keys. Results cached on disk by an earlier
+# version of a stage are not found anymore and are recomputed; increment the version whenever the result of a stage
+# changes, e.g. the composition dictionaries gained the "residual" of the fit in version 2 and NaN weights for
+# unmeasured phases in version 3; the cached peak tables lost the pattern name in version 2 and got the areas up to
+# the right peak base, relative to the positive intensity, in version 3. Normalization version 2 takes the window
+# means in the lazy plan of process_batch, whose results differ from the NumPy means in the last bits.
+STAGE_VERSIONS = {"normalization": 2, "composition": 3, "peaks": 3}
+
+
+def stage_key(stage: str, inputs: tuple[str, ...], **params) -> str:
+    """
+    Computes the cache key of a stage result, including the version of the stage, see STAGE_VERSIONS.
+
+    Args:
+        stage (str): The name of the stage.
+        inputs (tuple[str, ...]): The keys of the stage inputs.
+        **params: The parameters of the stage.
+
+    Returns:
+        str: The hex digest identifying the stage result.
+    """
+    description = repr((stage, STAGE_VERSIONS.get(stage, 1), inputs, sorted(params.items())))
+    return hashlib.blake2b(description.encode("utf-8"), digest_size=16).hexdigest()
+
+
+@dataclass(frozen=True)
+class StageResult:
+    """
+    The result of a pipeline stage together with the key it is cached under.
+
+    For pattern stages, the value is an array of shape (N, 2) with the angle in the first column and the intensity
+    in the second column. For the composition stage, the value is a dictionary of phase weights.
+    """
+
+    key: str
+    value: Any
+
+
+class StageCache:
+    """
+    Two-tier cache for stage results: a bounded in-memory LRU tier and an optional on-disk tier that
+    survives restarts of the notebook.
+    """
+
+    def __init__(self, max_entries: int = 1024, cache_dir: str | None = None):
+        """
+        Initializes the cache.
+
+        Args:
+            max_entries (int): The maximum number of results kept in memory.
+            cache_dir (str | None): Directory for the on-disk tier. If None, results are only cached in memory.
+        """
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self._entries: OrderedDict[str, Any] = OrderedDict()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any]) -> Any:
+        """
+        Returns the cached result for the given key, computing and caching it if it is missing.
+
+        Args:
+            key (str): The stage key.
+            compute (Callable[[], Any]): Computes the result on a cache miss.
+
+        Returns:
+            Any: The stage result.
+        """
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def get(self, key: str) -> Any:
+        """
+        Returns the cached result for the given key, or None if it is missing.
+        """
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+        value = self._load_from_disk(key)
+        if value is not None:
+            self._remember(key, value)
+        return value
+
+    def put(self, key: str, value: Any):
+        """
+        Caches a result, e.g. a row of a batch computation.
+        """
+        self._save_to_disk(key, value)
+        self._remember(key, value)
+
+    def clear(self):
+        """
+        Removes all results from memory and disk.
+        """
+        self._entries.clear()
+        if self.cache_dir:
+            for file_name in os.listdir(self.cache_dir):
+                if file_name.endswith(".pkl"):
+                    os.remove(os.path.join(self.cache_dir, file_name))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remember(self, key: str, value: Any):
+        if isinstance(value, np.ndarray):
+            # results are shared between all callers, so they must not be modified in place
+            value.setflags(write=False)
+        self._entries[key] = value
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _load_from_disk(self, key: str) -> Any:
+        if not self.cache_dir:
+            return None
+        path = os.path.join(self.cache_dir, key + ".pkl")
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    def _save_to_disk(self, key: str, value: Any):
+        if not self.cache_dir:
+            return
+        path = os.path.join(self.cache_dir, key + ".pkl")
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+
+def subtract_blank(pattern: np.ndarray, blank: np.ndarray) -> np.ndarray:
+    """
+    Subtracts the blank measurement from the pattern. Both must be resampled onto the same angle grid.
+
+    Raises:
+        ValueError: If the pattern and the blank do not share the same angle grid.
+    """
+    if not np.array_equal(pattern[:, 0], blank[:, 0]):
+        raise ValueError("The pattern and the blank do not share the same angle grid")
+    return np.column_stack([pattern[:, 0], pattern[:, 1] - blank[:, 1]])
+
+
+def normalize(pattern: np.ndarray, window: tuple[float, float]) -> np.ndarray:
+    """
+    Divides the intensity by its mean within the given angle window (inclusive). Angles outside the measured
+    range (NaN) are left out of the mean. The pattern runs through the lazy plan of PXRDPipeline.process_batch,
+    so both cache bit-identical results.
+
+    Raises:
+        ValueError: If the pattern has no finite intensity within the window.
+    """
+    batch = PXRDBatch(pattern[:, 0], pattern[np.newaxis, :, 1])
+    if empty_windows(batch, np.array([window], dtype=float)).size:
+        raise ValueError(f"The pattern has no finite intensity within the normalization window {tuple(window)}")
+    _, normalized = subtract_and_normalize(batch, np.empty((0, len(batch.angle))), np.array([-1]), np.array([window]))
+    return normalized.pattern(0)
+
+
+def counting_time(pattern: np.ndarray) -> float:
+    """
+    Estimates the effective counting time per point of a pattern in CPS from its noise. For Poisson counts the
+    variance of the CPS is CPS / time; the variance is taken from the differences of neighbouring points, with
+    the median absolute deviation, so peaks barely contribute. The pattern must be as measured: converting and
+    resampling it interpolates between the points and smooths the noise.
+    """
+    y = pattern[np.isfinite(pattern[:, 1]), 1]
+    differences = np.diff(y)
+    variance = (1.4826 * np.median(np.abs(differences - np.median(differences)))) ** 2 / 2
+    return float(np.median(y) / variance)
+
+
+def counting_statistics(
+    pattern: np.ndarray,
+    blank: np.ndarray | None,
+    window: tuple[float, float],
+    time: float,
+    blank_time: float | None = None,
+) -> tuple[np.ndarray, float, np.ndarray | None, float]:
+    """
+    Estimates the counting statistics of a resampled pattern and its blank from their CPS intensities, for
+    bootstrapping the composition.
+
+    Args:
+        pattern (np.ndarray): The resampled pattern in CPS.
+        blank (np.ndarray | None): The resampled blank in CPS, if one is subtracted.
+        window (tuple[float, float]): The normalization window.
+        time (float): The counting time per point of the pattern, see counting_time of the measured pattern.
+        blank_time (float | None): The counting time per point of the blank, needed with a blank.
+
+    Returns:
+        tuple[np.ndarray, float, np.ndarray | None, float]: The expected counts of the pattern, the corrected
+        intensity of one of its counts, and the same for the blank (None and 0 without blank), see
+        pxrd_composition.bootstrap_weights. The intensity of one count is NaN if the window has no measured angle.
+    """
+    subtracted = subtract_blank(pattern, blank) if blank is not None else pattern
+    in_window = (subtracted[:, 0] >= window[0]) & (subtracted[:, 0] <= window[1])
+    mean = np.nanmean(subtracted[in_window, 1]) if np.isfinite(subtracted[in_window, 1]).any() else np.nan
+    if blank is None:
+        return pattern[:, 1] * time, float(1 / (time * mean)), None, 0.0
+    return pattern[:, 1] * time, float(1 / (time * mean)), blank[:, 1] * blank_time, float(1 / (blank_time * mean))
+
+
+def remove_baseline(pattern: np.ndarray, max_half_window: int = 40, smooth_half_window: int = 3) -> np.ndarray:
+    """
+    Removes the SNIP baseline from the pattern. NaN intensities are ignored for fitting and stay NaN.
+    """
+    x, y = pattern[:, 0], pattern[:, 1]
+    valid = ~np.isnan(y)
+    baseline_fitter = Baseline(x_data=x[valid])
+    base, _ = baseline_fitter.snip(
+        y[valid], max_half_window=max_half_window, decreasing=True, smooth_half_window=smooth_half_window
+    )
+    y_detrend = np.full_like(y, np.nan)
+    y_detrend[valid] = y[valid] - base
+    return np.column_stack([x, y_detrend])
+
+
+def solve_composition(pattern: np.ndarray, phases: dict[str, np.ndarray]) -> dict[str, float]:
+    """
+    Fits the pattern as a non-negative linear combination of the phase patterns. All patterns must share the same
+    angle grid; only angles measured in all of them are fitted.
+
+    Phases without measured intensities are left out of the fit with a warning, their weight is NaN.
+
+    Returns:
+        dict[str, float]: The weight per phase, the remaining "unknown" fraction and the relative "residual" of the fit.
+    """
+    phases, unmeasured = measured_phases(phases)
+    basis = ReferenceBasis.from_patterns(phases)
+    weights, residuals = basis.solve(pattern[np.newaxis, :, 1])
+    return composition_from_weights(basis.names, weights[0], residuals[0], unmeasured)
+
+
+class PXRDPipeline:
+    """
+    Stage graph load → blank subtraction → normalization → baseline → composition with memoized results.
+    """
+
+    def __init__(
+        self,
+        xyd_cache,
+        stage_cache: StageCache | None = None,
+        resampler: GridResampler | None = None,
+        target_source: str = "Cu Kα1",
+        max_workers: int | None = None,
+    ):
+        """
+        Initializes the pipeline.
+
+        Args:
+            xyd_cache (XYDCache): The parse cache used by the load stage.
+            stage_cache (StageCache | None): The cache for the stage results. If None, an in-memory cache is used.
+            resampler (GridResampler | None): Resamples the loaded patterns onto the common angle grid. If None, the default grid is used.
+            target_source (str): The X-ray source all patterns are converted to, so that patterns measured with different sources can be compared.
+            max_workers (int | None): The number of processes fitting baselines in batches. If None, all cores are used.
+        """
+        self.xyd_cache = xyd_cache
+        self.stage_cache = stage_cache if stage_cache is not None else StageCache()
+        self.resampler = resampler if resampler is not None else GridResampler()
+        self.target_source = target_source
+        self.max_workers = max_workers
+        # reference bases by the keys of their phase patterns, the Gram matrices are reused across samples
+        self._bases = StageCache(max_entries=32)
+
+    def load(self, content: bytes) -> StageResult:
+        # parsed patterns already have their own binary cache, keyed by the content hash
+        key = hashlib.blake2b(content, digest_size=16).hexdigest()
+        return StageResult(key, self.xyd_cache.load_bytes(content, key))
+
+    def convert_wavelength(self, pattern: StageResult, source: str | None) -> StageResult:
+        # patterns of an unknown source or already measured with the target source are used as they are
+        if source is None or wavelength(source) == wavelength(self.target_source):
+            return pattern
+        key = stage_key("wavelength_conversion", (pattern.key,), source=wavelength(source), target=wavelength(self.target_source))
+        return StageResult(key, self.stage_cache.get_or_compute(key, lambda: np.column_stack([
+            convert_two_theta(pattern.value[:, 0], source, self.target_source), pattern.value[:, 1]
+        ])))
+
+    def resample(self, pattern: StageResult) -> StageResult:
+        grid = self.resampler.grid
+        key = stage_key("resample", (pattern.key,), grid=(grid.start, grid.stop, grid.step))
+        return StageResult(key, self.stage_cache.get_or_compute(key, lambda: self.resampler.resample(pattern.value)))
+
+    def subtract_blank(self, pattern: StageResult, blank: StageResult | None) -> StageResult:
+        if blank is None:
+            return pattern
+        key = stage_key("blank_subtraction", (pattern.key, blank.key))
+        return StageResult(key, self.stage_cache.get_or_compute(key, lambda: subtract_blank(pattern.value, blank.value)))
+
+    def normalize(self, pattern: StageResult, window: tuple[float, float]) -> StageResult:
+        window = (float(window[0]), float(window[1]))
+        key = stage_key("normalization", (pattern.key,), window=window)
+        return StageResult(key, self.stage_cache.get_or_compute(key, lambda: normalize(pattern.value, window)))
+
+    def remove_baseline(self, pattern: StageResult, max_half_window: int = 40, smooth_half_window: int = 3) -> StageResult:
+        key = stage_key(
+            "baseline", (pattern.key,), max_half_window=max_half_window, smooth_half_window=smooth_half_window
+        )
+        return StageResult(key, self.stage_cache.get_or_compute(
+            key, lambda: remove_baseline(pattern.value, max_half_window, smooth_half_window)
+        ))
+
+    def composition(self, pattern: StageResult, phases: dict[str, StageResult]) -> StageResult:
+        key = self._composition_key(pattern, phases)
+        return StageResult(key, self.stage_cache.get_or_compute(
+            key, lambda: solve_composition(pattern.value, {name: phase.value for name, phase in phases.items()})
+        ))
+
+    def composition_batch(
+        self, samples: dict[str, StageResult], phases: dict[str, dict[str, StageResult]]
+    ) -> dict[str, dict[str, float]]:
+        """
+        Solves the composition of many samples. Samples fitted against the same phases are solved together against
+        one factorized reference basis. Every result is cached under the same key as the single sample stage.
+        Phases without measured intensities are left out as in solve_composition.
+
+        Args:
+            samples (dict[str, StageResult]): The baseline corrected sample patterns by name.
+            phases (dict[str, dict[str, StageResult]]): The baseline corrected phase patterns by name, per sample.
+
+        Returns:
+            dict[str, dict[str, float]]: The composition of every sample, see solve_composition.
+        """
+        results = {}
+        groups: dict[str, list[str]] = {}
+        for name, pattern in samples.items():
+            key = self._composition_key(pattern, phases[name])
+            value = self.stage_cache.get(key)
+            if value is not None:
+                results[name] = value
+            else:
+                basis_key = stage_key("basis", tuple(phase.key for phase in phases[name].values()), phases=tuple(phases[name]))
+                groups.setdefault(basis_key, []).append(name)
+
+        for basis_key, names in groups.items():
+            basis, unmeasured = self._basis(basis_key, phases[names[0]])
+            weights, residuals = basis.solve(np.vstack([samples[name].value[:, 1] for name in names]))
+            for name, sample_weights, residual in zip(names, weights, residuals):
+                results[name] = composition_from_weights(basis.names, sample_weights, residual, unmeasured)
+                self.stage_cache.put(self._composition_key(samples[name], phases[name]), results[name])
+        return {name: results[name] for name in samples}
+
+    def composition_uncertainty(
+        self,
+        samples: dict[str, StageResult],
+        phases: dict[str, dict[str, StageResult]],
+        statistics: dict[str, tuple],
+        n_resamples: int = 1000,
+        confidence: float = 0.95,
+        seed: int = 0,
+    ) -> pl.DataFrame:
+        """
+        Bootstraps confidence intervals of the compositions of many samples under Poisson counting noise. Samples
+        fitted against the same phases share one factorized reference basis, the resamples are solved in a process
+        pool. The intervals are not cached, they are drawn again with the given seed.
+
+        Args:
+            samples (dict[str, StageResult]): The baseline corrected sample patterns by name.
+            phases (dict[str, dict[str, StageResult]]): The baseline corrected phase patterns by name, per sample.
+            statistics (dict[str, tuple]): The counting statistics of every sample, see counting_statistics.
+            n_resamples (int): The number of resamples per sample.
+            confidence (float): The confidence level of the intervals.
+            seed (int): The seed of the noise.
+
+        Returns:
+            pl.DataFrame: One row per sample and phase with the columns sample, phase, weight, std, lower and upper,
+            see pxrd_composition.composition_intervals.
+        """
+        groups: dict[str, list[str]] = {}
+        for name in samples:
+            basis_key = stage_key("basis", tuple(phase.key for phase in phases[name].values()), phases=tuple(phases[name]))
+            groups.setdefault(basis_key, []).append(name)
+
+        tables = []
+        for basis_key, names in groups.items():
+            basis, _ = self._basis(basis_key, phases[names[0]])
+            intensity = np.vstack([samples[name].value[:, 1] for name in names])
+            counts, scale, blank_counts, blank_scale = zip(*(statistics[name] for name in names))
+            blank_counts = np.vstack([
+                blank if blank is not None else np.zeros_like(sample) for sample, blank in zip(counts, blank_counts)
+            ])
+            draws = bootstrap_weights(
+                basis, intensity, np.vstack(counts), scale, blank_counts, blank_scale, n_resamples, self.max_workers, seed
+            )
+            tables.append(composition_intervals(names, basis.names, basis.solve(intensity)[0], draws, confidence))
+        return pl.concat(tables) if tables else composition_intervals([], [], np.empty((0, 0)), np.empty((0, 0, 0)))
+
+    def composition_screened(
+        self, samples: dict[str, StageResult], library: dict[str, StageResult], top_k: int = 5, max_shift: int = 0
+    ) -> dict[str, dict[str, float]]:
+        """
+        Solves the composition of many samples against a large reference library. Each sample is only fitted
+        against the top_k references ranked by normalized cross-correlation, see solve_screened.
+
+        Args:
+            samples (dict[str, StageResult]): The baseline corrected sample patterns by name.
+            library (dict[str, StageResult]): The baseline corrected reference patterns by name.
+            top_k (int): The number of candidates fitted per sample.
+            max_shift (int): The largest shift in grid points tried for screening.
+
+        Returns:
+            dict[str, dict[str, float]]: The composition of every sample over its candidates.
+        """
+        library, _ = measured_phases(library)
+        library_key = stage_key("library", tuple(pattern.key for pattern in library.values()), names=tuple(library))
+        keys = {
+            name: stage_key("composition_screened", (pattern.key, library_key), top_k=top_k, max_shift=max_shift)
+            for name, pattern in samples.items()
+        }
+        results = {name: self.stage_cache.get(key) for name, key in keys.items()}
+        pending = [name for name, value in results.items() if value is None]
+        if pending:
+            compositions = solve_screened(
+                np.vstack([samples[name].value[:, 1] for name in pending]),
+                np.vstack([pattern.value[:, 1] for pattern in library.values()]),
+                list(library),
+                top_k,
+                max_shift,
+            )
+            for name, composition in zip(pending, compositions):
+                results[name] = composition
+                self.stage_cache.put(keys[name], composition)
+        return results
+
+    def peak_table(self, patterns: dict[str, StageResult], **params) -> pl.DataFrame:
+        """
+        Returns the peak table of many baseline corrected patterns. The peaks of every pattern are cached next to
+        its corrected data, only patterns without cached peaks are detected, together in one pass.
+
+        Args:
+            patterns (dict[str, StageResult]): The baseline corrected patterns by pattern ID.
+            **params: The peak detection parameters, see pxrd_peaks.detect_peaks.
+
+        Returns:
+            pl.DataFrame: The peak table of all patterns, see pxrd_peaks.detect_peaks.
+        """
+        params = {"source": self.target_source} | params
+        keys = {name: stage_key("peaks", (pattern.key,), **params) for name, pattern in patterns.items()}
+        # the cached peaks of a pattern do not depend on its name, it is added when the table is read back
+        tables = {name: self.stage_cache.get(key) for name, key in keys.items()}
+        pending = [name for name, table in tables.items() if table is None]
+        if pending:
+            batch = PXRDBatch.from_patterns([patterns[name].value for name in pending])
+            detected = detect_peaks(batch.angle, batch.intensity, pending, **params)
+            for name, table in detected.partition_by("pattern", as_dict=True, maintain_order=True).items():
+                tables[name[0]] = table.drop("pattern")
+            for name in pending:
+                if tables[name] is None:
+                    tables[name] = detected.clear().drop("pattern")
+                self.stage_cache.put(keys[name], tables[name])
+        if not patterns:
+            return pl.DataFrame(schema=PEAK_TABLE_SCHEMA)
+        return pl.concat(
+            [tables[name].select(pl.lit(name, dtype=pl.String).alias("pattern"), pl.all()) for name in patterns],
+            how="vertical",
+        )
+
+    def _basis(self, basis_key: str, phases: dict[str, StageResult]) -> tuple[ReferenceBasis, list[str]]:
+        # the basis of the measured phases, with the names of the phases left out
+        cached = self._bases.get(basis_key)
+        if cached is None:
+            measured, unmeasured = measured_phases(phases)
+            cached = (ReferenceBasis.from_patterns({phase: pattern.value for phase, pattern in measured.items()}), unmeasured)
+            self._bases.put(basis_key, cached)
+        return cached
+
+    @staticmethod
+    def _composition_key(pattern: StageResult, phases: dict[str, StageResult]) -> str:
+        return stage_key("composition", (pattern.key, *(phase.key for phase in phases.values())), phases=tuple(phases))
+
+    def process_batch(
+        self,
+        items: list[tuple[StageResult, StageResult | None, tuple[float, float]]],
+        max_half_window: int = 40,
+        smooth_half_window: int = 3,
+    ) -> list[StageResult | None]:
+        """
+        Runs blank subtraction, normalization and baseline removal for many resampled patterns on the common angle
+        grid: blank subtraction and normalization as one lazy Polars plan collected once (see pxrd_lazy), the
+        baselines as a matrix fitted in a process pool. Every row is cached under the same keys as the single pattern
+        stages, so later calls of those stages, e.g. by the plots of the notebook, are cache hits.
+
+        Args:
+            items (list): One tuple (pattern, blank or None, normalization window) per pattern.
+            max_half_window (int): The maximum half window of the SNIP baseline.
+            smooth_half_window (int): The smoothing half window of the SNIP baseline.
+
+        Returns:
+            list[StageResult | None]: The baseline corrected pattern of every item. Patterns without finite
+            intensity within their normalization window are reported in a warning and give None.
+
+        Raises:
+            ValueError: If the patterns and the blanks do not share the same angle grid.
+        """
+        keys = []
+        results: list[StageResult | None] = [None] * len(items)
+        pending = []
+        for i, (pattern, blank, window) in enumerate(items):
+            subtracted = stage_key("blank_subtraction", (pattern.key, blank.key)) if blank is not None else pattern.key
+            normalized = stage_key("normalization", (subtracted,), window=(float(window[0]), float(window[1])))
+            baseline = stage_key(
+                "baseline", (normalized,), max_half_window=max_half_window, smooth_half_window=smooth_half_window
+            )
+            keys.append((subtracted, normalized, baseline))
+            value = self.stage_cache.get(baseline)
+            if value is not None:
+                results[i] = StageResult(baseline, value)
+                continue
+            pending.append(i)
+        if not pending:
+            return results
+
+        batch = PXRDBatch.from_patterns([items[i][0].value for i in pending])
+        # every distinct blank is passed once, the patterns refer to it by its row
+        blank_rows: dict[str, int] = {}
+        blanks = []
+        for i in pending:
+            blank = items[i][1]
+            if blank is not None and blank.key not in blank_rows:
+                if not np.array_equal(blank.value[:, 0], batch.angle):
+                    raise ValueError("The patterns and the blanks do not share the same angle grid")
+                blank_rows[blank.key] = len(blanks)
+                blanks.append(blank.value[:, 1])
+        rows = np.array([blank_rows[items[i][1].key] if items[i][1] is not None else -1 for i in pending])
+        windows = np.array([items[i][2] for i in pending], dtype=float)
+        subtracted, normalized = subtract_and_normalize(
+            batch, np.array(blanks).reshape(-1, len(batch.angle)), rows, windows
+        )
+        # a window without measured intensity, e.g. beyond the measured angle range, makes the whole pattern NaN
+        valid = np.ones(len(pending), dtype=bool)
+        valid[empty_windows(subtracted, windows)] = False
+        if not valid.all():
+            warnings.warn(
+                f"Skipped the patterns of items {[i for i, ok in zip(pending, valid) if not ok]}, they have no finite "
+                f"intensity within their normalization window"
+            )
+        corrected = np.full_like(normalized.intensity, np.nan)
+        if valid.any():
+            corrected[valid] = fit_baseline_matrix(
+                normalized.angle, normalized.intensity[valid], "snip", self.max_workers,
+                max_half_window=max_half_window, smooth_half_window=smooth_half_window,
+            )
+        corrected = PXRDBatch(normalized.angle, corrected)
+
+        for row, i in enumerate(pending):
+            subtracted_key, normalized_key, baseline_key = keys[i]
+            if items[i][1] is not None:
+                self.stage_cache.put(subtracted_key, subtracted.pattern(row))
+            if not valid[row]:
+                continue
+            self.stage_cache.put(normalized_key, normalized.pattern(row))
+            results[i] = StageResult(baseline_key, corrected.pattern(row))
+            self.stage_cache.put(baseline_key, results[i].value)
+        return results
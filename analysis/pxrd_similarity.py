@@ -0,0 +1,186 @@
+import os
+import sys
+
+import numpy as np
+import polars as pl
+
+# the JXDL and PXRD file handling is shared with the data model
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data-model"))
+from generated.jxdl_data_structure import JXDLSchema  # noqa: E402
+from jxdl_api import find_corresponding_pxrd_files, get_synthesis_by_experiment_id  # noqa: E402
+from pxrd_collector import PXRDFile, PXRDFileIndex  # noqa: E402
+
+from pxrd_cli import find_blank, normalization_window  # noqa: E402
+from pxrd_pipeline import PXRDPipeline, StageResult  # noqa: E402
+
+
+class SimilaritySearch:
+    """
+    k-nearest-neighbour search over a library of patterns on a common angle grid. The library is normalized once,
+    so a query is one blocked matrix product. For large libraries the vectors can be stored as float32 and
+    compressed with PCA, e.g. 10^5 patterns with 64 components answer a query in a few milliseconds.
+    """
+
+    def __init__(
+        self,
+        names: list[str],
+        intensity: np.ndarray,
+        metric: str = "cosine",
+        dtype: type = np.float32,
+        n_components: int | None = None,
+        block_size: int = 16384,
+    ):
+        """
+        Normalizes the library.
+
+        Args:
+            names (list[str]): The pattern IDs.
+            intensity (np.ndarray): The corrected, resampled intensities of shape (N, M). NaN counts as zero.
+            metric (str): "cosine" or "pearson" (cosine of the mean-centered intensities).
+            dtype (type): The type of the stored vectors, float32 halves memory and matrix product time.
+            n_components (int | None): The number of principal components to compress the vectors to. If None, the
+                full intensities are used.
+            block_size (int): The number of library patterns multiplied with the query at once.
+
+        Raises:
+            ValueError: If the metric is unknown.
+        """
+        if metric not in ("cosine", "pearson"):
+            raise ValueError(f"Unknown similarity metric: {metric}")
+        self.names = list(names)
+        self.metric = metric
+        self.dtype = dtype
+        self.block_size = block_size
+        self.components = None
+        vectors = self._standardize(intensity)
+        if n_components is not None:
+            # the principal axes of a random subset of the library are good enough to compress all of it
+            rng = np.random.default_rng(0)
+            subset = vectors[rng.choice(len(vectors), min(len(vectors), 4096), replace=False)]
+            self.components = np.linalg.svd(subset, full_matrices=False)[2][:n_components]
+            vectors = self._normalize(vectors @ self.components.T)
+        self.vectors = vectors.astype(dtype)
+
+    @classmethod
+    def from_patterns(cls, patterns: dict[str, np.ndarray], **kwargs) -> "SimilaritySearch":
+        """
+        Builds the search over patterns of shape (M, 2) on the same angle grid, see __init__ for the options.
+        """
+        return cls(list(patterns), np.vstack([pattern[:, 1] for pattern in patterns.values()]), **kwargs)
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norm = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return np.divide(vectors, norm, out=np.zeros_like(vectors), where=norm > 0)
+
+    def _standardize(self, intensity: np.ndarray) -> np.ndarray:
+        intensity = np.atleast_2d(np.asarray(intensity, dtype=float))
+        if self.metric == "pearson":
+            intensity = intensity - np.nanmean(intensity, axis=1, keepdims=True)
+        return self._normalize(np.nan_to_num(intensity, nan=0.0))
+
+    def query(self, intensity: np.ndarray, k: int = 10) -> pl.DataFrame:
+        """
+        Finds the k most similar library patterns of every query pattern.
+
+        Args:
+            intensity (np.ndarray): The corrected, resampled intensities of the query patterns, of shape (M,) or (Q, M).
+            k (int): The number of neighbours per query.
+
+        Returns:
+            pl.DataFrame: One row per query and neighbour with the columns query (the row of the query),
+            rank (starting at 1), pattern and similarity.
+        """
+        queries = self._standardize(intensity)
+        if self.components is not None:
+            queries = self._normalize(queries @ self.components.T)
+        queries = queries.astype(self.dtype)
+        k = min(k, len(self.vectors))
+        if k <= 0:
+            # an empty library has no neighbours
+            return pl.DataFrame(schema={"query": pl.Int64, "rank": pl.Int64, "pattern": pl.String, "similarity": pl.Float64})
+
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=self.dtype)
+        best_indices = np.empty((len(queries), 0), dtype=np.intp)
+        for start in range(0, len(self.vectors), self.block_size):
+            block = self.vectors[start:start + self.block_size]
+            scores = np.hstack([best_scores, queries @ block.T])
+            indices = np.hstack([
+                best_indices, np.broadcast_to(np.arange(start, start + len(block)), (len(queries), len(block)))
+            ])
+            if scores.shape[1] > k:
+                # keep the k best of the previous blocks and this block
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                scores, indices = np.take_along_axis(scores, top, axis=1), np.take_along_axis(indices, top, axis=1)
+            best_scores, best_indices = scores, indices
+
+        order = np.argsort(-best_scores, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_indices = np.take_along_axis(best_indices, order, axis=1)
+        return pl.DataFrame({
+            "query": np.repeat(np.arange(len(queries)), k),
+            "rank": np.tile(np.arange(1, k + 1), len(queries)),
+            "pattern": [self.names[i] for i in best_indices.ravel()],
+            "similarity": best_scores.ravel().astype(float),
+        })
+
+    def query_experiment(
+        self,
+        jxdl: JXDLSchema,
+        experiment_id: str,
+        pipeline: PXRDPipeline,
+        pxrd_files: list[PXRDFile],
+        k: int = 10,
+        max_half_window: int = 40,
+        smooth_half_window: int = 3,
+    ) -> pl.DataFrame:
+        """
+        Finds the k most similar library patterns of every PXRD pattern characterizing the product of an experiment.
+        The patterns are corrected like the library: converted to the target source, resampled, blank subtracted,
+        normalized and without their SNIP baseline, with the pipeline stages and their cache.
+
+        Args:
+            jxdl (JXDLSchema): The JXDL data, see jxdl_api.load_jxdl.
+            experiment_id (str): The experiment ID, e.g. "KE-008".
+            pipeline (PXRDPipeline): The pipeline the library was corrected with.
+            pxrd_files (list[PXRDFile]): The sample and blank PXRD files, e.g. the output of collect_pxrd_files. The
+                files referenced in the JXDL file are matched by file name.
+            k (int): The number of neighbours per pattern.
+            max_half_window (int): The maximum half window of the SNIP baseline.
+            smooth_half_window (int): The smoothing half window of the SNIP baseline.
+
+        Returns:
+            pl.DataFrame: The columns of query, with the file name of the pattern as query. Empty if the experiment
+            is unknown or none of its files can be corrected, e.g. because they are missing, of an unknown X-ray
+            source or without intensity within their normalization window.
+        """
+        synthesis = get_synthesis_by_experiment_id(jxdl, experiment_id)
+        references = find_corresponding_pxrd_files(synthesis) if synthesis is not None else []
+        by_name = {os.path.basename(pxrd_file.path): pxrd_file for pxrd_file in pxrd_files}
+        index = PXRDFileIndex(pxrd_files)
+
+        def load(pxrd_file):
+            with open(pxrd_file.path, 'rb') as f:
+                pattern = pipeline.load(f.read())
+            return pipeline.resample(pipeline.convert_wavelength(pattern, pxrd_file.xray_source))
+
+        names, items = [], []
+        for reference in references:
+            pxrd_file = by_name.get(os.path.basename(reference.path))
+            window = normalization_window(pxrd_file, pipeline.target_source) if pxrd_file is not None else None
+            if window is None:
+                continue
+            blank = find_blank(index, pxrd_file)
+            names.append(os.path.basename(pxrd_file.path))
+            items.append((load(pxrd_file), load(blank) if blank else None, window))
+        corrected: list[StageResult | None] = (
+            pipeline.process_batch(items, max_half_window, smooth_half_window) if items else []
+        )
+        # patterns skipped by process_batch are reported there
+        names = [name for name, pattern in zip(names, corrected) if pattern is not None]
+        corrected = [pattern for pattern in corrected if pattern is not None]
+        if not corrected:
+            return pl.DataFrame(schema={"query": pl.String, "rank": pl.Int64, "pattern": pl.String, "similarity": pl.Float64})
+
+        result = self.query(np.vstack([pattern.value[:, 1] for pattern in corrected]), k)
+        return result.with_columns(pl.Series("query", [names[i] for i in result["query"]], dtype=pl.String))
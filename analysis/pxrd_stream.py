@@ -0,0 +1,248 @@
+import argparse
+import os
+import sys
+from typing import Iterable, Iterator
+
+import numpy as np
+import polars as pl
+
+# the PXRD file handling is shared with the data model
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data-model"))
+from pxrd_archive import INDEX_ATTRIBUTES, PXRDArchive  # noqa: E402
+from pxrd_collector import PXRDFile, PXRDFileIndex, collect_pxrd_file_paths  # noqa: E402
+from pxrd_reader import read_pxrd_files  # noqa: E402
+
+from pxrd_baseline import pattern_hash  # noqa: E402
+from pxrd_cli import find_blank, normalization_window  # noqa: E402
+from pxrd_grid import AngleGrid, GridResampler  # noqa: E402
+from pxrd_pipeline import PXRDPipeline, StageCache, StageResult  # noqa: E402
+
+# The metadata columns of the streamed results, followed by the corrected intensities on the common angle grid
+STREAM_METADATA_SCHEMA = {
+    "path": pl.String,
+    **{attribute: pl.String for attribute in INDEX_ATTRIBUTES},
+    "blank": pl.String,
+}
+
+
+def iter_file_chunks(paths: list[str], chunk_size: int = 256, max_workers: int | None = None) -> Iterator[list[tuple[PXRDFile, np.ndarray]]]:
+    """
+    Reads PXRD files chunk by chunk, e.g. the output of collect_pxrd_file_paths. Only one chunk of patterns is in
+    memory at a time. Files that cannot be read or whose names do not follow the PXRD file name pattern are skipped.
+
+    Args:
+        paths (list[str]): The paths of the PXRD files.
+        chunk_size (int): The number of files per chunk.
+        max_workers (int | None): The number of reader threads per chunk.
+
+    Yields:
+        list[tuple[PXRDFile, np.ndarray]]: The PXRD files of a chunk with their patterns of shape (N, 2).
+    """
+    for start in range(0, len(paths), chunk_size):
+        stack = read_pxrd_files(paths[start:start + chunk_size], max_workers=max_workers)
+        chunk = []
+        for i, path in enumerate(stack.paths):
+            try:
+                chunk.append((PXRDFile(path), stack.pattern(i)))
+            except ValueError:
+                continue
+        yield chunk
+
+
+def iter_archive_chunks(archive: PXRDArchive, chunk_size: int = 256) -> Iterator[list[tuple[PXRDFile, np.ndarray]]]:
+    """
+    Reads the patterns of a packed archive chunk by chunk. The patterns are views into the memory-mapped archive,
+    so only the pages of the current chunk are read from disk.
+
+    Args:
+        archive (PXRDArchive): The packed archive.
+        chunk_size (int): The number of patterns per chunk.
+
+    Yields:
+        list[tuple[PXRDFile, np.ndarray]]: The PXRD files of a chunk with their patterns of shape (N, 2).
+    """
+    for start in range(0, len(archive), chunk_size):
+        yield [
+            (PXRDFile.from_metadata(archive.entries[i]["path"], archive.entries[i]), archive.pattern(i))
+            for i in range(start, min(start + chunk_size, len(archive)))
+        ]
+
+
+class ParquetSink:
+    """
+    Writes the results of a stream as one Parquet file per chunk into a directory, so nothing has to be kept in
+    memory until the end. All parts are read back as one table with scan().
+    """
+
+    def __init__(self, directory: str):
+        """
+        Initializes the sink. Parts of an earlier run in the directory are removed.
+
+        Args:
+            directory (str): The output directory.
+        """
+        self.directory = directory
+        self.parts = 0
+        os.makedirs(directory, exist_ok=True)
+        for file_name in os.listdir(directory):
+            if file_name.startswith("part-") and file_name.endswith(".parquet"):
+                os.remove(os.path.join(directory, file_name))
+
+    def write(self, frame: pl.DataFrame):
+        """
+        Writes the frame of one chunk as the next part.
+        """
+        path = os.path.join(self.directory, f"part-{self.parts:06d}.parquet")
+        # a part only appears under its final name when it is complete
+        frame.write_parquet(path + ".tmp")
+        os.replace(path + ".tmp", path)
+        self.parts += 1
+
+    def write_grid(self, angle: np.ndarray):
+        """
+        Writes the common angle grid of the intensities.
+        """
+        pl.DataFrame({"angle": angle}).write_parquet(os.path.join(self.directory, "angle.parquet"))
+
+    def scan(self) -> pl.LazyFrame:
+        """
+        Returns all parts written so far as one lazy frame.
+        """
+        return pl.scan_parquet(os.path.join(self.directory, "part-*.parquet"))
+
+
+def stream_corrected(
+    chunks: Iterable[list[tuple[PXRDFile, np.ndarray]]],
+    pipeline: PXRDPipeline,
+    blanks: list[tuple[PXRDFile, np.ndarray]],
+    max_half_window: int = 40,
+    smooth_half_window: int = 3,
+) -> Iterator[pl.DataFrame]:
+    """
+    Runs every chunk through wavelength conversion, resampling, blank subtraction, normalization and baseline removal
+    as one batch. Blanks themselves, files of an unknown X-ray source and patterns without intensity within their
+    normalization window are left out.
+
+    Args:
+        chunks (Iterable[list[tuple[PXRDFile, np.ndarray]]]): The chunks, see iter_file_chunks and iter_archive_chunks.
+        pipeline (PXRDPipeline): The pipeline. Its stage cache should only keep results in memory and be bounded,
+            so memory does not grow with the number of chunks.
+        blanks (list[tuple[PXRDFile, np.ndarray]]): The blank files with their patterns, matched to the samples by
+            X-ray source and sample holder.
+        max_half_window (int): The maximum half window of the SNIP baseline.
+        smooth_half_window (int): The smoothing half window of the SNIP baseline.
+
+    Yields:
+        pl.DataFrame: The metadata of every file of the chunk, the path of its blank and the corrected intensities
+        on the common angle grid as an array column.
+    """
+    def load(pxrd_file, pattern):
+        # the patterns are not parsed from bytes here, so they are keyed by the hash of the array
+        loaded = StageResult(pattern_hash(pattern), np.asarray(pattern))
+        return pipeline.resample(pipeline.convert_wavelength(loaded, pxrd_file.xray_source))
+
+    blank_index = PXRDFileIndex([blank for blank, _ in blanks])
+    loaded_blanks = {blank.path: load(blank, pattern) for blank, pattern in blanks}
+    size = len(pipeline.resampler.grid.angle)
+
+    for chunk in chunks:
+        items = []
+        for pxrd_file, pattern in chunk:
+            window = normalization_window(pxrd_file, pipeline.target_source)
+            if pxrd_file.experiment_id == "Blank" or window is None:
+                continue
+            blank = find_blank(blank_index, pxrd_file)
+            items.append((pxrd_file, blank, load(pxrd_file, pattern), window))
+        corrected = pipeline.process_batch(
+            [(loaded, loaded_blanks[blank.path] if blank else None, window) for _, blank, loaded, window in items],
+            max_half_window=max_half_window,
+            smooth_half_window=smooth_half_window,
+        ) if items else []
+        # patterns skipped by process_batch are reported there
+        kept = [(item, result) for item, result in zip(items, corrected) if result is not None]
+        items, corrected = [item for item, _ in kept], [result for _, result in kept]
+
+        frame = pl.DataFrame(
+            [
+                {"path": pxrd_file.path}
+                | {attribute: getattr(pxrd_file, attribute) for attribute in INDEX_ATTRIBUTES}
+                | {"blank": os.path.basename(blank.path) if blank else None}
+                for pxrd_file, blank, _, _ in items
+            ],
+            schema=STREAM_METADATA_SCHEMA,
+        )
+        intensity = np.vstack([result.value[:, 1] for result in corrected]) if corrected else np.empty((0, size))
+        yield frame.with_columns(pl.Series("intensity", intensity, dtype=pl.Array(pl.Float64, size)))
+
+
+def stream_to_parquet(
+    chunks: Iterable[list[tuple[PXRDFile, np.ndarray]]],
+    output_dir: str,
+    blanks: list[tuple[PXRDFile, np.ndarray]],
+    grid: AngleGrid | None = None,
+    chunk_size: int = 256,
+    max_workers: int | None = None,
+    **baseline_params,
+) -> ParquetSink:
+    """
+    Corrects all patterns of the chunks and writes the results chunk by chunk, so memory stays bounded by the chunk
+    size regardless of the size of the archive.
+
+    Args:
+        chunks (Iterable[list[tuple[PXRDFile, np.ndarray]]]): The chunks, see iter_file_chunks and iter_archive_chunks.
+        output_dir (str): The output directory of the Parquet parts.
+        blanks (list[tuple[PXRDFile, np.ndarray]]): The blank files with their patterns.
+        grid (AngleGrid | None): The common angle grid. If None, the grid of the notebook is used.
+        chunk_size (int): The chunk size of the chunks, the in-memory stage cache keeps a few chunks.
+        max_workers (int | None): The number of processes fitting baselines.
+        **baseline_params: The SNIP parameters, see stream_corrected.
+
+    Returns:
+        ParquetSink: The sink, its scan() returns all results.
+    """
+    pipeline = PXRDPipeline(
+        xyd_cache=None,
+        stage_cache=StageCache(max_entries=4 * chunk_size),
+        resampler=GridResampler(grid if grid is not None else AngleGrid(start=0.9, stop=80.0, step=0.015)),
+        max_workers=max_workers,
+    )
+    sink = ParquetSink(output_dir)
+    sink.write_grid(pipeline.resampler.grid.angle)
+    for frame in stream_corrected(chunks, pipeline, blanks, **baseline_params):
+        sink.write(frame)
+    return sink
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(
+        description="Corrects all PXRD patterns of a directory or a packed archive chunk by chunk into Parquet parts."
+    )
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--pxrd-dir", default=os.path.join("..", "data", "PXRD"), help="the directory with the PXRD files")
+    source.add_argument("--archive", help="the packed archive without extension, e.g. ../data/generated/pxrd_archive")
+    parser.add_argument("--output", default="pxrd_corrected", help="the output directory of the Parquet parts")
+    parser.add_argument("--chunk-size", type=int, default=256, help="the number of patterns processed at once")
+    parser.add_argument("--workers", type=int, default=None, help="the number of processes fitting baselines, all cores by default")
+    args = parser.parse_args(argv)
+
+    if args.archive:
+        archive = PXRDArchive(args.archive)
+        blanks = [
+            (PXRDFile.from_metadata(entry["path"], entry), archive.pattern(i))
+            for i, entry in enumerate(archive.entries) if entry["experiment_id"] == "Blank"
+        ]
+        chunks = iter_archive_chunks(archive, args.chunk_size)
+    else:
+        paths = sorted(collect_pxrd_file_paths(args.pxrd_dir))
+        blanks = [
+            pattern for chunk in iter_file_chunks([path for path in paths if os.path.basename(path).startswith("PXRD_Blank_")])
+            for pattern in chunk
+        ]
+        chunks = iter_file_chunks(paths, args.chunk_size)
+
+    sink = stream_to_parquet(chunks, args.output, blanks, chunk_size=args.chunk_size, max_workers=args.workers)
+    print(f"{sink.scan().select(pl.len()).collect().item()} patterns corrected into {sink.parts} parts in {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,323 @@
+import argparse
+import itertools
+import json
+import os
+import sys
+from dataclasses import dataclass, field
+from typing import Callable
+
+import numpy as np
+import polars as pl
+
+# the PXRD file handling is shared with the data model
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data-model"))
+from pxrd_collector import PXRDFileIndex, collect_pxrd_files  # noqa: E402
+
+from pxrd_baseline import fit_baselines  # noqa: E402
+from pxrd_cli import NORMALIZATION_WINDOWS, create_pipeline, find_blank, source_window  # noqa: E402
+from pxrd_composition import ReferenceBasis  # noqa: E402
+from pxrd_pipeline import PXRDPipeline, StageResult  # noqa: E402
+
+# The grid swept if no grid file is given: the SNIP parameters of the notebook around their defaults, an
+# asymmetric least squares baseline and the default normalization windows
+DEFAULT_GRID = {
+    "baselines": {
+        "snip": {"max_half_window": [20, 40, 80], "smooth_half_window": [0, 3]},
+        "asls": {"lam": [1e5, 1e7], "p": [0.001, 0.01]},
+    },
+    "windows": {element: [window] for element, window in NORMALIZATION_WINDOWS.items()},
+}
+
+RESULTS_SCHEMA = {
+    "setting": pl.UInt32,
+    "algorithm": pl.String,
+    "parameters": pl.String,
+    "windows": pl.String,
+    "sample": pl.String,
+    "score": pl.Float64,
+}
+
+
+@dataclass
+class SweepSetting:
+    """
+    One point of the sweep grid: a pybaselines algorithm with its parameters and the normalization windows by
+    anode element, in angles of that element.
+    """
+
+    algorithm: str
+    params: dict = field(default_factory=dict)
+    windows: dict[str, tuple[float, float]] = field(default_factory=lambda: dict(NORMALIZATION_WINDOWS))
+
+
+@dataclass
+class SweepItem:
+    """
+    A resampled pattern in angles of the target source, with its resampled blank and its X-ray source.
+    """
+
+    name: str
+    pattern: StageResult
+    blank: StageResult | None
+    xray_source: str
+
+
+def setting_grid(
+    baselines: dict[str, dict[str, list]], windows: dict[str, list[tuple[float, float]]]
+) -> list[SweepSetting]:
+    """
+    Expands the parameter lists into every combination of baseline parameters and normalization windows.
+
+    Args:
+        baselines (dict[str, dict[str, list]]): The values of every parameter by algorithm, e.g.
+            {"snip": {"max_half_window": [20, 40], "smooth_half_window": [0, 3]}}.
+        windows (dict[str, list[tuple[float, float]]]): The candidate windows by anode element, e.g.
+            {"Cu": [(38, 40), (30, 32)], "Co": [(1.5, 1.8)]}.
+
+    Returns:
+        list[SweepSetting]: The settings of the grid.
+    """
+    window_sets = [
+        dict(zip(windows, (tuple(map(float, window)) for window in combination)))
+        for combination in itertools.product(*windows.values())
+    ]
+    settings = []
+    for algorithm, params in baselines.items():
+        for values in itertools.product(*params.values()):
+            for window_set in window_sets:
+                settings.append(SweepSetting(algorithm, dict(zip(params, values)), window_set))
+    return settings
+
+
+def negative_area_fraction(samples: np.ndarray, references: np.ndarray | None = None) -> np.ndarray:
+    """
+    Scores baseline corrected patterns by the area below zero relative to their total absolute area. A baseline
+    running above the background leaves negative intensities, so lower is better. A baseline below the background
+    noise scores 0 however much background it leaves, e.g. SNIP without smoothing, and asymmetric least squares
+    always leaves the fraction p below zero, so the score only compares baselines through the noise, e.g. SNIP with
+    smoothing; see background_error.
+
+    Args:
+        samples (np.ndarray): The corrected intensities of shape (N, M). NaN values are ignored.
+        references (np.ndarray | None): Not used.
+
+    Returns:
+        np.ndarray: The score of every sample, between 0 and 1.
+    """
+    negative = np.nansum(np.clip(-samples, 0, None), axis=1)
+    return negative / np.nansum(np.abs(samples), axis=1)
+
+
+def background_error(samples: np.ndarray, references: np.ndarray | None = None) -> np.ndarray:
+    """
+    Scores baseline corrected patterns by the background they still contain or lost, relative to their total
+    absolute area. Most angles of a pattern are background, so the median of the corrected intensity is the
+    background left over by a baseline running below it. A baseline running above the background is counted by the
+    area more than three noise levels below zero; the noise level comes from the differences of neighbouring points.
+    Unlike the negative area, noise alone does not lower the score of a baseline that stays below it. Lower is better.
+
+    Args:
+        samples (np.ndarray): The corrected intensities of shape (N, M). NaN values are ignored.
+        references (np.ndarray | None): Not used.
+
+    Returns:
+        np.ndarray: The score of every sample, 0 for a baseline through the middle of the background noise.
+    """
+    differences = np.diff(samples, axis=1)
+    deviation = np.nanmedian(np.abs(differences - np.nanmedian(differences, axis=1, keepdims=True)), axis=1)
+    noise = 1.4826 * deviation / np.sqrt(2)
+    overshoot = np.nansum(np.clip(-samples - 3 * noise[:, np.newaxis], 0, None), axis=1)
+    left_over = np.clip(np.nanmedian(samples, axis=1), 0, None) * np.isfinite(samples).sum(axis=1)
+    return (overshoot + left_over) / np.nansum(np.abs(samples), axis=1)
+
+
+def composition_residual(samples: np.ndarray, references: np.ndarray | None) -> np.ndarray:
+    """
+    Scores baseline corrected patterns by the relative residual of their fit against the references corrected with
+    the same setting. References without measured intensities under a setting are left out. Lower is better.
+
+    Args:
+        samples (np.ndarray): The corrected intensities of shape (N, M).
+        references (np.ndarray | None): The corrected reference intensities of shape (k, M).
+
+    Returns:
+        np.ndarray: The relative residual norm of every sample.
+
+    Raises:
+        ValueError: If no references are given.
+    """
+    if references is None or not len(references):
+        raise ValueError("The residual metric needs references")
+    references = references[np.isfinite(references).any(axis=1)]
+    if not len(references):
+        return np.full(len(samples), np.nan)
+    return ReferenceBasis([str(i) for i in range(len(references))], references).solve(samples)[1]
+
+
+# The quality metrics of the sweep by name; every metric scores the samples of a setting, lower is better
+METRICS: dict[str, Callable[[np.ndarray, np.ndarray | None], np.ndarray]] = {
+    "background": background_error,
+    "negative_area": negative_area_fraction,
+    "residual": composition_residual,
+}
+
+
+def sweep(
+    pipeline: PXRDPipeline,
+    samples: list[SweepItem],
+    settings: list[SweepSetting],
+    references: list[SweepItem] | None = None,
+    metric: str | Callable[[np.ndarray, np.ndarray | None], np.ndarray] | None = None,
+) -> pl.DataFrame:
+    """
+    Corrects the samples (and references) with every setting and scores the result. The blank subtraction and the
+    normalization are pipeline stages, so they are computed once per window set and taken from the stage cache
+    on later runs. The baselines are fitted in the process pool of the pipeline and cached as well.
+
+    Args:
+        pipeline (PXRDPipeline): The pipeline, see pxrd_cli.create_pipeline.
+        samples (list[SweepItem]): The samples the settings are scored on.
+        settings (list[SweepSetting]): The settings, see setting_grid.
+        references (list[SweepItem] | None): The pure phase references, needed by the residual metric.
+        metric (str | Callable | None): The name of a metric in METRICS or a function scoring the corrected samples
+            of shape (N, M) given the corrected references of shape (k, M) or None. If None, the residual metric is
+            used with references and the background metric without.
+
+    Returns:
+        pl.DataFrame: One row per setting and sample with the columns of RESULTS_SCHEMA.
+
+    Raises:
+        ValueError: If the metric is unknown or a setting has no normalization window for an X-ray source.
+    """
+    if metric is None:
+        metric = "residual" if references else "background"
+    if isinstance(metric, str):
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric: {metric}")
+        metric = METRICS[metric]
+    items = [*samples, *(references or [])]
+
+    normalized: dict[tuple, list[StageResult]] = {}
+    rows = []
+    for index, setting in enumerate(settings):
+        window_key = tuple(sorted(setting.windows.items()))
+        if window_key not in normalized:
+            normalized[window_key] = []
+            for item in items:
+                window = source_window(item.xray_source, pipeline.target_source, setting.windows)
+                if window is None:
+                    raise ValueError(f"No normalization window for {item.name} measured with {item.xray_source}")
+                normalized[window_key].append(
+                    pipeline.normalize(pipeline.subtract_blank(item.pattern, item.blank), window)
+                )
+
+        corrected = fit_baselines(
+            [pattern.value for pattern in normalized[window_key]],
+            setting.algorithm,
+            pipeline.max_workers,
+            cache=pipeline.stage_cache,
+            **setting.params,
+        )
+        intensity = np.vstack([pattern[:, 1] for pattern in corrected])
+        scores = metric(intensity[:len(samples)], intensity[len(samples):] if references else None)
+        parameters, windows = json.dumps(setting.params, sort_keys=True), json.dumps(setting.windows, sort_keys=True)
+        rows.extend(
+            {
+                "setting": index,
+                "algorithm": setting.algorithm,
+                "parameters": parameters,
+                "windows": windows,
+                "sample": item.name,
+                "score": float(score),
+            }
+            for item, score in zip(samples, scores)
+        )
+    return pl.DataFrame(rows, schema=RESULTS_SCHEMA)
+
+
+def rank_settings(results: pl.DataFrame) -> pl.DataFrame:
+    """
+    Ranks the settings of a sweep by their mean score over all samples, the best setting first. The worst score of
+    every setting shows whether a setting fails for single samples; samples that could not be scored, e.g. because
+    their measured range misses the normalization window, are counted as failed.
+    """
+    return (
+        results.with_columns(pl.col("score").fill_nan(None))
+        .group_by("setting", "algorithm", "parameters", "windows")
+        .agg(
+            mean_score=pl.col("score").mean(),
+            max_score=pl.col("score").max(),
+            failed=pl.col("score").null_count(),
+        )
+        .sort("failed", "mean_score", "setting")
+    )
+
+
+def load_items(pipeline: PXRDPipeline, pxrd_files: list, blanks: PXRDFileIndex) -> list[SweepItem]:
+    """
+    Loads, converts and resamples PXRD files with their blanks for a sweep. Blanks themselves and files of an
+    unknown X-ray source are left out.
+
+    Args:
+        pipeline (PXRDPipeline): The pipeline.
+        pxrd_files (list[PXRDFile]): The sample or reference files.
+        blanks (PXRDFileIndex): The index of the files containing the blanks.
+
+    Returns:
+        list[SweepItem]: The items by file name.
+    """
+    loaded: dict[str, StageResult] = {}
+
+    def load(pxrd_file):
+        if pxrd_file.path not in loaded:
+            with open(pxrd_file.path, 'rb') as f:
+                pattern = pipeline.load(f.read())
+            loaded[pxrd_file.path] = pipeline.resample(pipeline.convert_wavelength(pattern, pxrd_file.xray_source))
+        return loaded[pxrd_file.path]
+
+    items = []
+    for pxrd_file in pxrd_files:
+        if pxrd_file.experiment_id == "Blank" or pxrd_file.xray_source is None:
+            continue
+        blank = find_blank(blanks, pxrd_file)
+        items.append(SweepItem(
+            os.path.basename(pxrd_file.path), load(pxrd_file), load(blank) if blank else None, pxrd_file.xray_source
+        ))
+    return items
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(
+        description="Scores a grid of baseline algorithms, their parameters and normalization windows on PXRD samples."
+    )
+    parser.add_argument("--pxrd-dir", default=os.path.join("..", "data", "PXRD"), help="the directory with the sample and blank PXRD files")
+    parser.add_argument("--references", help="the directory with the pure phase PXRD files, needed by the residual metric")
+    parser.add_argument("--grid", help="a JSON file with the parameter lists by algorithm under \"baselines\" and the windows by anode element under \"windows\", see DEFAULT_GRID")
+    parser.add_argument("--metric", choices=list(METRICS), help="the quality metric, lower is better; residual with --references, background otherwise")
+    parser.add_argument("--output", default="pxrd_sweep.parquet", help="the Parquet file for the score of every setting and sample")
+    parser.add_argument("--workers", type=int, default=None, help="the number of processes fitting baselines, all cores by default")
+    parser.add_argument("--cache-dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"), help="the cache directory, shared with the notebook by default")
+    args = parser.parse_args(argv)
+
+    grid = DEFAULT_GRID
+    if args.grid:
+        with open(args.grid, encoding="utf-8") as f:
+            grid = json.load(f)
+    settings = setting_grid(grid["baselines"], grid["windows"])
+
+    pipeline = create_pipeline(args.cache_dir, args.workers)
+    pxrd_files = collect_pxrd_files(args.pxrd_dir)
+    index = PXRDFileIndex(pxrd_files)
+    samples = load_items(pipeline, pxrd_files, index)
+    # references are measured in the configurations of the samples, so their blanks are in the sample directory
+    references = load_items(pipeline, collect_pxrd_files(args.references), index) if args.references else None
+
+    results = sweep(pipeline, samples, settings, references, args.metric)
+    results.write_parquet(args.output)
+    with pl.Config(tbl_rows=10, fmt_str_lengths=80):
+        print(rank_settings(results).head(10))
+    print(f"{len(settings)} settings scored on {len(samples)} samples, results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+from typing import Sequence
+
+import numpy as np
+
+# Kα1 wavelengths in Å, keyed by the values of the XRaySource enum of the JXDL data model
+WAVELENGTHS = {
+    "Co Kα1": 1.788965,
+    "Cu Kα1": 1.540562,
+}
+
+
+def wavelength(source: str) -> float:
+    """
+    Returns the wavelength of an X-ray source.
+
+    Args:
+        source (str): The X-ray source as in the JXDL file ("Co Kα1"), as in PXRD file names ("Co-Ka1", "Co-Kα1")
+            or only the anode element ("Co"), which means its Kα1 line.
+
+    Returns:
+        float: The wavelength in Å.
+
+    Raises:
+        ValueError: If the X-ray source is unknown.
+    """
+    name = source.replace("-", " ").replace("Ka", "Kα")
+    if " " not in name:
+        name += " Kα1"
+    if name not in WAVELENGTHS:
+        raise ValueError(f"Unknown X-ray source: {source}")
+    return WAVELENGTHS[name]
+
+
+def convert_two_theta(two_theta: np.ndarray, source: str | Sequence[str], target: str) -> np.ndarray:
+    """
+    Converts diffraction angles measured with one X-ray source to the angles of the same reflections with another
+    source, using Bragg's law: sin(θ_target) = λ_target / λ_source * sin(θ_source).
+
+    Args:
+        two_theta (np.ndarray): The 2θ angles in degrees, of shape (M,) or (N, M) for a batch of patterns.
+        source (str | Sequence[str]): The X-ray source of all angles, or one source per row of a batch.
+        target (str): The X-ray source to convert to.
+
+    Returns:
+        np.ndarray: The converted 2θ angles in degrees. Reflections that do not exist for the target source are NaN.
+    """
+    two_theta = np.asarray(two_theta, dtype=float)
+    if isinstance(source, str):
+        ratio = wavelength(target) / wavelength(source)
+    else:
+        ratio = wavelength(target) / np.array([wavelength(row_source) for row_source in source])[:, np.newaxis]
+    sin_theta = ratio * np.sin(np.radians(two_theta) / 2)
+    with np.errstate(invalid="ignore"):
+        return np.degrees(2 * np.arcsin(np.where(sin_theta <= 1, sin_theta, np.nan)))
@@ -1,8 +1,12 @@
 import json
 from typing import List
 
+import numpy as np
+
 from generated.jxdl_data_structure import JXDLSchema, Reagent, Synthesis, Role
+from pxrd_archive import PXRDArchive
 from pxrd_collector import PXRDFile
+from pxrd_reader import read_pxrd_file
 
 class Product:
     def __init__(self, name: str, mass: str|None, pxrd_files: List[PXRDFile]):
@@ -18,11 +22,11 @@ def load_jxdl(file_path: str) -> JXDLSchema:
 
 
 def get_synthesis_list(jxdl: JXDLSchema) -> list[Synthesis]:
-    return jxdl.jxdl_schema_xdl.synthesis
+    return jxdl.xdl.synthesis
 
 
 def get_synthesis_by_experiment_id(jxdl: JXDLSchema, experiment_id: str) -> Synthesis | None:
-    for synthesis in jxdl.jxdl_schema_xdl.synthesis:
+    for synthesis in jxdl.xdl.synthesis:
         if synthesis.metadata.description == experiment_id:
             return synthesis
     return None
@@ -59,6 +63,34 @@ def find_corresponding_pxrd_files(synthesis: Synthesis) -> List[PXRDFile]:
     return result
 
 
+def load_pxrd_pattern(pxrd_file: PXRDFile, archive: PXRDArchive | None = None) -> np.ndarray:
+    """
+    Loads the pattern of a PXRD file as an array of shape (N, 2) with the angle and the intensity.
+    If the file is part of the given packed archive, a zero-copy view into the archive is returned,
+    otherwise the file itself is parsed.
+    """
+    if archive:
+        pattern = archive.pattern_by_path(pxrd_file.path)
+        if pattern is not None:
+            return pattern
+    return read_pxrd_file(pxrd_file.path)
+
+
+def load_pxrd_patterns_by_experiment_id(jxdl: JXDLSchema, experiment_id: str, archive: PXRDArchive | None = None) -> list[tuple[PXRDFile, np.ndarray]]:
+    """
+    Loads the PXRD patterns characterizing the product of an experiment, as measured. For similarity queries the
+    patterns have to be corrected like the library first, see SimilaritySearch.query_experiment in
+    analysis/pxrd_similarity.py.
+
+    Returns:
+        list[tuple[PXRDFile, np.ndarray]]: The PXRD files with their patterns, empty if the experiment is unknown.
+    """
+    synthesis = get_synthesis_by_experiment_id(jxdl, experiment_id)
+    if synthesis is None:
+        return []
+    return [(pxrd_file, load_pxrd_pattern(pxrd_file, archive)) for pxrd_file in find_corresponding_pxrd_files(synthesis)]
+
+
 def find_product_mass(synthesis: Synthesis) -> str | None:
     # Filter characterizations by whether they have the weight attribute
     mass_characterizations = [c for c in synthesis.product_characterization if c.weight]
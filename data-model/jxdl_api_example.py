@@ -1,5 +1,8 @@
+import os
+
 import jxdl_api as api
 from generated.jxdl_data_structure import JXDLSchema, Synthesis
+from pxrd_archive import PXRDArchive
 
 jxdl_file_path = "../data/generated/jxdl.json"
 # Load JXDL file into our JXDLSchema class structure
@@ -28,3 +31,10 @@ for synthesis in synthesis_list:
     pxrd_files_per_experiment.append(len(pxrd_files))
 average_pxrd_files = sum(pxrd_files_per_experiment) / len(pxrd_files_per_experiment)
 print(f"Average number of PXRD files per experiment: {average_pxrd_files:.2f}")
+
+# Load the PXRD patterns of an experiment. With a packed archive (see pxrd_archive.py), the patterns are
+# zero-copy views into the archive instead of parsed text files.
+archive = PXRDArchive("../data/generated/pxrd_archive") if os.path.exists("../data/generated/pxrd_archive.npy") else None
+for pxrd_file in api.find_corresponding_pxrd_files(example_synthesis):
+    pattern = api.load_pxrd_pattern(pxrd_file, archive)
+    print(f"{pxrd_file.path}: {len(pattern)} points between {pattern[0, 0]}° and {pattern[-1, 0]}°")
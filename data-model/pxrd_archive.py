@@ -0,0 +1,135 @@
+import json
+import os
+
+import numpy as np
+
+from pxrd_collector import PXRDFile, collect_pxrd_file_paths
+from pxrd_reader import read_pxrd_files
+
+# Metadata of the PXRDFile stored for every pattern in the archive index
+INDEX_ATTRIBUTES = ["experiment_id", "xray_source", "sample_holder_shape", "sample_holder_diameter", "scan_rate",
+                    "angle_range", "phase_label"]
+
+
+def archive_paths(archive_path: str) -> tuple[str, str]:
+    """
+    Returns the paths of the data file and the index file of an archive.
+
+    Args:
+        archive_path (str): The path of the archive without extension, e.g. ../data/generated/pxrd_archive.
+
+    Returns:
+        tuple[str, str]: The path of the .npy data file and of the .index.json index file.
+    """
+    return archive_path + ".npy", archive_path + ".index.json"
+
+
+def pack_pxrd_archive(source_dir: str, archive_path: str, max_workers: int | None = None) -> dict[str, str]:
+    """
+    Packs all PXRD files of a directory tree into a single contiguous array file plus a small index.
+
+    The patterns are stored one after another in one .npy file of shape (total points, 2), so that readers can
+    memory-map it and get zero-copy views of any pattern. The index holds one row per pattern with the relative
+    path, the metadata parsed by PXRDFile, and the offset and length of the pattern in the array.
+
+    Args:
+        source_dir (str): The directory to search for PXRD files, e.g. ../data/PXRD.
+        archive_path (str): The path of the archive without extension.
+        max_workers (int | None): The number of reader threads.
+
+    Returns:
+        dict[str, str]: The files that could not be packed, with the reason.
+    """
+    paths = sorted(collect_pxrd_file_paths(source_dir))
+    stack = read_pxrd_files(paths, max_workers=max_workers)
+
+    entries = []
+    for path, offset, length in zip(stack.paths, stack.offsets[:-1], stack.lengths()):
+        pxrd_file = PXRDFile(path)
+        entries.append({
+            "path": os.path.relpath(path, source_dir).replace(os.sep, "/"),
+            **{attribute: getattr(pxrd_file, attribute) for attribute in INDEX_ATTRIBUTES},
+            "offset": int(offset),
+            "length": int(length),
+        })
+
+    data_path, index_path = archive_paths(archive_path)
+    os.makedirs(os.path.dirname(os.path.abspath(data_path)), exist_ok=True)
+    np.save(data_path, stack.data)
+    with open(index_path, 'w') as f:
+        json.dump({"patterns": entries}, f, indent=1, ensure_ascii=False)
+    return stack.errors
+
+
+class PXRDArchive:
+    """
+    Read access to a packed PXRD archive. The pattern data is memory-mapped, so every returned pattern is a
+    zero-copy view and only the pages of the requested patterns are read from disk.
+    """
+
+    def __init__(self, archive_path: str):
+        """
+        Opens the archive.
+
+        Args:
+            archive_path (str): The path of the archive without extension.
+        """
+        data_path, index_path = archive_paths(archive_path)
+        with open(index_path, 'r') as f:
+            self.entries: list[dict] = json.load(f)["patterns"]
+        self.data = np.load(data_path, mmap_mode='r')
+
+        self._by_file_name: dict[str, list[int]] = {}
+        self._by_experiment_id: dict[str, list[int]] = {}
+        for i, entry in enumerate(self.entries):
+            self._by_file_name.setdefault(entry["path"].rsplit("/", 1)[-1], []).append(i)
+            self._by_experiment_id.setdefault(entry["experiment_id"], []).append(i)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def pattern(self, index: int) -> np.ndarray:
+        """
+        Returns the pattern at the given index of the archive as a read-only view of shape (N, 2).
+        """
+        entry = self.entries[index]
+        return self.data[entry["offset"]:entry["offset"] + entry["length"]]
+
+    def find(self, path: str) -> int | None:
+        """
+        Finds the archive index of a PXRD file by its path, e.g. the relative file path stored in a JXDL file.
+
+        Args:
+            path (str): The path of the PXRD file. It matches an archived pattern if it ends with its relative path.
+
+        Returns:
+            int | None: The index of the pattern in the archive, or None if the file is not archived.
+        """
+        path = path.replace(os.sep, "/")
+        for i in self._by_file_name.get(path.rsplit("/", 1)[-1], []):
+            relative_path = self.entries[i]["path"]
+            if path == relative_path or path.endswith("/" + relative_path):
+                return i
+        return None
+
+    def pattern_by_path(self, path: str) -> np.ndarray | None:
+        """
+        Returns the pattern of the PXRD file with the given path, or None if the file is not archived.
+        """
+        index = self.find(path)
+        return self.pattern(index) if index is not None else None
+
+    def patterns_by_experiment_id(self, experiment_id: str) -> list[tuple[dict, np.ndarray]]:
+        """
+        Returns the index entries and patterns of all PXRD files of the given experiment.
+        """
+        return [(self.entries[i], self.pattern(i)) for i in self._by_experiment_id.get(experiment_id, [])]
+
+
+if __name__ == '__main__':
+    source_dir = os.path.join('..', 'data', 'PXRD')
+    archive_path = os.path.join('..', 'data', 'generated', 'pxrd_archive')
+    errors = pack_pxrd_archive(source_dir, archive_path)
+    print(f"Packed {len(PXRDArchive(archive_path))} PXRD files into {archive_path}")
+    for path, error in errors.items():
+        print(f"Skipped {path}: {error}")
@@ -1,9 +1,27 @@
 import os
+import re
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 from use_case_specific.pxrd_collector_mocof1 import process_pxrd_file_use_case_specific
 
 
+# File name pattern: PXRD_(experiment id)_(X-ray source)_(sample holder shape)-(sample holder diameter)_(scan rate)_(angle range)_(phase label).xyd,
+# eg. PXRD_KE-232_Co-Kα1_film-3mm_5s-deg.xyd or PXRD_KE-343_Cu-Ka1_film-3mm_3s-deg_1.5-80deg_CuOAc2-DABA.xyd
+# Everything after the experiment id is optional. The phase label is the remaining suffix, eg. MOCOF-1.
+PXRD_FILE_NAME_PATTERN = re.compile(r"""
+    ^PXRD_(?P<experiment_id>[^_]+)
+    (?:_(?P<xray_source>[A-Z][a-z]?(?:-K[aα][12]?)?)(?=_|\.xyd$))?
+    (?:_(?P<sample_holder_shape>[A-Za-z]+)(?:-(?P<sample_holder_diameter>\d+(?:\.\d+)?mm))?(?=_|\.xyd$))?
+    (?:_(?P<scan_rate>\d+(?:\.\d+)?s-deg)(?=_|\.xyd$))?
+    (?:_(?P<angle_range>\d+(?:\.\d+)?-\d+(?:\.\d+)?deg)(?=_|\.xyd$))?
+    (?:_(?P<phase_label>.+?))?
+    \.xyd$
+""", re.VERBOSE)
+
+
 class PXRDFile:
+    __slots__ = ("path", "experiment_id", "xray_source", "sample_holder_shape", "sample_holder_diameter",
+                 "scan_rate", "angle_range", "phase_label")
 
     def __init__(self, path: str):
         """
@@ -11,51 +29,94 @@ class PXRDFile:
 
         Args:
             path (str): The path to the PXRD file.
+
+        Raises:
+            ValueError: If the file name does not follow the PXRD file name pattern.
         """
         self.path = path
         file_name = os.path.basename(path)
 
-        # File name pattern: PXRD_(experiment id)_(X-ray source)_(sample holder shape)-(sample holder diameter).xyd, eg. PXRD_KE-232_Co-Kα1_film-3mm.xyd
-        # Extract experiment id, x-ray source, sample holder shape and diameter from the file name
-        file_name_parts = file_name.replace(".xyd", "").split("_")
-        self.experiment_id = file_name_parts[1]
-        self.xray_source = file_name_parts[2].replace("a","α")
-        self.sample_holder_shape = file_name_parts[3].split("-")[0]
-        self.sample_holder_diameter = file_name_parts[3].split("-")[1] if "-" in file_name_parts[3] else None
+        # Extract experiment id, x-ray source, sample holder shape and diameter, scan rate, angle range and phase label from the file name
+        match = PXRD_FILE_NAME_PATTERN.match(file_name)
+        if not match:
+            raise ValueError(f"Unexpected PXRD file name: {file_name}")
+        self.experiment_id = match["experiment_id"]
+        self.xray_source = match["xray_source"].replace("Ka", "Kα") if match["xray_source"] else None
+        self.sample_holder_shape = match["sample_holder_shape"]
+        self.sample_holder_diameter = match["sample_holder_diameter"]
+        self.scan_rate = match["scan_rate"]
+        self.angle_range = match["angle_range"]
+        self.phase_label = match["phase_label"]
         process_pxrd_file_use_case_specific(self)  # Process the PXRD file
 
+    @classmethod
+    def from_metadata(cls, path: str, metadata: dict) -> "PXRDFile":
+        """
+        Creates a PXRDFile from metadata parsed before, e.g. stored in the PXRD manifest, without parsing the file name again.
+
+        Args:
+            path (str): The path to the PXRD file.
+            metadata (dict): The attributes of the PXRDFile except the path.
 
+        Returns:
+            PXRDFile: The PXRDFile object.
+        """
+        pxrd_file = cls.__new__(cls)
+        pxrd_file.path = path
+        for attribute in cls.__slots__[1:]:
+            setattr(pxrd_file, attribute, metadata[attribute])
+        return pxrd_file
 
-def collect_pxrd_file_paths(path: str) -> list:
+    def __repr__(self):
+        return f"PXRDFile({self.path!r})"
+
+
+def collect_pxrd_file_paths(path: str, max_workers: int | None = None) -> list:
     """
     Collects all PXRD files from the given directory and its subdirectories.
+    The directories of each level of the tree are listed in parallel, which pays off on network shares.
 
     Args:
         path (str): The path to the directory to search for PXRD files.
+        max_workers (int | None): The number of threads listing directories. If None, the default of ThreadPoolExecutor is used.
 
     Returns:
         list: A list of paths to the collected PXRD files.
     """
-    import os
-    import fnmatch
+    def scan(directory):
+        files, subdirectories = [], []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                # like os.walk, do not descend into symlinked directories, which may form cycles or list files twice
+                if entry.is_dir(follow_symlinks=False):
+                    subdirectories.append(entry.path)
+                elif entry.name.endswith('.xyd'):
+                    files.append(entry.path)
+        return files, subdirectories
 
     pxrd_files = []
-    for root, dirs, files in os.walk(path):
-        for file in fnmatch.filter(files, '*.xyd'):
-            pxrd_files.append(os.path.join(root, file))
+    directories = [path]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while directories:
+            next_directories = []
+            for files, subdirectories in executor.map(scan, directories):
+                pxrd_files.extend(files)
+                next_directories.extend(subdirectories)
+            directories = next_directories
     return pxrd_files
 
-def collect_pxrd_files(path: str) -> List[PXRDFile]:
+def collect_pxrd_files(path: str, max_workers: int | None = None) -> List[PXRDFile]:
     """
     Collects all PXRD files from the given directory and its subdirectories.
 
     Args:
         path (str): The path to the directory to search for PXRD files.
+        max_workers (int | None): The number of threads listing directories.
 
     Returns:
         list: A list of PXRDFile objects representing the collected PXRD files.
     """
-    pxrd_files = collect_pxrd_file_paths(path)
+    pxrd_files = collect_pxrd_file_paths(path, max_workers)
     return [PXRDFile(pxrd_file) for pxrd_file in pxrd_files]
 
 
@@ -71,4 +132,76 @@ def filter_pxrd_files(experiment_id: str, all_pxrd_files: list) -> List[PXRDFile
         list: A list of PXRDFile objects representing the filtered PXRD files.
     """
     filtered_files = [pxrd_file for pxrd_file in all_pxrd_files if pxrd_file.experiment_id == experiment_id]
-    return filtered_files if len(filtered_files) > 0 else None
\ No newline at end of file
+    return filtered_files if len(filtered_files) > 0 else None
+
+
+class PXRDFileIndex:
+    """
+    Index of PXRD files, built once, mapping experiment IDs to their PXRD files with secondary keys for the
+    X-ray source and the sample holder. Looking up the files of an experiment is a dictionary access instead
+    of a scan over all files.
+    """
+
+    def __init__(self, pxrd_files: List[PXRDFile]):
+        """
+        Builds the index.
+
+        Args:
+            pxrd_files (list): A list of PXRDFile objects, e.g. the output of collect_pxrd_files.
+        """
+        self.by_experiment_id: dict[str, List[PXRDFile]] = {}
+        self.by_xray_source: dict[str, List[PXRDFile]] = {}
+        self.by_sample_holder: dict[tuple[str, str | None], List[PXRDFile]] = {}
+        for pxrd_file in pxrd_files:
+            self.add(pxrd_file)
+
+    def add(self, pxrd_file: PXRDFile):
+        """
+        Adds a PXRD file to the index.
+
+        Args:
+            pxrd_file (PXRDFile): The PXRD file to add.
+        """
+        self.by_experiment_id.setdefault(pxrd_file.experiment_id, []).append(pxrd_file)
+        self.by_xray_source.setdefault(pxrd_file.xray_source, []).append(pxrd_file)
+        sample_holder = (pxrd_file.sample_holder_shape, pxrd_file.sample_holder_diameter)
+        self.by_sample_holder.setdefault(sample_holder, []).append(pxrd_file)
+
+    def find(self, experiment_id: str | None = None, xray_source: str | None = None,
+             sample_holder_shape: str | None = None, sample_holder_diameter: str | None = None) -> List[PXRDFile] | None:
+        """
+        Finds the PXRD files matching all given keys.
+
+        Args:
+            experiment_id (str | None): The experiment ID, e.g. KE-232.
+            xray_source (str | None): The X-ray source, e.g. Co-Kα1.
+            sample_holder_shape (str | None): The sample holder shape, e.g. KAPTON_FILMS.
+            sample_holder_diameter (str | None): The sample holder diameter, e.g. 3mm. Only used together with the shape.
+
+        Returns:
+            list: A list of PXRDFile objects representing the matching PXRD files, or None if there are none.
+        """
+        candidates = None
+        if experiment_id is not None:
+            candidates = self.by_experiment_id.get(experiment_id, [])
+        elif xray_source is not None:
+            candidates = self.by_xray_source.get(xray_source, [])
+        elif sample_holder_shape is not None:
+            candidates = [
+                pxrd_file
+                for (shape, diameter), pxrd_files in self.by_sample_holder.items() if shape == sample_holder_shape
+                for pxrd_file in pxrd_files
+            ]
+        if candidates is None:
+            candidates = [pxrd_file for pxrd_files in self.by_experiment_id.values() for pxrd_file in pxrd_files]
+
+        matches = [
+            pxrd_file for pxrd_file in candidates
+            if (xray_source is None or pxrd_file.xray_source == xray_source)
+            and (sample_holder_shape is None or pxrd_file.sample_holder_shape == sample_holder_shape)
+            and (sample_holder_diameter is None or pxrd_file.sample_holder_diameter == sample_holder_diameter)
+        ]
+        return matches if len(matches) > 0 else None
+
+    def __len__(self):
+        return sum(len(pxrd_files) for pxrd_files in self.by_experiment_id.values())
@@ -0,0 +1,159 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import List
+
+from pxrd_collector import PXRDFile, collect_pxrd_file_paths
+from pxrd_reader import content_hash
+
+
+@dataclass
+class ManifestDelta:
+    """
+    The PXRD files that were added, changed or removed since the previous update of a manifest.
+    All paths are relative to the scanned directory.
+
+    The manifest is shared by all tools, so a delta only describes the changes since the last update by any of
+    them. Tools keeping their own results up to date compare the content hashes of the entries with those of
+    their results instead, see analysis/pxrd_peak_index.py.
+    """
+
+    added: list[str] = field(default_factory=list)
+    changed: list[str] = field(default_factory=list)
+    removed: list[str] = field(default_factory=list)
+
+    def __bool__(self):
+        return bool(self.added or self.changed or self.removed)
+
+    def __str__(self):
+        return f"{len(self.added)} added, {len(self.changed)} changed, {len(self.removed)} removed"
+
+
+class PXRDManifest:
+    """
+    Persisted manifest of the scanned PXRD files with their size, modification time, content hash and parsed
+    metadata. Updating the manifest only reads new or modified files, so repeated scans of a directory that
+    grows all day only cost a directory listing plus the work for the delta.
+    """
+
+    def __init__(self, manifest_path: str):
+        """
+        Loads the manifest from the given path, or starts an empty manifest if the file does not exist yet.
+
+        Args:
+            manifest_path (str): The path of the manifest JSON file, e.g. ../data/generated/pxrd_manifest.json.
+        """
+        self.manifest_path = manifest_path
+        self.source_dir: str | None = None
+        # relative path -> {"size", "mtime_ns", "content_hash", "metadata"}
+        self.entries: dict[str, dict] = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r') as f:
+                manifest = json.load(f)
+            self.source_dir = manifest["source_dir"]
+            self.entries = manifest["files"]
+
+    def update(self, source_dir: str, max_workers: int | None = None) -> ManifestDelta:
+        """
+        Scans the directory, updates the manifest for new, changed and deleted PXRD files and saves it.
+        Files whose size and modification time are unchanged are not read. Files that were touched but
+        have the same content hash are not reported as changed.
+
+        Args:
+            source_dir (str): The directory to scan for PXRD files, e.g. ../data/PXRD.
+            max_workers (int | None): The number of threads for listing directories and hashing files.
+
+        Returns:
+            ManifestDelta: The files added, changed and removed since the previous update.
+        """
+        if self.source_dir is not None and os.path.normpath(self.source_dir) != os.path.normpath(source_dir):
+            # the manifest describes another directory, start over
+            self.entries = {}
+        self.source_dir = source_dir
+
+        delta = ManifestDelta()
+        stats = {}
+        for path in collect_pxrd_file_paths(source_dir, max_workers):
+            relative_path = os.path.relpath(path, source_dir).replace(os.sep, "/")
+            stats[relative_path] = os.stat(path)
+
+        delta.removed = sorted(set(self.entries) - set(stats))
+        for relative_path in delta.removed:
+            del self.entries[relative_path]
+
+        modified = sorted(
+            relative_path for relative_path, stat in stats.items()
+            if relative_path not in self.entries
+            or (self.entries[relative_path]["size"], self.entries[relative_path]["mtime_ns"]) != (stat.st_size, stat.st_mtime_ns)
+        )
+
+        def hash_file(relative_path):
+            with open(self.path(relative_path), 'rb') as f:
+                return content_hash(f.read())
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            hashes = list(executor.map(hash_file, modified))
+
+        for relative_path, digest in zip(modified, hashes):
+            previous = self.entries.get(relative_path)
+            if previous is None:
+                delta.added.append(relative_path)
+            elif previous["content_hash"] != digest:
+                delta.changed.append(relative_path)
+            stat = stats[relative_path]
+            self.entries[relative_path] = {
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "content_hash": digest,
+                "metadata": self._parse_metadata(relative_path),
+            }
+
+        self.save()
+        return delta
+
+    def path(self, relative_path: str) -> str:
+        """
+        Returns the path of a manifest entry, joined with the scanned directory.
+        """
+        return os.path.join(self.source_dir, *relative_path.split("/"))
+
+    def pxrd_files(self, relative_paths: list[str] | None = None) -> List[PXRDFile]:
+        """
+        Returns PXRDFile objects built from the stored metadata, without parsing the file names again.
+
+        Args:
+            relative_paths (list[str] | None): The entries to return, e.g. the added files of a delta. If None, all entries are returned.
+
+        Returns:
+            list: A list of PXRDFile objects sorted by path. Files whose name did not follow the PXRD file name pattern are left out.
+        """
+        relative_paths = sorted(self.entries if relative_paths is None else relative_paths)
+        return [
+            PXRDFile.from_metadata(self.path(relative_path), self.entries[relative_path]["metadata"])
+            for relative_path in relative_paths
+            if self.entries[relative_path]["metadata"] is not None
+        ]
+
+    def save(self):
+        """
+        Saves the manifest.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(self.manifest_path)), exist_ok=True)
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"source_dir": self.source_dir, "files": self.entries}, f, indent=1, ensure_ascii=False)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _parse_metadata(self, relative_path: str) -> dict | None:
+        try:
+            pxrd_file = PXRDFile(self.path(relative_path))
+        except ValueError:
+            return None
+        return {attribute: getattr(pxrd_file, attribute) for attribute in PXRDFile.__slots__ if attribute != "path"}
+
+
+if __name__ == '__main__':
+    manifest = PXRDManifest(os.path.join('..', 'data', 'generated', 'pxrd_manifest.json'))
+    delta = manifest.update(os.path.join('..', 'data', 'PXRD'))
+    print(f"PXRD manifest updated: {delta}")
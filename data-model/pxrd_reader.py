@@ -0,0 +1,385 @@
+import hashlib
+import io
+import json
+import os
+import warnings
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+import numpy as np
+
+
+_WHITESPACE = np.frombuffer(b" \t\r\n\x0b\x0c", dtype=np.uint8)
+# mantissas with more digits can not be represented exactly as float
+_MAX_DIGITS = 15
+
+
+def _parse_fixed_width(content: bytes) -> np.ndarray | None:
+    """
+    Vectorized tokenizer for files in which every row has the same width and every column holds right-aligned,
+    unsigned decimals with a fixed number of decimal places, like the .xyd files written by our diffractometer.
+
+    The content is viewed as a matrix of characters, so each number is the dot product of its digits with the
+    place values of their columns. The integer mantissa is exact and divided once by a power of ten, which gives
+    the same correctly rounded result as np.loadtxt.
+
+    Returns:
+        np.ndarray | None: The parsed numbers with one column per field, or None if the content does not have
+        this layout.
+    """
+    if not content.endswith(b"\n"):
+        content += b"\n"
+    width = content.find(b"\n") + 1
+    if len(content) % width != 0:
+        return None
+    # one row per character column, so that every column of the file is contiguous in memory
+    columns = np.frombuffer(content, dtype=np.uint8).reshape(-1, width).T.copy()
+    column_min = columns.min(axis=1)
+    column_max = columns.max(axis=1)
+    if column_min[-1] != ord("\n") or column_max[-1] != ord("\n"):
+        return None
+
+    # columns holding nothing but whitespace separate the fields
+    separators = np.flatnonzero(column_max <= ord(" "))
+    uniform = column_min[separators] == column_max[separators]
+    if not np.all(np.isin(column_min[separators[uniform]], _WHITESPACE)) or \
+            not np.all(np.isin(columns[separators[~uniform]], _WHITESPACE)):
+        return None
+    used = np.ones(width, dtype=np.int8)
+    used[separators] = 0
+    edges = np.diff(used, prepend=np.int8(0), append=np.int8(0))
+
+    fields = []
+    for start, end in zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)):
+        is_dot = (column_min[start:end] == ord(".")) & (column_max[start:end] == ord("."))
+        is_digit = (column_min[start:end] >= ord("0")) & (column_max[start:end] <= ord("9"))
+        # numbers are right-aligned, so only the leading columns may contain spaces next to digits
+        padded = int(np.argmax(is_digit | is_dot))
+        if is_dot.sum() > 1 or not np.all((is_digit | is_dot)[padded:]) or end - start - is_dot.sum() > _MAX_DIGITS:
+            return None
+        characters = columns[start:end]
+        if padded > 0:
+            leading = characters[:padded]
+            is_space = leading == ord(" ")
+            if not np.all(is_space | ((leading >= ord("0")) & (leading <= ord("9")))) or \
+                    np.any(is_space[1:] > is_space[:-1]):
+                return None
+        # spaces and the dot count as zero, the dot column gets no place value
+        place_values = np.zeros(end - start)
+        place_values[~is_dot] = 10.0 ** np.arange(end - start - is_dot.sum() - 1, -1, -1)
+        mantissa = place_values @ (np.maximum(characters, ord("0")) - ord("0"))
+        fraction_digits = end - start - 1 - int(np.argmax(is_dot)) if is_dot.any() else 0
+        fields.append(mantissa / 10.0 ** fraction_digits)
+    return np.column_stack(fields) if fields else None
+
+
+def parse_xyd(content: bytes) -> np.ndarray:
+    """
+    Parses the content of a two-column .xyd file (angle, CPS intensity).
+
+    Args:
+        content (bytes): The raw content of the PXRD file.
+
+    Returns:
+        np.ndarray: An array of shape (N, 2) with the angle in the first and the intensity in the second column.
+
+    Raises:
+        ValueError: If the content is not made of two numeric columns.
+    """
+    data = _parse_fixed_width(content)
+    if data is None:
+        with warnings.catch_warnings():
+            # an empty file is reported below
+            warnings.simplefilter("ignore", UserWarning)
+            data = np.loadtxt(io.StringIO(content.decode("utf-8")), ndmin=2)
+    if data.size == 0:
+        raise ValueError("The file contains no data")
+    if data.shape[1] != 2:
+        raise ValueError(f"Expected two columns, got {data.shape[1]}")
+    return data
+
+
+def content_hash(content: bytes) -> str:
+    """
+    Computes the hash under which the parsed content of a PXRD file is cached.
+
+    Args:
+        content (bytes): The raw content of the PXRD file.
+
+    Returns:
+        str: The hex digest of the content.
+    """
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+
+class XYDCache:
+    """
+    Cache for parsed PXRD patterns, keyed by the hash of the file content.
+
+    The most recently used patterns are kept in memory and, if a cache directory is given, all of them are
+    stored as binary .npy files, so that each file is parsed only once, even across restarts. For patterns loaded
+    by path, the modification time and size of the file are remembered in an index, so that unchanged files are
+    not even read again. The index is written by flush(), which is called on close() and when leaving a with block.
+    """
+
+    INDEX_FILE_NAME = "index.json"
+
+    def __init__(self, cache_dir: str | None = None, max_entries: int = 4096):
+        """
+        Initializes the cache.
+
+        Args:
+            cache_dir (str | None): Directory for the binary cache files. If None, patterns are only cached in memory.
+            max_entries (int): The maximum number of patterns kept in memory.
+        """
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self._patterns: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._index_dirty = False
+        # absolute path -> (mtime in ns, size, content hash)
+        self._file_stats: dict[str, tuple[int, int, str]] = {}
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            index_path = os.path.join(cache_dir, self.INDEX_FILE_NAME)
+            if os.path.exists(index_path):
+                with open(index_path, 'r') as f:
+                    self._file_stats = {path: tuple(stat) for path, stat in json.load(f).items()}
+
+    def load_bytes(self, content: bytes, digest: str | None = None) -> np.ndarray:
+        """
+        Returns the parsed pattern of the given file content, parsing it only if it is not cached yet.
+
+        Args:
+            content (bytes): The raw content of the PXRD file.
+            digest (str | None): The content hash, if already known.
+
+        Returns:
+            np.ndarray: The read-only parsed pattern of shape (N, 2).
+        """
+        digest = digest or content_hash(content)
+        pattern = self._load_cached(digest)
+        if pattern is None:
+            pattern = self._store(digest, parse_xyd(content))
+        return pattern
+
+    def load_path(self, path: str) -> np.ndarray:
+        """
+        Returns the parsed pattern of the given PXRD file. The cached pattern is invalidated as soon as the
+        modification time, size or content hash of the file changes.
+
+        Args:
+            path (str): The path to the PXRD file.
+
+        Returns:
+            np.ndarray: The read-only parsed pattern of shape (N, 2).
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        cached_stat = self._file_stats.get(path)
+        if cached_stat and cached_stat[:2] == (stat.st_mtime_ns, stat.st_size):
+            pattern = self._load_cached(cached_stat[2])
+            if pattern is not None:
+                return pattern
+
+        with open(path, 'rb') as f:
+            content = f.read()
+        digest = content_hash(content)
+        pattern = self.load_bytes(content, digest)
+        self._file_stats[path] = (stat.st_mtime_ns, stat.st_size, digest)
+        self._index_dirty = True
+        return pattern
+
+    def load_paths(self, paths: list[str]) -> list[np.ndarray]:
+        """
+        Returns the parsed patterns of the given PXRD files, writing the index once for the whole batch.
+
+        Args:
+            paths (list[str]): The paths to the PXRD files.
+
+        Returns:
+            list[np.ndarray]: The read-only parsed patterns in the order of the given paths.
+        """
+        try:
+            return [self.load_path(path) for path in paths]
+        finally:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the index of file modification times to the cache directory, if it changed since the last flush.
+        """
+        if self._index_dirty and self.cache_dir:
+            index_path = os.path.join(self.cache_dir, self.INDEX_FILE_NAME)
+            tmp_path = index_path + ".tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(self._file_stats, f)
+            os.replace(tmp_path, index_path)
+        self._index_dirty = False
+
+    def close(self):
+        """
+        Flushes the index. The cache can still be used afterwards.
+        """
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def clear(self):
+        """
+        Removes all cached patterns from memory and disk.
+        """
+        self._patterns.clear()
+        self._file_stats.clear()
+        self._index_dirty = False
+        if self.cache_dir:
+            for file_name in os.listdir(self.cache_dir):
+                if file_name.endswith(".npy") or file_name == self.INDEX_FILE_NAME:
+                    os.remove(os.path.join(self.cache_dir, file_name))
+
+    def _load_cached(self, digest: str) -> np.ndarray | None:
+        if digest in self._patterns:
+            self._patterns.move_to_end(digest)
+            return self._patterns[digest]
+        if self.cache_dir:
+            cache_path = os.path.join(self.cache_dir, digest + ".npy")
+            if os.path.exists(cache_path):
+                pattern = np.load(cache_path)
+                self._remember(digest, pattern)
+                return pattern
+        return None
+
+    def _remember(self, digest: str, pattern: np.ndarray):
+        pattern.setflags(write=False)
+        self._patterns[digest] = pattern
+        if len(self._patterns) > self.max_entries:
+            self._patterns.popitem(last=False)
+
+    def _store(self, digest: str, pattern: np.ndarray) -> np.ndarray:
+        self._remember(digest, pattern)
+        if self.cache_dir:
+            # write to a temporary file first, so that an interrupted write never leaves a corrupt cache entry
+            cache_path = os.path.join(self.cache_dir, digest + ".npy")
+            tmp_path = cache_path + ".tmp"
+            with open(tmp_path, 'wb') as f:
+                np.save(f, pattern)
+            os.replace(tmp_path, cache_path)
+        return pattern
+
+
+@dataclass
+class PXRDPatternStack:
+    """
+    Patterns of many PXRD files stacked into one contiguous array.
+
+    Pattern i occupies the rows offsets[i]:offsets[i + 1] of data. Files that could not be read are listed in
+    errors with the reason and are not part of the stack.
+    """
+
+    paths: list[str]
+    offsets: np.ndarray
+    data: np.ndarray
+    errors: dict[str, str] = field(default_factory=dict)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def pattern(self, index: int) -> np.ndarray:
+        """
+        Returns the pattern of the file at the given index as a view of shape (N, 2) into the stack.
+        """
+        return self.data[self.offsets[index]:self.offsets[index + 1]]
+
+    def lengths(self) -> np.ndarray:
+        """
+        Returns the number of points of every pattern.
+        """
+        return np.diff(self.offsets)
+
+    def to_matrix(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the patterns as a 2-D intensity matrix, given that all of them share the same angle grid.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: The shared angles of shape (M,) and the intensities of shape (N, M).
+
+        Raises:
+            ValueError: If the patterns do not share the same angle grid.
+        """
+        lengths = self.lengths()
+        if len(self) == 0 or np.any(lengths != lengths[0]):
+            raise ValueError("The patterns do not share the same angle grid")
+        stacked = self.data.reshape(len(self), lengths[0], 2)
+        angle = stacked[0, :, 0]
+        if not np.all(stacked[:, :, 0] == angle):
+            raise ValueError("The patterns do not share the same angle grid")
+        return angle, stacked[:, :, 1]
+
+    def to_polars(self):
+        """
+        Returns the patterns as a long polars DataFrame with the columns path, angle and intensity.
+        """
+        import polars as pl
+
+        return pl.DataFrame({
+            "path": pl.Series(self.paths, dtype=pl.Categorical).gather(np.repeat(np.arange(len(self)), self.lengths())),
+            "angle": self.data[:, 0],
+            "intensity": self.data[:, 1],
+        })
+
+
+def read_pxrd_file(path: str) -> np.ndarray:
+    """
+    Reads and parses a single PXRD file.
+
+    Args:
+        path (str): The path to the PXRD file.
+
+    Returns:
+        np.ndarray: The parsed pattern of shape (N, 2).
+    """
+    with open(path, 'rb') as f:
+        return parse_xyd(f.read())
+
+
+def read_pxrd_files(paths: str | list[str], max_workers: int | None = None) -> PXRDPatternStack:
+    """
+    Reads and parses many PXRD files in parallel into one stack. Malformed or unreadable files are reported in
+    the errors of the stack instead of aborting the batch.
+
+    Args:
+        paths (str | list[str]): A directory to search for PXRD files, or a list of paths, e.g. the output of
+            collect_pxrd_file_paths.
+        max_workers (int | None): The number of reader threads. If None, the default of ThreadPoolExecutor is used.
+
+    Returns:
+        PXRDPatternStack: The stacked patterns in the order of the given paths.
+    """
+    if isinstance(paths, str):
+        from pxrd_collector import collect_pxrd_file_paths
+        paths = sorted(collect_pxrd_file_paths(paths))
+
+    def read(path):
+        try:
+            return read_pxrd_file(path), None
+        except (OSError, ValueError, UnicodeDecodeError) as e:
+            return None, f"{type(e).__name__}: {e}"
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(read, paths))
+
+    read_paths, patterns, errors = [], [], {}
+    for path, (pattern, error) in zip(paths, results):
+        if error is None:
+            read_paths.append(path)
+            patterns.append(pattern)
+        else:
+            errors[path] = error
+    offsets = np.zeros(len(patterns) + 1, dtype=np.int64)
+    np.cumsum([len(pattern) for pattern in patterns], out=offsets[1:])
+    data = np.concatenate(patterns) if patterns else np.empty((0, 2))
+    return PXRDPatternStack(read_paths, offsets, data, errors)
@@ -11,12 +11,33 @@ from sciformation_cleaned_utils import find_reaction_components, get_inchi, form
     format_mass, format_amount
 from sciformation_cleaner import clean_sciformation_eln
 from utils import load_json, save_json
-from pxrd_collector import collect_pxrd_files, filter_pxrd_files
+from pxrd_collector import PXRDFileIndex
+from pxrd_manifest import ManifestDelta, PXRDManifest
 
 
-def convert_cleaned_eln_to_jxdl(eln: SciformationCleanedELNSchema, default_code: str = "KE", split_procedure_in_sections: bool = True) -> JXDLSchema:
+def update_pxrd_manifest() -> tuple[PXRDManifest, ManifestDelta]:
+    """
+    Updates the PXRD manifest, so that only PXRD files added or changed since the last run are read and hashed.
+
+    Only this scan is incremental: the conversion still indexes the metadata of all files in the manifest and
+    rebuilds the JXDL of every experiment, which does not read any PXRD file. The delta is informational.
+
+    Returns:
+        tuple[PXRDManifest, ManifestDelta]: The updated manifest and the files added, changed and removed since its
+        previous update.
+    """
+    pxrd_manifest = PXRDManifest(os.path.join('..', 'data', 'generated', 'pxrd_manifest.json'))
+    delta = pxrd_manifest.update(os.path.join('..', 'data', 'PXRD'))
+    return pxrd_manifest, delta
+
+
+def convert_cleaned_eln_to_jxdl(eln: SciformationCleanedELNSchema, default_code: str = "KE", split_procedure_in_sections: bool = True,
+                                pxrd_index: PXRDFileIndex | None = None) -> JXDLSchema:
     synthesis_list: List[Synthesis] = []
-    pxrd_files = collect_pxrd_files(os.path.join('..', 'data', 'PXRD'))
+    # index the PXRD files once, so that finding the files of an experiment does not scan all files
+    if pxrd_index is None:
+        pxrd_manifest, _ = update_pxrd_manifest()
+        pxrd_index = PXRDFileIndex(pxrd_manifest.pxrd_files())
 
     for experiment in eln.experiments:
         reaction_product = find_reaction_components(experiment, RxnRole.PRODUCT)[0]
@@ -35,7 +56,7 @@ def convert_cleaned_eln_to_jxdl(eln: SciformationCleanedELNSchema, default_code:
             x_ray_source=None
         )]
 
-        experiment_pxrd_files = filter_pxrd_files(experiment_id, pxrd_files)
+        experiment_pxrd_files = pxrd_index.find(experiment_id)
         if experiment_pxrd_files:
             for pxrd_file in experiment_pxrd_files:
                 x_ray_source = XRaySource[pxrd_file.xray_source.replace(" ", "_").replace("-", "_").upper()]
@@ -165,7 +186,13 @@ if __name__ == '__main__':
     # Validate data according to schema
     validate(instance=cleaned_eln, schema=load_json(os.path.join('schemas', 'sciformation_eln_cleaned.schema.json')))
 
-    jxdl = convert_cleaned_eln_to_jxdl(SciformationCleanedELNSchema.from_dict(cleaned_eln))
+    pxrd_manifest, delta = update_pxrd_manifest()
+    # only reported, the JXDL of all experiments is rebuilt from the manifest below
+    if delta:
+        print(f"PXRD files: {delta}")
+    jxdl = convert_cleaned_eln_to_jxdl(
+        SciformationCleanedELNSchema.from_dict(cleaned_eln), pxrd_index=PXRDFileIndex(pxrd_manifest.pxrd_files())
+    )
     result_file_path = os.path.join('..', 'data', 'generated', 'jxdl.json')
     result_dict = jxdl.to_dict()
     print("JXDL Result: " + str(result_dict))
@@ -0,0 +1,258 @@
+import copy
+import functools
+import json
+import math
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+from pxrd_collector import PXRDFileIndex, collect_pxrd_files
+from pxrd_reader import read_pxrd_file
+from sciformation_cleaner import rxnRoleMapping
+from utils import load_json
+
+# The raw rxnRole numbers of the cleaned roles. Acids and catalysts are reagents or solvents in the export, the
+# cleaner derives their roles from the sum formula again.
+RXN_ROLE_NUMBERS = {role: number for number, role in rxnRoleMapping.items()} | {"acid": 2, "catalyst": 2}
+
+# The reaction properties of the cleaned experiments, exported as elnReactionPropertyCollection
+REACTION_PROPERTIES = ["duration", "temperature"]
+
+# The effective counting time per point of the generated scans, in s, as estimated from the noise of our scans
+COUNTING_TIME = 200
+
+
+def template_experiment_id(experiment: dict, default_code: str = "KE") -> str:
+    """
+    Returns the experiment ID of a cleaned experiment, as in sciformation2jxdl.convert_cleaned_eln_to_jxdl.
+    """
+    return experiment.get("code", default_code) + "-" + str(experiment["nrInLabJournal"]).zfill(3)
+
+
+@functools.cache
+def load_templates(cleaned_eln_path: str, pxrd_dir: str | None) -> tuple[list[dict], dict, list]:
+    """
+    Loads the real experiments the synthetic ones are built from, with their PXRD scans.
+
+    Args:
+        cleaned_eln_path (str): The cleaned ELN, e.g. ../data/generated/sciformation_eln_cleaned.json.
+        pxrd_dir (str | None): The directory with the PXRD files of the experiments. If None, no scans are loaded.
+
+    Returns:
+        tuple[list[dict], dict, list]: The cleaned experiments, the scans of every experiment ID as tuples of the
+        file name after the experiment ID and the pattern, and the blanks as tuples of file name and content.
+    """
+    experiments = load_json(cleaned_eln_path)["experiments"]
+    scans, blanks = {}, []
+    if pxrd_dir is not None:
+        pxrd_files = collect_pxrd_files(pxrd_dir)
+        index = PXRDFileIndex(pxrd_files)
+        for experiment in experiments:
+            experiment_id = template_experiment_id(experiment)
+            scans[experiment_id] = [
+                (os.path.basename(pxrd_file.path)[len("PXRD_" + experiment_id):], read_pxrd_file(pxrd_file.path))
+                for pxrd_file in index.find(experiment_id) or []
+            ]
+        for pxrd_file in index.find("Blank") or []:
+            with open(pxrd_file.path, 'rb') as f:
+                blanks.append((os.path.basename(pxrd_file.path), f.read()))
+    return experiments, scans, blanks
+
+
+def raw_component(component: dict, scale: float) -> dict:
+    """
+    Converts a cleaned reaction component back into an elnReactionComponentCollection entry, with the amounts
+    multiplied by the scale of the synthetic reaction.
+    """
+    raw = copy.deepcopy(component)
+    raw["rxnRole"] = RXN_ROLE_NUMBERS[component["rxnRole"]]
+    for key in ["mass", "volume", "amount"]:
+        if key in raw:
+            raw[key] *= scale
+    # the export has every attribute of a component, the cleaner drops the empty ones
+    return raw | {"casNr": raw.get("casNr"), "measured": None, "cdbMolecule": None}
+
+
+def raw_experiment(template: dict, code: str, nr: int, started: datetime, rng: np.random.Generator) -> dict:
+    """
+    Builds a raw Sciformation export entry from a cleaned template experiment. The procedure texts, the reaction
+    conditions and the reagents are those of the template, the scale of the reaction and the yield vary.
+
+    Args:
+        template (dict): The cleaned template experiment.
+        code (str): The lab journal code of the synthetic experiments.
+        nr (int): The number of the experiment in the lab journal.
+        started (datetime): The start of the reaction.
+        rng (np.random.Generator): The random generator.
+
+    Returns:
+        dict: The raw entry, see sciformation_cleaner.clean_sciformation_eln.
+    """
+    template_id, experiment_id = template_experiment_id(template), f"{code}-{str(nr).zfill(3)}"
+    scale, product_yield = rng.uniform(0.5, 2.0), rng.uniform(0.5, 1.2)
+    components = []
+    for component in template["reactionComponents"]:
+        raw = raw_component(component, scale * product_yield if component["rxnRole"] == "product" else scale)
+        # the product is named after its experiment, e.g. KE-008 with the entry KE-008-A
+        for key in ["moleculeName", "labNotebookEntryAndRole"]:
+            if key in raw and raw[key].startswith(template_id):
+                raw[key] = experiment_id + raw[key][len(template_id):]
+        components.append(raw)
+    return {
+        "@id": nr,
+        "nrInLabJournal": nr,
+        "code": code,
+        "creator": template["creator"],
+        "modifier": None,
+        "reactionTitle": experiment_id,
+        "reactionStartedWhen": int(started.timestamp() * 1000),
+        "realizationText": template["realizationText"],
+        "observationText": template["observationText"],
+        "elnReactionPropertyCollection": [
+            {"name": name, "strValue": template[name]} for name in REACTION_PROPERTIES if name in template
+        ],
+        "elnReactionComponentCollection": components,
+    }
+
+
+def _fixed_width(values: np.ndarray, width: int, decimals: int) -> np.ndarray:
+    # the characters of right-aligned, non-negative decimals, one row per value; the first character is always a
+    # space, so that neighbouring fields stay separated
+    largest = 10 ** (width - 2) - 1
+    mantissa = np.clip(np.rint(np.asarray(values) * 10 ** decimals), 0, largest).astype(np.int64)
+    places = 10 ** np.arange(width - 2, -1, -1, dtype=np.int64)
+    digits = (mantissa[:, np.newaxis] // places) % 10 + ord("0")
+    # leading zeros of the integer part become spaces, its last digit is kept
+    leading = (mantissa[:, np.newaxis] < places) & (places > 10 ** decimals)
+    digits[leading] = ord(" ")
+    return np.insert(digits, width - 1 - decimals, ord("."), axis=1).astype(np.uint8)
+
+
+def format_xyd(pattern: np.ndarray) -> bytes:
+    """
+    Formats a pattern in the fixed-width layout of the .xyd files written by our diffractometer, e.g.
+    "    1.500   11.6377" with CRLF line endings.
+    """
+    return np.hstack([
+        _fixed_width(pattern[:, 0], 9, 3),
+        _fixed_width(pattern[:, 1], 10, 4),
+        np.tile(np.frombuffer(b"\r\n", dtype=np.uint8), (len(pattern), 1)),
+    ]).tobytes()
+
+
+def vary_pattern(pattern: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """
+    Returns a new measurement of a pattern: the intensity scaled as by a different amount of sample, with new
+    counting noise.
+    """
+    expected = np.clip(pattern[:, 1], 0, None) * rng.uniform(0.8, 1.25) * COUNTING_TIME
+    return np.column_stack([pattern[:, 0], rng.poisson(expected) / COUNTING_TIME])
+
+
+def generate_shard(
+    shard: int,
+    start: int,
+    stop: int,
+    output_dir: str,
+    code: str,
+    seed: np.random.SeedSequence,
+    cleaned_eln_path: str,
+    pxrd_dir: str | None,
+) -> tuple[int, int]:
+    """
+    Writes the raw export of the experiments start to stop - 1 (numbers in the lab journal start + 1 to stop) and
+    their PXRD scans. The export is written entry by entry, so memory does not grow with the size of the shard.
+
+    Returns:
+        tuple[int, int]: The numbers of experiments and PXRD files written.
+    """
+    templates, scans, _ = load_templates(cleaned_eln_path, pxrd_dir)
+    rng = np.random.default_rng(seed)
+    first_start = datetime.strptime(min(template["reactionStartedWhen"] for template in templates), "%Y-%m-%d %H:%M:%S.%f")
+    shard_pxrd_dir = os.path.join(output_dir, "PXRD", f"shard-{shard:04d}")
+    if pxrd_dir is not None:
+        os.makedirs(shard_pxrd_dir, exist_ok=True)
+
+    n_scans = 0
+    with open(os.path.join(output_dir, f"Sciformation_{code}_jsonRaw_{shard:04d}.json"), 'w') as f:
+        f.write("[")
+        for nr in range(start + 1, stop + 1):
+            template = templates[rng.integers(len(templates))]
+            # a few experiments are started every day
+            started = datetime.fromtimestamp(first_start.timestamp() + nr * 8 * 3600 + rng.uniform(0, 4 * 3600))
+            experiment = raw_experiment(template, code, nr, started, rng)
+            f.write(("\n" if nr == start + 1 else ",\n") + json.dumps(experiment, ensure_ascii=False))
+            for suffix, pattern in scans.get(template_experiment_id(template), []):
+                file_name = f"PXRD_{experiment['reactionTitle']}{suffix}"
+                with open(os.path.join(shard_pxrd_dir, file_name), 'wb') as pxrd_file:
+                    pxrd_file.write(format_xyd(vary_pattern(pattern, rng)))
+                n_scans += 1
+        f.write("\n]\n")
+    return stop - start, n_scans
+
+
+def generate_synthetic_dataset(
+    output_dir: str,
+    n_experiments: int,
+    cleaned_eln_path: str,
+    pxrd_dir: str | None,
+    code: str = "SY",
+    shard_size: int = 10000,
+    seed: int = 0,
+    max_workers: int | None = None,
+) -> tuple[int, int]:
+    """
+    Generates a synthetic Sciformation export and matching PXRD files for load testing, built from the real
+    experiments of the cleaned ELN. Every synthetic experiment copies the procedure, the conditions and the reagents
+    of a random real experiment at a different scale, and gets new measurements of its PXRD scans, named according
+    to the PXRD file name pattern with the new experiment ID. The blanks are copied as they are.
+
+    The export is split into shards of shard_size experiments, Sciformation_{code}_jsonRaw_{shard}.json, each one
+    readable by clean_sciformation_eln. The scans of a shard are written to PXRD/shard-{shard}, the blanks to PXRD.
+    The shards are generated in parallel, the result does not depend on the number of processes.
+
+    Args:
+        output_dir (str): The output directory.
+        n_experiments (int): The number of experiments, e.g. 10^3 to 10^6.
+        cleaned_eln_path (str): The cleaned ELN with the template experiments.
+        pxrd_dir (str | None): The PXRD files of the template experiments. If None, no PXRD files are written.
+        code (str): The lab journal code of the synthetic experiments, their IDs are e.g. SY-001.
+        shard_size (int): The number of experiments per export file.
+        seed (int): The seed of the generator.
+        max_workers (int | None): The number of processes. If None, all cores are used.
+
+    Returns:
+        tuple[int, int]: The numbers of experiments and PXRD files written.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    _, _, blanks = load_templates(cleaned_eln_path, pxrd_dir)
+    if pxrd_dir is not None:
+        os.makedirs(os.path.join(output_dir, "PXRD"), exist_ok=True)
+        for file_name, content in blanks:
+            with open(os.path.join(output_dir, "PXRD", file_name), 'wb') as f:
+                f.write(content)
+
+    n_shards = math.ceil(n_experiments / shard_size)
+    seeds = np.random.SeedSequence(seed).spawn(n_shards)
+    arguments = [
+        (shard, shard * shard_size, min((shard + 1) * shard_size, n_experiments), output_dir, code, seeds[shard],
+         cleaned_eln_path, pxrd_dir)
+        for shard in range(n_shards)
+    ]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(generate_shard, *zip(*arguments)))
+    return sum(result[0] for result in results), sum(result[1] for result in results) + len(blanks)
+
+
+if __name__ == '__main__':
+    # The number of experiments can be given as argument, e.g. python synthetic_dataset_generator.py 1000000
+    n_experiments = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    cleaned_eln_path = os.path.join('..', 'data', 'generated', 'sciformation_eln_cleaned.json')
+    pxrd_dir = os.path.join('..', 'data', 'PXRD')
+    output_dir = os.path.join('..', 'data', 'generated', 'synthetic')
+
+    n_written, n_scans = generate_synthetic_dataset(output_dir, n_experiments, cleaned_eln_path, pxrd_dir)
+    print(f"Generated {n_written} experiments and {n_scans} PXRD files in {output_dir}")
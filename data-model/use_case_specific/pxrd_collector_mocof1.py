@@ -1,3 +1,5 @@
 def process_pxrd_file_use_case_specific(pxrd_file):
+    if pxrd_file.sample_holder_shape is None:
+        return
     pxrd_file.sample_holder_shape = pxrd_file.sample_holder_shape.replace("film", "KAPTON_FILMS").replace("capillary",
                                                                           "HILGENBERG_GLASS_NO_14_CAPILLARY")
\ No newline at end of file